@@ -0,0 +1,184 @@
+"""A small persistent cache of Plaid account metadata per item.
+
+Syncs, --show-accounts and the link server's item health check all start with an
+/accounts/get call per item. AccountsCache keeps what those calls return (each
+account's type, subtype, mask, names and balances, the item's institution and
+products, and whether the item needs a new login) in a JSON file for a
+configurable time, so that a fresh entry saves the round trip. It is enabled by
+giving a TTL in seconds in the config file (the path is optional):
+
+    [PLAID]
+    accounts_cache_ttl = 3600
+    accounts_cache = ~/.cache/plaid2text/accounts.json
+
+Entries are also refreshed whenever another call returns the item's accounts
+(/transactions/sync and /investments/transactions/get do), though only
+/accounts/get renews their TTL. They are keyed by item ID together with a hash of
+the access token, so a new access token never sees the old token's entry. Syncs
+don't cache an item's login-required status, so an item that recovers is synced
+again right away.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_PATH = "~/.cache/plaid2text/accounts.json"
+
+
+def _text(value) -> Optional[str]:
+    # Plaid SDK enums (AccountType, Products, ...) print as their value
+    return str(value) if value is not None else None
+
+
+def _number(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def account_metadata(account) -> Dict[str, object]:
+    """The cached fields of an account from a Plaid response, as plain JSON values."""
+    if hasattr(account, "to_dict"):
+        # The SDK's composed models (e.g. InvestmentAccount) can't be read field by field
+        account = account.to_dict()
+    balances = account.get("balances") or {}
+    return {
+        "account_id": account["account_id"],
+        "name": account.get("name"),
+        "official_name": account.get("official_name"),
+        "type": _text(account.get("type")),
+        "subtype": _text(account.get("subtype")),
+        "mask": account.get("mask"),
+        "balances": {
+            "current": _number(balances.get("current")),
+            "available": _number(balances.get("available")),
+            "limit": _number(balances.get("limit")),
+            "iso_currency_code": balances.get("iso_currency_code"),
+        },
+    }
+
+
+def item_metadata(item) -> Dict[str, object]:
+    return {
+        "item_id": item.get("item_id"),
+        "institution_id": item.get("institution_id"),
+        "available_products": [_text(product) for product in item.get("available_products") or []],
+        "billed_products": [_text(product) for product in item.get("billed_products") or []],
+        "update_type": _text(item.get("update_type")),
+    }
+
+
+class AccountsCache:
+    """Account metadata per item, persisted to a JSON file with a TTL.
+
+    get() returns a fresh entry, a dict with "accounts", "item" (possibly None),
+    "login_required" and "fetched_at", or None. Updates are written through to
+    the file atomically; the cache may be shared between threads.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            # A missing or unreadable cache is an empty one
+            pass
+
+    @classmethod
+    def from_config(cls, config) -> Optional["AccountsCache"]:
+        """The cache configured in the [PLAID] section, or None without a positive TTL."""
+        section = config["PLAID"] if config.has_section("PLAID") else {}
+        ttl = float(section.get("accounts_cache_ttl", 0))
+        if ttl <= 0:
+            return None
+        return cls(section.get("accounts_cache", DEFAULT_PATH), ttl)
+
+    @staticmethod
+    def _token(access_token: str) -> str:
+        return hashlib.sha256(access_token.encode()).hexdigest()
+
+    def get(self, item_id: str, access_token: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(item_id)
+            if (entry is None or entry["token"] != self._token(access_token)
+                    or time.time() - entry["fetched_at"] >= self.ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def store(self, item_id: str, access_token: str, accounts: List, item=None, merge: bool = False,
+              renew: bool = True):
+        """Cache the accounts (and item) from a successful Plaid response.
+
+        With merge, accounts the response does not list are kept, for responses
+        that may only cover some of the item's accounts. Without renew, an existing
+        entry keeps its fetch time, so responses other than /accounts/get refresh it
+        without keeping it alive past its TTL.
+        """
+        token = self._token(access_token)
+        metadata = [account_metadata(account) for account in accounts]
+        with self._lock:
+            previous = self._entries.get(item_id)
+            if previous is not None and previous["token"] != token:
+                previous = None
+            if merge and previous is not None:
+                listed = {account["account_id"] for account in metadata}
+                metadata = [account for account in previous["accounts"] if account["account_id"] not in listed] + metadata
+            if item is not None:
+                item = item_metadata(item)
+            elif previous is not None:
+                item = previous.get("item")
+            fetched_at = time.time()
+            if not renew and previous is not None and not previous["login_required"]:
+                fetched_at = previous["fetched_at"]
+            self._entries[item_id] = {
+                "token": token,
+                "fetched_at": fetched_at,
+                "login_required": False,
+                "accounts": metadata,
+                "item": item,
+            }
+            self._save()
+
+    def store_response(self, item_id: str, access_token: str, response):
+        """Refresh the item's entry from any other response that lists its accounts."""
+        accounts = response.get("accounts") if hasattr(response, "get") else None
+        if accounts:
+            self.store(item_id, access_token, accounts, response.get("item"), merge=True, renew=False)
+
+    def mark_login_required(self, item_id: str, access_token: str):
+        with self._lock:
+            self._entries[item_id] = {
+                "token": self._token(access_token),
+                "fetched_at": time.time(),
+                "login_required": True,
+                "accounts": [],
+                "item": None,
+            }
+            self._save()
+
+    def invalidate(self, item_id: str):
+        with self._lock:
+            if self._entries.pop(item_id, None) is not None:
+                self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".accounts", suffix=".tmp")
+        try:
+            with open(fd, "w") as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
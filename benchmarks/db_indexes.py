@@ -0,0 +1,147 @@
+"""Time the transactions app's account/date queries before and after the 0005 indexes.
+
+Builds a throwaway SQLite database migrated to 0004, fills it with synthetic
+transactions, times the queries transaction_filter and update_beancount run,
+then applies 0005 and times them again:
+
+    python benchmarks/db_indexes.py --rows 300000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+
+def _setup_django(database_path):
+    settings.configure(
+        INSTALLED_APPS=["django.contrib.contenttypes", "django.contrib.auth", "transactions"],
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": database_path}},
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+        USE_TZ=False,
+    )
+    django.setup()
+
+
+def _populate(rows, account_count, seed=0):
+    from transactions.models import (
+        Account,
+        PlaidInvestmentTransaction,
+        PlaidInvestmentTransactionType,
+        PlaidItem,
+        PlaidSecurity,
+        PlaidTransaction,
+    )
+
+    rng = random.Random(seed)
+    item = PlaidItem.objects.create(item_id="item", access_token="token")
+    accounts = Account.objects.bulk_create([
+        Account(plaid_id=f"account-{i}", name=f"Account {i}", item=item) for i in range(account_count)
+    ])
+    security = PlaidSecurity.objects.create(security_id="fund", name="Fund", type="etf", is_cash_equivalent=False)
+    buy = PlaidInvestmentTransactionType.objects.create(type="buy", subtype="buy")
+    first_day = date(2015, 1, 1)
+
+    PlaidTransaction.objects.bulk_create((
+        PlaidTransaction(
+            transaction_id=f"txn-{i}",
+            account=rng.choice(accounts),
+            date=first_day + timedelta(days=rng.randrange(3650)),
+            name="PAYEE",
+            amount=Decimal("12.34"),
+            pending=rng.random() < 0.02,
+        )
+        for i in range(rows)
+    ), batch_size=5000)
+    PlaidInvestmentTransaction.objects.bulk_create((
+        PlaidInvestmentTransaction(
+            investment_transaction_id=f"inv-{i}",
+            account=rng.choice(accounts),
+            date=first_day + timedelta(days=rng.randrange(3650)),
+            name="BUY FUND",
+            quantity=Decimal("1.000"),
+            price=Decimal("100.00"),
+            amount=Decimal("100.00"),
+            security=security,
+            type=buy,
+        )
+        for i in range(rows // 4)
+    ), batch_size=5000)
+    return [account.pk for account in accounts]
+
+
+def _queries(account_ids):
+    """The filters transaction_filter and update_beancount run, for one account each."""
+    from transactions.models import PlaidInvestmentTransaction, PlaidTransaction
+
+    start, end, since = date(2020, 1, 1), date(2020, 12, 31), date(2024, 6, 1)
+    return {
+        "transaction_filter (transactions)": lambda account: PlaidTransaction.objects.filter(
+            account=account, pending=False, date__gte=start, date__lte=end),
+        "transaction_filter (investments)": lambda account: PlaidInvestmentTransaction.objects.filter(
+            account=account, date__gte=start, date__lte=end),
+        "update_beancount (transactions)": lambda account: PlaidTransaction.objects.filter(
+            account=account, pending=False, date__gt=since).order_by("date"),
+        "update_beancount (investments)": lambda account: PlaidInvestmentTransaction.objects.filter(
+            account=account, date__gt=since).order_by("date"),
+    }
+
+
+def _time_queries(account_ids, repeat):
+    results = {}
+    for name, query in _queries(account_ids).items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for account in account_ids:
+                # Fetch narrow rows so the timing is the query, not model instantiation
+                list(query(account).values_list("id", "date"))
+            timings.append(time.perf_counter() - started)
+        plan = query(account_ids[0]).explain()
+        results[name] = (statistics.median(timings) / len(account_ids), plan)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300000, help="number of bank transactions (default: 300000)")
+    parser.add_argument("--accounts", type=int, default=20, help="number of accounts (default: 20)")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions per query (default: 5)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _setup_django(os.path.join(temp_dir, "benchmark.sqlite3"))
+        from django.core.management import call_command
+        from django.db import connection
+
+        call_command("migrate", "transactions", "0004", verbosity=0)
+        print(f"Populating {args.rows} transactions and {args.rows // 4} investment transactions...")
+        account_ids = _populate(args.rows, args.accounts)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        before = _time_queries(account_ids, args.repeat)
+        call_command("migrate", "transactions", "0005", verbosity=0)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        after = _time_queries(account_ids, args.repeat)
+
+    print(f"\n{'query':36} {'before (ms)':>12} {'after (ms)':>12} {'speedup':>8}")
+    for name, (seconds, _) in before.items():
+        after_seconds = after[name][0]
+        print(f"{name:36} {seconds * 1000:12.2f} {after_seconds * 1000:12.2f} {seconds / after_seconds:7.1f}x")
+    for name in before:
+        print(f"\n{name}\n  before: {before[name][1]}\n  after:  {after[name][1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Synthetic ledgers and Plaid responses for the benchmarks.
+
+Everything is generated from a seed, so two runs with the same parameters (and
+two commits being compared) see exactly the same data.
+"""
+import os
+import random
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+PAYEES = [
+    "STARBUCKS", "DUNKIN", "WHOLE FOODS", "TRADER JOES", "SAFEWAY", "SHELL", "CHEVRON", "AMAZON",
+    "TARGET", "COSTCO", "UBER", "LYFT", "NETFLIX", "SPOTIFY", "COMCAST", "PG&E", "CVS", "WALGREENS",
+    "HOME DEPOT", "LOWES", "CHIPOTLE", "SWEETGREEN", "APPLE", "DELTA", "UNITED", "HILTON", "AIRBNB",
+]
+
+CATEGORIES = [
+    ("FOOD_AND_DRINK", "FOOD_AND_DRINK_COFFEE", "Expenses:Food:Coffee"),
+    ("FOOD_AND_DRINK", "FOOD_AND_DRINK_GROCERIES", "Expenses:Food:Groceries"),
+    ("FOOD_AND_DRINK", "FOOD_AND_DRINK_RESTAURANT", "Expenses:Food:Restaurants"),
+    ("TRANSPORTATION", "TRANSPORTATION_GAS", "Expenses:Auto:Gas"),
+    ("TRANSPORTATION", "TRANSPORTATION_TAXIS_AND_RIDE_SHARES", "Expenses:Transport:Rideshare"),
+    ("GENERAL_MERCHANDISE", "GENERAL_MERCHANDISE_ONLINE_MARKETPLACES", "Expenses:Shopping:Online"),
+    ("GENERAL_MERCHANDISE", "GENERAL_MERCHANDISE_SUPERSTORES", "Expenses:Shopping:General"),
+    ("ENTERTAINMENT", "ENTERTAINMENT_TV_AND_MOVIES", "Expenses:Entertainment:Streaming"),
+    ("RENT_AND_UTILITIES", "RENT_AND_UTILITIES_GAS_AND_ELECTRICITY", "Expenses:Utilities:Electric"),
+    ("TRAVEL", "TRAVEL_FLIGHTS", "Expenses:Travel:Flights"),
+]
+
+SECURITIES = ["VTSAX", "VTIAX", "VBTLX", "VMFXX", "AAPL", "MSFT"]
+
+INVESTMENT_TYPES = [
+    ("buy", "buy", "BUY"),
+    ("sell", "sell", "SELL"),
+    ("cash", "dividend", "DIVIDEND"),
+    ("transfer", "transfer", "Sweep in"),
+    ("transfer", "transfer", "Sweep out"),
+]
+
+
+@dataclass
+class SyntheticAccount:
+    beancount_name: str
+    plaid_account_id: str
+    item_id: str
+    access_token: str
+    transaction_file: str
+    type: str = "depository"
+
+
+@dataclass
+class SyntheticLedger:
+    root_file: str
+    accounts: List[SyntheticAccount]
+    payee_rules: Dict[str, str]
+    entries: int
+    last_date: date
+    items: Dict[str, str] = field(default_factory=dict)  # item_id -> access_token
+
+
+def _amount(rng: random.Random) -> Decimal:
+    return Decimal(rng.randrange(100, 20000)) / 100
+
+
+def generate_ledger(directory: str, accounts: int = 10, payee_rules: int = 50, years: int = 3,
+                    entries_per_day: int = 1, accounts_per_item: int = 3, end: Optional[date] = None,
+                    seed: int = 0) -> SyntheticLedger:
+    """Write a root ledger with `accounts` Plaid accounts, `payee_rules` payee rules and
+    `years` of history per account, each account in its own transaction file.
+
+    Every accounts_per_item accounts share a Plaid item; the last account of each item
+    is an investment account. Existing entries are categorized by Plaid category only,
+    so the payee rules give --recategorize real work to do.
+    """
+    rng = random.Random(seed)
+    end = end or date(2025, 12, 31)
+    start = end - timedelta(days=365 * years)
+    os.makedirs(directory, exist_ok=True)
+
+    ledger_accounts = []
+    items = {}
+    for i in range(accounts):
+        item_index = i // accounts_per_item
+        item_id = f"item-{item_index}"
+        access_token = f"access-synthetic-{item_index}"
+        items[item_id] = access_token
+        institution = f"Bank{item_index}"
+        is_investment = (i % accounts_per_item == accounts_per_item - 1)
+        name = f"Brokerage{i}" if is_investment else f"Checking{i}"
+        ledger_accounts.append(SyntheticAccount(
+            beancount_name=f"Assets:{institution}:{name}",
+            plaid_account_id=f"account-{i}",
+            item_id=item_id,
+            access_token=access_token,
+            transaction_file=f"accounts/{institution}/{name}.beancount",
+            type="investment" if is_investment else "depository",
+        ))
+
+    # Payee rules cover about half the payees the ledger uses: real payees first, then
+    # synthetic ones so any number of rules can exist
+    payees = PAYEES + [f"MERCHANT {n}" for n in range(max(0, 2 * payee_rules - len(PAYEES)))]
+    rule_payees = payees[:payee_rules]
+    rules = {payee: f"Expenses:Payees:{payee.title().replace(' ', '').replace('&', '')}" for payee in rule_payees}
+
+    lines = ['option "operating_currency" "USD"\n\n', '2000-01-01 open Expenses:Unknown\n']
+    for _, detailed, expense_account in CATEGORIES:
+        lines.append(f'2000-01-01 open {expense_account}\n  plaid_category: "{detailed}"\n')
+    for payee, expense_account in rules.items():
+        lines.append(f'2000-01-01 open {expense_account}\n  payees: "{payee}"\n')
+    for account in ledger_accounts:
+        lines.append(
+            f'2000-01-01 open {account.beancount_name}\n'
+            f'  plaid_account_id: "{account.plaid_account_id}"\n'
+            f'  plaid_item_id: "{account.item_id}"\n'
+            f'  plaid_access_token: "{account.access_token}"\n'
+            f'  transaction_file: "{account.transaction_file}"\n'
+        )
+    lines.append("\n")
+
+    entries = 0
+    days = (end - start).days
+    for index, account in enumerate(ledger_accounts):
+        path = os.path.join(directory, account.transaction_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        account_lines = []
+        for day in range(days):
+            entry_date = start + timedelta(days=day)
+            for n in range(entries_per_day):
+                payee = rng.choice(payees)
+                _, detailed, expense_account = rng.choice(CATEGORIES)
+                amount = _amount(rng)
+                account_lines.append(
+                    f'{entry_date} * "{payee}" "{payee}"\n'
+                    f'  plaid_transaction_id: "ledger-{index}-{day}-{n}"\n'
+                    f'  plaid_category_detailed: "{detailed}"\n'
+                    f'  {account.beancount_name}  -{amount} USD\n'
+                    f'  {expense_account}  {amount} USD\n\n'
+                )
+                entries += 1
+        with open(path, "w") as f:
+            f.writelines(account_lines)
+        lines.append(f'include "{account.transaction_file}"\n')
+
+    root_file = os.path.join(directory, "root.beancount")
+    with open(root_file, "w") as f:
+        f.writelines(lines)
+    return SyntheticLedger(root_file=root_file, accounts=ledger_accounts, payee_rules=rules,
+                           entries=entries, last_date=end - timedelta(days=1), items=items)
+
+
+def _plaid_transaction(rng: random.Random, transaction_id: str, account: SyntheticAccount, day: date) -> dict:
+    payee = rng.choice(PAYEES)
+    primary, detailed, _ = rng.choice(CATEGORIES)
+    return {
+        "transaction_id": transaction_id,
+        "account_id": account.plaid_account_id,
+        "date": day,
+        "datetime": None,
+        "authorized_date": day,
+        "authorized_datetime": None,
+        "name": payee,
+        "merchant_name": payee.title(),
+        "website": None,
+        "amount": _amount(rng),
+        "iso_currency_code": "USD",
+        "check_number": None,
+        "pending": rng.random() < 0.02,
+        "personal_finance_category": {
+            "primary": primary,
+            "detailed": detailed,
+            "confidence_level": rng.choice(["VERY_HIGH", "HIGH", "MEDIUM"]),
+        },
+    }
+
+
+def transactions_sync_pages(ledger: SyntheticLedger, transactions: int = 5000, page_size: int = 500,
+                            duplicate_fraction: float = 0.1, seed: int = 1) -> Dict[str, List[dict]]:
+    """/transactions/sync responses per access token, `transactions` in total.
+
+    New transactions are dated after the ledger's last entry; duplicate_fraction of
+    them re-send transactions the ledger already has, to exercise dedup.
+    """
+    rng = random.Random(seed)
+    bank_accounts = [account for account in ledger.accounts if account.type != "investment"]
+    by_token: Dict[str, List[dict]] = {token: [] for token in ledger.items.values()}
+    for n in range(transactions):
+        account = rng.choice(bank_accounts)
+        if rng.random() < duplicate_fraction:
+            index = ledger.accounts.index(account)
+            transaction = _plaid_transaction(rng, f"ledger-{index}-{rng.randrange(365)}-0", account,
+                                             ledger.last_date - timedelta(days=rng.randrange(30)))
+        else:
+            transaction = _plaid_transaction(rng, f"sync-{n}", account,
+                                             ledger.last_date + timedelta(days=1 + rng.randrange(60)))
+        by_token[account.access_token].append(transaction)
+
+    pages = {}
+    for token, added in by_token.items():
+        chunks = [added[i:i + page_size] for i in range(0, len(added), page_size)] or [[]]
+        pages[token] = [
+            {
+                "added": chunk,
+                "modified": [],
+                "removed": [],
+                "has_more": i < len(chunks) - 1,
+                "next_cursor": f"cursor-{i + 1}",
+            }
+            for i, chunk in enumerate(chunks)
+        ]
+    return pages
+
+
+def investments_transactions_pages(ledger: SyntheticLedger, transactions: int = 1000, page_size: int = 500,
+                                   seed: int = 2) -> Dict[str, List[dict]]:
+    """/investments/transactions/get responses per access token, paginated by offset."""
+    rng = random.Random(seed)
+    investment_accounts = [account for account in ledger.accounts if account.type == "investment"]
+    securities = [
+        {
+            "security_id": f"security-{ticker}",
+            "name": f"{ticker} Fund",
+            "ticker_symbol": ticker,
+            "type": "mutual fund",
+            "market_identifier_code": None,
+            "is_cash_equivalent": ticker == "VMFXX",
+            "isin": None,
+            "cusip": None,
+            "iso_currency_code": "USD",
+        }
+        for ticker in SECURITIES
+    ]
+    by_token: Dict[str, List[dict]] = {token: [] for token in ledger.items.values()}
+    for n in range(transactions if investment_accounts else 0):
+        account = rng.choice(investment_accounts)
+        type_, subtype, name = rng.choice(INVESTMENT_TYPES)
+        price = _amount(rng)
+        quantity = Decimal(rng.randrange(1, 1000)) / 10
+        by_token[account.access_token].append({
+            "investment_transaction_id": f"investment-{n}",
+            "account_id": account.plaid_account_id,
+            "security_id": rng.choice(securities)["security_id"],
+            "date": ledger.last_date + timedelta(days=1 + rng.randrange(60)),
+            "name": name,
+            "quantity": quantity,
+            "price": price,
+            "amount": (quantity * price).quantize(Decimal("0.01")),
+            "fees": None,
+            "cancel_transaction_id": None,
+            "iso_currency_code": "USD",
+            "type": type_,
+            "subtype": subtype,
+        })
+
+    pages = {}
+    for token, investment_transactions in by_token.items():
+        item_accounts = [
+            {"account_id": account.plaid_account_id, "type": account.type}
+            for account in ledger.accounts if account.access_token == token
+        ]
+        chunks = [investment_transactions[i:i + page_size]
+                  for i in range(0, len(investment_transactions), page_size)] or [[]]
+        pages[token] = [
+            {
+                "accounts": item_accounts,
+                "securities": securities,
+                "investment_transactions": chunk,
+                "total_investment_transactions": len(investment_transactions),
+            }
+            for chunk in chunks
+        ]
+    return pages
+
+
+class SyntheticPlaidApi:
+    """Serves generated pages through the PlaidApi methods the code under test calls."""
+
+    def __init__(self, ledger: SyntheticLedger, sync_pages: Dict[str, List[dict]],
+                 investment_pages: Dict[str, List[dict]]):
+        self.ledger = ledger
+        self.sync_pages = sync_pages
+        self.investment_pages = investment_pages
+        self.requests = 0
+
+    def accounts_get(self, request):
+        self.requests += 1
+        return {"accounts": [
+            {"account_id": account.plaid_account_id, "type": account.type}
+            for account in self.ledger.accounts if account.access_token == request.access_token
+        ]}
+
+    def transactions_sync(self, request):
+        self.requests += 1
+        pages = self.sync_pages.get(request.access_token) or [
+            {"added": [], "modified": [], "removed": [], "has_more": False, "next_cursor": "cursor-0"}
+        ]
+        # Cursors are "cursor-<next page>"; an empty cursor starts from the first page
+        index = int(request.cursor.split("-")[1]) if request.cursor else 0
+        if index >= len(pages):
+            return {"added": [], "modified": [], "removed": [], "has_more": False, "next_cursor": request.cursor}
+        return pages[index]
+
+    def investments_transactions_get(self, request):
+        self.requests += 1
+        pages = self.investment_pages.get(request.access_token) or [
+            {"accounts": [], "securities": [], "investment_transactions": [], "total_investment_transactions": 0}
+        ]
+        offset = request.options.offset if "options" in request else 0
+        page_size = len(pages[0]["investment_transactions"]) or 1
+        index = offset // page_size
+        if index >= len(pages):
+            return {**pages[0], "investment_transactions": []}
+        return pages[index]
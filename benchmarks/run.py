@@ -0,0 +1,310 @@
+"""Run timed scenarios against synthetic ledgers and Plaid responses and emit JSON.
+
+Scenarios cover the sync (fetch and convert), the sync's write and dedup into
+account files, scanning account files for existing transactions, recategorize,
+rendering and the Django app's fetch. Each run is written as JSON so results
+can be compared between commits:
+
+    python benchmarks/run.py --output before.json
+    git checkout other-branch
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import generators  # noqa: E402
+
+RESULTS_VERSION = 1
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Fixture:
+    """A generated ledger plus the Plaid responses served against it.
+
+    The pristine ledger is generated once; scenarios that modify files get a fresh
+    copy per run, made outside the timed section.
+    """
+
+    def __init__(self, directory, args):
+        self.directory = directory
+        self.args = args
+        self.ledger = generators.generate_ledger(
+            os.path.join(directory, "pristine"), accounts=args.accounts, payee_rules=args.payee_rules,
+            years=args.years, seed=args.seed,
+        )
+        self.sync_pages = generators.transactions_sync_pages(
+            self.ledger, transactions=args.transactions, seed=args.seed + 1)
+        self.investment_pages = generators.investments_transactions_pages(
+            self.ledger, transactions=args.investment_transactions, seed=args.seed + 2)
+        self.copies = 0
+
+    def client(self):
+        return generators.SyntheticPlaidApi(self.ledger, self.sync_pages, self.investment_pages)
+
+    def fresh_root(self):
+        """Copy the pristine ledger and return the copy's root file."""
+        self.copies += 1
+        target = os.path.join(self.directory, f"run-{self.copies}")
+        shutil.copytree(os.path.dirname(self.ledger.root_file), target)
+        return os.path.join(target, "root.beancount")
+
+
+def _scenario_sync(fixture):
+    import main
+
+    client = fixture.client()
+    root_file = fixture.ledger.root_file
+
+    def run(_):
+        transactions, _ = main._update_transactions(client, root_file)
+        investment_transactions = main._update_investments(client, root_file)
+        return len(transactions) + len(investment_transactions)
+
+    return None, run
+
+
+def _scenario_write_dedup(fixture):
+    import main
+
+    config_file = os.path.join(fixture.directory, "config")
+    with open(config_file, "w") as f:
+        f.write("[PLAID]\nclient_id = benchmark\nsecret = benchmark\n")
+
+    def run(root_file):
+        argv = ["main.py", "--sync-transactions", "--root-file", root_file, "--config-file", config_file]
+        with mock.patch.object(main, "_plaid_client", return_value=fixture.client()), \
+                mock.patch.object(sys, "argv", argv):
+            main.main()
+        return fixture.args.transactions + fixture.args.investment_transactions
+
+    return fixture.fresh_root, run
+
+
+def _scenario_dedup_scan(fixture):
+    import main
+
+    base_dir = os.path.dirname(fixture.ledger.root_file)
+    paths = [os.path.join(base_dir, account.transaction_file) for account in fixture.ledger.accounts]
+
+    def run(_):
+        return sum(len(main._existing_plaid_transactions(path)[1]) for path in paths)
+
+    return None, run
+
+
+def _scenario_recategorize_plan(fixture):
+    import main
+
+    def run(_):
+        return sum(len(plan.changes) for plan in main._plan_recategorization(fixture.ledger.root_file))
+
+    return None, run
+
+
+def _scenario_recategorize_write(fixture):
+    import main
+
+    return fixture.fresh_root, main._recategorize_transactions
+
+
+def _scenario_render(fixture):
+    import main
+    from transactions.beancount_renderer import BeancountRenderer
+
+    client = fixture.client()
+    transactions, _ = main._update_transactions(client, fixture.ledger.root_file)
+    investment_transactions = main._update_investments(client, fixture.ledger.root_file)
+
+    def run(_):
+        return len(BeancountRenderer(transactions, investment_transactions).print())
+
+    return None, run
+
+
+def _setup_django():
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        settings.configure(
+            INSTALLED_APPS=["django.contrib.contenttypes", "django.contrib.auth", "transactions"],
+            DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+            DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+            USE_TZ=False,
+        )
+        django.setup()
+        from django.core.management import call_command
+        call_command("migrate", verbosity=0)
+
+
+def _scenario_django_fetch(fixture):
+    _setup_django()
+    from transactions.models import (
+        Account,
+        FinanceCategory,
+        PlaidInvestmentTransaction,
+        PlaidItem,
+        PlaidTransaction,
+    )
+    from transactions.plaid_fetch import fetch_investments, fetch_transactions
+
+    def setup():
+        # Every run starts from an empty database with just the items
+        for model in (PlaidInvestmentTransaction, PlaidTransaction, Account, FinanceCategory, PlaidItem):
+            model.objects.all().delete()
+        PlaidItem.objects.bulk_create([
+            PlaidItem(item_id=item_id, access_token=access_token)
+            for item_id, access_token in fixture.ledger.items.items()
+        ])
+
+    def run(_):
+        client = fixture.client()
+        # The fetchers report progress with print
+        with contextlib.redirect_stdout(io.StringIO()):
+            transactions = fetch_transactions(client)
+            investment_transactions = fetch_investments(client, start_date=fixture.ledger.last_date)
+        return len(transactions) + len(investment_transactions)
+
+    return setup, run
+
+
+# name -> factory(fixture) returning (per-run setup or None, run(setup result) -> item count)
+SCENARIOS = {
+    "sync": _scenario_sync,
+    "write_dedup": _scenario_write_dedup,
+    "dedup_scan": _scenario_dedup_scan,
+    "recategorize_plan": _scenario_recategorize_plan,
+    "recategorize_write": _scenario_recategorize_write,
+    "render": _scenario_render,
+    "django_fetch": _scenario_django_fetch,
+}
+
+
+def _time_scenario(factory, fixture, repeat):
+    setup, run = factory(fixture)
+    timings = []
+    items = None
+    for _ in range(repeat):
+        prepared = setup() if setup else None
+        started = time.perf_counter()
+        items = run(prepared)
+        timings.append(time.perf_counter() - started)
+    return {
+        "median_seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "runs": timings,
+        "items": items,
+    }
+
+
+def run_benchmarks(args):
+    """Run the selected scenarios and return the results document."""
+    # The code under test logs every file it touches
+    logging.disable(logging.CRITICAL)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = Fixture(directory, args)
+        for name in args.only or SCENARIOS:
+            try:
+                results[name] = _time_scenario(SCENARIOS[name], fixture, args.repeat)
+            except ImportError as e:
+                results[name] = {"skipped": str(e)}
+            print(f"{name}: {_describe(results[name])}", file=sys.stderr)
+        ledger_entries = fixture.ledger.entries
+    logging.disable(logging.NOTSET)
+
+    return {
+        "version": RESULTS_VERSION,
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "accounts": args.accounts,
+            "payee_rules": args.payee_rules,
+            "years": args.years,
+            "ledger_entries": ledger_entries,
+            "transactions": args.transactions,
+            "investment_transactions": args.investment_transactions,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "scenarios": results,
+    }
+
+
+def _describe(result):
+    if "skipped" in result:
+        return f"skipped ({result['skipped']})"
+    return f"{result['median_seconds'] * 1000:.1f} ms median over {len(result['runs'])} runs"
+
+
+def compare(baseline, current):
+    """Lines comparing each scenario's median against a baseline results document."""
+    lines = [f"{'scenario':20} {'baseline (ms)':>14} {'current (ms)':>14} {'change':>8}"]
+    if baseline.get("parameters") != current.get("parameters"):
+        lines.append("warning: the runs used different parameters")
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if "skipped" in result or not before or "skipped" in before:
+            continue
+        old, new = before["median_seconds"], result["median_seconds"]
+        lines.append(f"{name:20} {old * 1000:14.1f} {new * 1000:14.1f} {(new - old) / old:+8.0%}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=10, help="Plaid accounts in the ledger (default: 10)")
+    parser.add_argument("--payee-rules", type=int, default=50, help="payee rules in the ledger (default: 50)")
+    parser.add_argument("--years", type=int, default=3, help="years of entries per account (default: 3)")
+    parser.add_argument("--transactions", type=int, default=2000,
+                        help="transactions served by /transactions/sync (default: 2000)")
+    parser.add_argument("--investment-transactions", type=int, default=500,
+                        help="transactions served by /investments/transactions/get (default: 500)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per scenario (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated data (default: 0)")
+    parser.add_argument("--only", action="append", choices=list(SCENARIOS),
+                        help="run only this scenario (can be given more than once)")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against an earlier JSON results file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, results)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
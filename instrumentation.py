@@ -0,0 +1,533 @@
+"""Lightweight per-phase timing and counters for sync and recategorize runs.
+
+Code marks its phases and counts what it processes through the module-level
+`profiler`:
+
+    with profiler.phase("render"):
+        entries = [...]
+    profiler.count("entries_rendered", len(entries))
+
+Phases nest, and are reported by their path (e.g. "fetch_transactions/load_ledger")
+with call counts, wall time and CPU time. The profiler is disabled unless enable()
+is called (main.py's --profile); disabled, phase() returns a shared no-op context
+manager and count() returns immediately, so instrumented code costs next to nothing.
+
+The profiler is meant to be driven from one thread; counters can be bumped from others.
+
+Plaid API calls are accounted separately: wrapping a PlaidApi client in
+InstrumentedPlaidApi records each request's latency, response size and error code
+per endpoint and per item in an ApiStats.
+
+PrometheusTextfile writes metrics for node-exporter's textfile collector.
+
+With enable(memory=True), each top-level phase is also bracketed by tracemalloc
+snapshots, and the report gains the peak RSS, the traced peak and the top
+allocation sites of each phase. Tracing slows everything down considerably, so
+the timings of a memory-profiled run are not representative.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional
+
+_NO_PHASE = nullcontext()
+
+
+class PhaseStats:
+    __slots__ = ("calls", "wall_seconds", "cpu_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"calls": self.calls, "wall_seconds": self.wall_seconds, "cpu_seconds": self.cpu_seconds}
+
+
+class _Phase:
+    __slots__ = ("_profiler", "_name", "_stats", "_wall", "_cpu")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        stack = self._profiler._stack
+        stack.append(self._name)
+        # Registered on entry, so the report lists phases in the order they started
+        path = "/".join(stack)
+        self._stats = self._profiler.phases.get(path)
+        if self._stats is None:
+            self._stats = self._profiler.phases[path] = PhaseStats()
+        if self._profiler.memory is not None and len(stack) == 1:
+            self._profiler.memory.phase_started()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stats.wall_seconds += time.perf_counter() - self._wall
+        self._stats.cpu_seconds += time.process_time() - self._cpu
+        self._stats.calls += 1
+        if self._profiler.memory is not None and len(self._profiler._stack) == 1:
+            self._profiler.memory.phase_finished(self._name)
+        self._profiler._stack.pop()
+        return False
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    """The process's peak resident set size so far, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# tracemalloc's own bookkeeping and the import machinery are noise in the snapshots
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class MemoryStats:
+    """tracemalloc snapshots around the top-level phases of a run.
+
+    For each phase this records the peak RSS once it finished, the peak of traced
+    memory during it, how much traced memory it left behind, and the allocation
+    sites that grew the most. A phase that runs more than once keeps the call with
+    the highest traced peak. Sites are grouped by their innermost `frames` frames,
+    and reported innermost first, so that allocations made inside the standard
+    library or the Plaid SDK can be traced back to the code that caused them.
+    """
+
+    def __init__(self, top: int = 10, frames: int = 4):
+        self.top = top
+        self.frames = frames
+        self.phases: Dict[str, Dict[str, object]] = {}
+        self._before: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    def phase_started(self):
+        self._before = self._snapshot()
+        tracemalloc.reset_peak()
+
+    def phase_finished(self, name: str):
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        after = self._snapshot()
+        differences = after.compare_to(self._before, "traceback" if self.frames > 1 else "lineno")
+        self._before = None
+
+        previous = self.phases.get(name)
+        calls = previous["calls"] + 1 if previous else 1
+        if previous and previous["traced_peak_bytes"] >= traced_peak:
+            previous["calls"] = calls
+            return
+        self.phases[name] = {
+            "calls": calls,
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "traced_bytes": traced,
+            "traced_peak_bytes": traced_peak,
+            "retained_bytes": sum(difference.size_diff for difference in differences),
+            "top_allocations": [
+                {
+                    "site": [f"{frame.filename}:{frame.lineno}" for frame in reversed(difference.traceback)],
+                    "size_bytes": difference.size,
+                    "size_diff_bytes": difference.size_diff,
+                    "count": difference.count,
+                    "count_diff": difference.count_diff,
+                }
+                for difference in differences[:self.top]
+            ],
+        }
+
+    def report(self) -> Dict[str, object]:
+        return {
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "traced_peak_bytes": max((phase["traced_peak_bytes"] for phase in self.phases.values()), default=0),
+            "phases": {name: dict(phase) for name, phase in self.phases.items()},
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, PhaseStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.labeled_counters: Dict[str, Dict[str, int]] = {}
+        self.gauges: Dict[str, Dict[str, float]] = {}
+        self.sections: Dict[str, Callable[[], Dict[str, object]]] = {}
+        self.memory: Optional[MemoryStats] = None
+        self._stack: List[str] = []
+        self._lock = threading.Lock()
+        self._started_wall = 0.0
+        self._started_cpu = 0.0
+
+    def enable(self, memory: bool = False):
+        """Start recording, discarding anything recorded before.
+
+        With memory, top-level phases are also traced with tracemalloc (see MemoryStats).
+        """
+        if self.memory is not None:
+            self.memory.stop()
+        self.memory = None
+        if memory:
+            self.memory = MemoryStats()
+            self.memory.start()
+        self.phases = {}
+        self.counters = {}
+        self.labeled_counters = {}
+        self.gauges = {}
+        self._stack = []
+        self._started_wall = time.perf_counter()
+        self._started_cpu = time.process_time()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.memory is not None:
+            self.memory.stop()
+
+    def phase(self, name: str):
+        """Context manager timing one call of a phase, nested under the current phase."""
+        if not self.enabled:
+            return _NO_PHASE
+        return _Phase(self, name)
+
+    def count(self, name: str, n: int = 1, label: Optional[str] = None):
+        """Add n to a counter, e.g. entries processed or bytes written.
+
+        With a label (an item ID, a file), the count is also kept per label.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            if label is not None:
+                by_label = self.labeled_counters.setdefault(name, {})
+                by_label[label] = by_label.get(label, 0) + n
+
+    def gauge(self, name: str, label: str, value: float):
+        """Record a value per label, e.g. each item's cursor age."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges.setdefault(name, {})[label] = value
+
+    def add_section(self, name: str, report: Callable[[], Dict[str, object]]):
+        """Include report()'s result under name in the profile report."""
+        self.sections[name] = report
+
+    def report(self) -> Dict[str, object]:
+        report = {
+            "wall_seconds": time.perf_counter() - self._started_wall,
+            "cpu_seconds": time.process_time() - self._started_cpu,
+            "phases": {path: stats.to_dict() for path, stats in self.phases.items()},
+            "counters": dict(self.counters),
+            "labeled_counters": {name: dict(by_label) for name, by_label in self.labeled_counters.items()},
+            "gauges": {name: dict(by_label) for name, by_label in self.gauges.items()},
+        }
+        if self.memory is not None:
+            report["memory"] = self.memory.report()
+        for name, section in self.sections.items():
+            report[name] = section()
+        return report
+
+    def write_report(self, destination: Optional[str] = None):
+        """Write the report as JSON to a file, or to stdout for None or "-"."""
+        text = json.dumps(self.report(), indent=2) + "\n"
+        if destination in (None, "-"):
+            sys.stdout.write(text)
+        else:
+            with open(destination, "w") as f:
+                f.write(text)
+
+
+# Upper bounds, in seconds, of the Plaid request latency histogram's buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class RequestStats:
+    """Requests, errors, retries, latency and response sizes for one endpoint or item."""
+
+    __slots__ = ("requests", "errors", "retries", "seconds", "response_bytes", "latency_buckets", "error_codes")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.response_bytes = 0
+        # One count per bucket in LATENCY_BUCKETS, plus one for slower requests
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.error_codes: Dict[str, int] = {}
+
+    def record(self, seconds: float, response_bytes: Optional[int], error_code: Optional[str], retry: bool):
+        self.requests += 1
+        self.seconds += seconds
+        self.response_bytes += response_bytes or 0
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        self.latency_buckets[bucket] += 1
+        if retry:
+            self.retries += 1
+        if error_code is not None:
+            self.errors += 1
+            self.error_codes[error_code] = self.error_codes.get(error_code, 0) + 1
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "seconds": self.seconds,
+            "mean_seconds": self.seconds / self.requests if self.requests else 0.0,
+            "response_bytes": self.response_bytes,
+            "latency_histogram": {
+                **{f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)},
+                "le_inf": self.latency_buckets[-1],
+            },
+            "error_codes": dict(self.error_codes),
+        }
+
+
+def _error_code(e: Exception) -> str:
+    """Plaid's error_code for an ApiException, else its HTTP status or exception type."""
+    body = getattr(e, "body", None)
+    if body:
+        try:
+            error_code = json.loads(body).get("error_code")
+        except (TypeError, ValueError, AttributeError):
+            error_code = None
+        if error_code:
+            return error_code
+    status = getattr(e, "status", None)
+    return f"HTTP {status}" if status else type(e).__name__
+
+
+class ApiStats:
+    """Plaid API call accounting, per endpoint and per item.
+
+    Requests carry access tokens rather than item IDs, so items are identified
+    through register_item() or learned from responses that include the item.
+    A request is counted as a retry when the previous request to the same
+    endpoint for the same item failed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded requests and items."""
+        with self._lock:
+            self.endpoints: Dict[str, RequestStats] = {}
+            self.items: Dict[str, RequestStats] = {}
+            self.item_ids: Dict[str, str] = {}
+            self.institutions: Dict[str, str] = {}
+            self._failed = set()
+
+    def register_item(self, access_token: str, item_id: str, institution_id: Optional[str] = None):
+        with self._lock:
+            self.item_ids[access_token] = item_id
+            if institution_id:
+                self.institutions[item_id] = institution_id
+
+    def record(self, endpoint: str, access_token: Optional[str], seconds: float,
+               response_bytes: Optional[int] = None, error_code: Optional[str] = None, response=None):
+        item = response.get("item") if response is not None and hasattr(response, "get") else None
+        if item is not None and access_token:
+            self.register_item(access_token, item.get("item_id"), item.get("institution_id"))
+
+        with self._lock:
+            item_id = self.item_ids.get(access_token, "unknown")
+            key = (endpoint, item_id)
+            retry = key in self._failed
+            if error_code is None:
+                self._failed.discard(key)
+            else:
+                self._failed.add(key)
+            for stats, name in ((self.endpoints, endpoint), (self.items, item_id)):
+                if name not in stats:
+                    stats[name] = RequestStats()
+                stats[name].record(seconds, response_bytes, error_code, retry)
+
+    @property
+    def requests(self) -> int:
+        return sum(stats.requests for stats in self.endpoints.values())
+
+    @property
+    def seconds(self) -> float:
+        return sum(stats.seconds for stats in self.endpoints.values())
+
+    def slowest_institutions(self, limit: int = 5) -> List[Dict[str, object]]:
+        """Items by mean request latency, slowest first."""
+        ranked = sorted(self.items.items(), key=lambda item: item[1].seconds / item[1].requests, reverse=True)
+        return [
+            {
+                "item_id": item_id,
+                "institution_id": self.institutions.get(item_id),
+                "requests": stats.requests,
+                "seconds": stats.seconds,
+                "mean_seconds": stats.seconds / stats.requests,
+            }
+            for item_id, stats in ranked[:limit]
+        ]
+
+    def report(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "seconds": self.seconds,
+                "endpoints": {name: stats.to_dict() for name, stats in self.endpoints.items()},
+                "items": {
+                    item_id: {"institution_id": self.institutions.get(item_id), **stats.to_dict()}
+                    for item_id, stats in self.items.items()
+                },
+                "slowest_institutions": self.slowest_institutions(),
+            }
+
+    def summary_lines(self) -> List[str]:
+        """A human-readable summary: totals, then each endpoint and the slowest institutions."""
+        if not self.requests:
+            return ["Plaid API: no requests"]
+        errors = sum(stats.errors for stats in self.endpoints.values())
+        lines = [f"Plaid API: {self.requests} requests ({errors} failed) in {self.seconds:.2f}s"]
+        for name, stats in self.endpoints.items():
+            lines.append(f"  {name}: {stats.requests} requests, {stats.seconds:.2f}s, "
+                         f"{stats.response_bytes} bytes, {stats.retries} retries"
+                         + (f", errors {stats.error_codes}" if stats.error_codes else ""))
+        lines.append("  slowest institutions:")
+        for item in self.slowest_institutions():
+            name = item["institution_id"] or item["item_id"]
+            lines.append(f"    {name}: {item['mean_seconds'] * 1000:.0f} ms mean over {item['requests']} requests")
+        return lines
+
+
+class InstrumentedPlaidApi:
+    """Wraps a PlaidApi client, recording every endpoint call in an ApiStats.
+
+    Anything else is passed through to the wrapped client. Response sizes come
+    from the SDK's last raw response, so they are approximate when one client
+    is shared between threads.
+    """
+
+    def __init__(self, client, stats: Optional[ApiStats] = None):
+        self._client = client
+        self.stats = stats if stats is not None else plaid_api_stats
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def call(request=None, *args, **kwargs):
+            access_token = request.get("access_token") if hasattr(request, "get") else None
+            started = time.perf_counter()
+            try:
+                response = attribute(request, *args, **kwargs) if request is not None else attribute(*args, **kwargs)
+            except Exception as e:
+                self.stats.record(name, access_token, time.perf_counter() - started, error_code=_error_code(e))
+                raise
+            self.stats.record(name, access_token, time.perf_counter() - started, self._response_bytes(), response=response)
+            return response
+
+        return call
+
+    def _response_bytes(self) -> Optional[int]:
+        last_response = getattr(getattr(self._client, "api_client", None), "last_response", None)
+        data = getattr(last_response, "data", None)
+        return len(data) if data is not None else None
+
+
+def instrument_plaid_client(client, stats: Optional[ApiStats] = None):
+    """Wrap client in an InstrumentedPlaidApi, unless it already is one."""
+    if isinstance(client, InstrumentedPlaidApi):
+        return client
+    return InstrumentedPlaidApi(client, stats)
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class PrometheusTextfile:
+    """Metrics in the Prometheus text exposition format, for node-exporter's textfile collector.
+
+    Samples of the same metric are grouped under one HELP/TYPE header. write()
+    replaces the file atomically, so the collector never reads a partial file.
+    """
+
+    def __init__(self):
+        # name -> (type, help, [(sample name, labels, value)])
+        self._metrics: Dict[str, tuple] = {}
+
+    def _samples(self, name: str, help: str, type_: str) -> list:
+        if name not in self._metrics:
+            self._metrics[name] = (type_, help, [])
+        return self._metrics[name][2]
+
+    def gauge(self, name: str, help: str, value: float, **labels):
+        self._samples(name, help, "gauge").append((name, labels, value))
+
+    def histogram(self, name: str, help: str, buckets: Dict[float, int], total: float, **labels):
+        """Add a histogram from per-bucket (not cumulative) counts keyed by upper bound."""
+        samples = self._samples(name, help, "histogram")
+        cumulative = 0
+        for bound, count in sorted(buckets.items()):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            samples.append((f"{name}_bucket", {**labels, "le": le}, cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+
+    def render(self) -> str:
+        lines = []
+        for name, (type_, help, samples) in self._metrics.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type_}")
+            for sample_name, labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {value}" if label_text else f"{sample_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path), suffix=".tmp")
+        try:
+            with open(fd, "w") as f:
+                f.write(self.render())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+profiler = Profiler()
+plaid_api_stats = ApiStats()
@@ -1,59 +1,62 @@
+from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 import argparse
 import configparser
+import difflib
+import json
 import os
+import re
+import sys
 import time
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, TextIO, Tuple
 import logging
+import importlib
 import tempfile
-import webbrowser
-import threading
-
-import plaid
-from plaid.api import plaid_api
-from plaid.configuration import Configuration, Environment
-from plaid.api_client import ApiClient
-from plaid.exceptions import ApiException
-
-try:
-    from plaid.model.accounts_get_request import AccountsGetRequest
-    from plaid.model.transactions_sync_request import TransactionsSyncRequest
-    from plaid.model.investments_transactions_get_request import InvestmentsTransactionsGetRequest
-    from plaid.model.investments_transactions_get_request_options import InvestmentsTransactionsGetRequestOptions
-    from plaid.model.plaid_error import PlaidError
-    from plaid.model.link_token_create_request import LinkTokenCreateRequest
-    from plaid.model.link_token_create_request_update import LinkTokenCreateRequestUpdate
-    from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
-    from plaid.model.products import Products
-    from plaid.model.country_code import CountryCode
-except ImportError:
-    # Newer SDK uses different import paths
-    from plaid.models import AccountsGetRequest
-    from plaid.models import TransactionsSyncRequest
-    from plaid.models import InvestmentsTransactionsGetRequest
-    from plaid.models import InvestmentsTransactionsGetRequestOptions
-    from plaid.models import PlaidError
-    from plaid.models import LinkTokenCreateRequest
-    from plaid.models import LinkTokenCreateRequestUpdate
-    from plaid.models import ItemPublicTokenExchangeRequest
-    from plaid.models import Products
-    from plaid.models import CountryCode
-
-from flask import Flask, request, render_template_string, jsonify
 
 from beancount.core import data
 from beancount.core.data import Custom, Directive, Open
-from beancount.parser import printer
-from beancount.parser import parser
-from beancount import loader
 
+if TYPE_CHECKING:
+    from plaid.api import plaid_api
+
+# The Plaid SDK, Flask and the beancount loader are imported by the modes that use
+# them, so --help and --recategorize don't pay for loading them.
 from plaid_models import PlaidTransaction, PlaidInvestmentTransaction, PlaidSecurity, PlaidInvestmentTransactionType, Account, FinanceCategory, PlaidItem, PlaidCursor
+from accounts_cache import AccountsCache, account_metadata
+from instrumentation import LATENCY_BUCKETS, InstrumentedPlaidApi, plaid_api_stats, profiler
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _plaid_model(name: str):
+    """Import a Plaid SDK model class by name, e.g. "AccountsGetRequest"."""
+    try:
+        module = importlib.import_module("plaid.model." + re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower())
+    except ImportError:
+        # Newer SDK uses different import paths
+        module = importlib.import_module("plaid.models")
+    return getattr(module, name)
+
+
+def _plaid_client(config: configparser.ConfigParser) -> "plaid_api.PlaidApi":
+    from plaid.api import plaid_api
+    from plaid.api_client import ApiClient
+    from plaid.configuration import Configuration, Environment
+
+    configuration = Configuration(
+        host=config["PLAID"].get("host", Environment.Production),
+        api_key={
+            "clientId": config["PLAID"]["client_id"],
+            "secret": config["PLAID"]["secret"],
+        },
+    )
+    api_client = ApiClient(configuration)
+    # Every request is accounted in plaid_api_stats
+    return InstrumentedPlaidApi(plaid_api.PlaidApi(api_client))
+
+
 def _parse_args_and_load_config():
     defaults = {
         "config_file": "~/.config/plaid2text/config",
@@ -78,6 +81,19 @@ def _parse_args_and_load_config():
         help="re-categorize existing transactions based on current categorization rules",
     )
 
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="with --recategorize, print the proposed changes instead of rewriting any files",
+    )
+
+    parser.add_argument(
+        "--dry-run-format",
+        choices=["diff", "json"],
+        default="diff",
+        help="output format for --dry-run: a unified diff or JSON lines (default: diff)",
+    )
+
     parser.add_argument(
         "--update-permissions",
         "-u",
@@ -92,6 +108,27 @@ def _parse_args_and_load_config():
         help="show Plaid account information for a selected item",
     )
 
+    parser.add_argument(
+        "--fsync",
+        action="store_true",
+        help="fsync each account file once after writing new transactions",
+    )
+
+    parser.add_argument(
+        "--insert-mode",
+        choices=["append", "merge"],
+        default="append",
+        help="append new transactions to account files, or merge them in date order so "
+             "late-posting transactions are kept (default: append)",
+    )
+
+    parser.add_argument(
+        "--shard-by",
+        choices=["year", "month"],
+        help="write each account's transactions to per-year or per-month shard files "
+             "(e.g. accounts/Bank/Checking/2026.beancount) included from the account file",
+    )
+
     parser.add_argument(
         "--start-date",
         metavar="YYYY-MM-DD",
@@ -122,7 +159,47 @@ def _parse_args_and_load_config():
         help="Enable debug mode to retrieve only the first batch of transactions from each account",
     )
 
+    parser.add_argument(
+        "--journal",
+        metavar="FILE",
+        help="with --sync-transactions, append every raw Plaid response to FILE, a gzipped JSON "
+             "lines journal that --replay can read",
+    )
+
+    parser.add_argument(
+        "--replay",
+        metavar="JOURNAL",
+        help="sync from the last run recorded in JOURNAL (see --journal) instead of the Plaid API",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        metavar="FILE",
+        help="write run duration, per-phase timings, volumes, Plaid API errors and cursor ages "
+             "to FILE in the Prometheus text format (for node-exporter's textfile collector)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="record wall time, CPU time and counters for each phase and write them as JSON "
+             "to FILE (default: stdout)",
+    )
+
+    parser.add_argument(
+        "--memory-profile",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="like --profile, and also trace allocations with tracemalloc to report peak RSS "
+             "and the top allocation sites of each phase (slow)",
+    )
+
     args = parser.parse_args()
+    if args.dry_run and not args.recategorize:
+        parser.error("--dry-run only applies to --recategorize")
     return args
 
 
@@ -142,7 +219,11 @@ def _get_latest_cursor(entries: List[Directive], account: str, item_id: str) ->
 
 def _load_beancount_accounts(file_path: str) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str], Dict[str, Dict[str, str]], Dict[str, str]]:
     """Load account mappings and cursors from beancount file."""
-    entries, _, _ = loader.load_file(file_path)
+    from beancount import loader
+
+    with profiler.phase("load_ledger"):
+        entries, _, _ = loader.load_file(file_path)
+    profiler.count("ledger_entries_loaded", len(entries))
     accounts = [entry for entry in entries if isinstance(entry, Open)]
     
     # Get account mappings
@@ -220,13 +301,19 @@ def _get_or_create_category(primary: str, detailed: str, description: str, expen
     )
 
 
-def _update_transactions(client: plaid_api.PlaidApi, root_file: str, debug: bool = False) -> Tuple[List[PlaidTransaction], List[Custom]]:
+def _update_transactions(client: "plaid_api.PlaidApi", root_file: str, debug: bool = False,
+                         accounts_cache: Optional["AccountsCache"] = None) -> Tuple[List[PlaidTransaction], List[Custom]]:
     """Fetch transactions from Plaid and convert them to PlaidTransaction objects."""
+    from plaid.exceptions import ApiException
+    AccountsGetRequest = _plaid_model("AccountsGetRequest")
+    TransactionsSyncRequest = _plaid_model("TransactionsSyncRequest")
+
     transactions = []
     cursor_directives = []
     short_names, expense_accounts, items, cursors, transaction_files = _load_beancount_accounts(root_file)
     
     for item_id, access_token in items.items():
+        plaid_api_stats.register_item(access_token, item_id)
         # Get cursor from account file
         cursor = ""
         for account_cursors in cursors.values():
@@ -234,13 +321,25 @@ def _update_transactions(client: plaid_api.PlaidApi, root_file: str, debug: bool
                 cursor = account_cursors[item_id]
                 break
         
-        # First, get account information
+        # First, get account information, from the cache if it is fresh. A cached
+        # login-required status is checked again, so an item that recovered isn't skipped.
+        cached = accounts_cache.get(item_id, access_token) if accounts_cache is not None else None
+        if cached is not None and cached["login_required"]:
+            cached = None
         try:
-            accounts_request = AccountsGetRequest(access_token=access_token)
-            accounts_response = client.accounts_get(accounts_request)
+            if cached is not None:
+                item_accounts = cached["accounts"]
+            else:
+                accounts_request = AccountsGetRequest(access_token=access_token)
+                with profiler.phase("plaid.accounts_get"):
+                    accounts_response = client.accounts_get(accounts_request)
+                if accounts_cache is not None:
+                    accounts_cache.store(item_id, access_token, accounts_response["accounts"], accounts_response.get("item"))
+                # In the cached form, so account types are plain strings either way
+                item_accounts = [account_metadata(account) for account in accounts_response["accounts"]]
             accounts = {
                 acc["account_id"]: acc["type"]
-                for acc in accounts_response["accounts"]
+                for acc in item_accounts
             }
         except ApiException as e:
             if e.status == 400 and "ITEM_LOGIN_REQUIRED" in str(e):
@@ -261,6 +360,8 @@ def _update_transactions(client: plaid_api.PlaidApi, root_file: str, debug: bool
             logger.warning(f"No beancount account found for item {item_id}, skipping")
             continue
 
+        # Accounts listed by the sync pages, written to the cache once the item is synced
+        synced_accounts = {}
         has_more = True
         while has_more:
             try:
@@ -270,10 +371,14 @@ def _update_transactions(client: plaid_api.PlaidApi, root_file: str, debug: bool
                     count=500,
                 )
 
-                response = client.transactions_sync(request)
+                with profiler.phase("plaid.transactions_sync"):
+                    response = client.transactions_sync(request)
+                for synced_account in response.get("accounts") or []:
+                    synced_accounts[synced_account["account_id"]] = synced_account
                 plaid_transactions = response["added"]
                 has_more = response["has_more"]
                 cursor = response["next_cursor"]
+                profiler.count("transactions_fetched", len(plaid_transactions), label=item_id)
 
                 for t in plaid_transactions:
                     # Log transaction details when fetched from Plaid
@@ -351,16 +456,25 @@ def _update_transactions(client: plaid_api.PlaidApi, root_file: str, debug: bool
                 break
             if debug:
                 break  # Only retrieve the first batch of transactions in debug mode
+        if accounts_cache is not None and synced_accounts and not has_more:
+            # The sync lists all of the item's accounts, so closed ones drop out; only
+            # accounts_get renews the entry, so it still expires on schedule
+            accounts_cache.store(item_id, access_token, list(synced_accounts.values()), renew=False)
     return transactions, cursor_directives
 
 
-def _update_investments(client: plaid_api.PlaidApi, root_file: str) -> List[PlaidInvestmentTransaction]:
+def _update_investments(client: "plaid_api.PlaidApi", root_file: str,
+                        accounts_cache: Optional["AccountsCache"] = None) -> List[PlaidInvestmentTransaction]:
     """Update investment transactions for all items."""
+    from plaid.exceptions import ApiException
+    InvestmentsTransactionsGetRequest = _plaid_model("InvestmentsTransactionsGetRequest")
+
     # Load accounts and cursors
     short_names, expense_accounts, items, cursors, transaction_files = _load_beancount_accounts(root_file)
     
     investment_transactions = []
     for item_id, access_token in items.items():
+        plaid_api_stats.register_item(access_token, item_id)
         try:
             # Get investment transactions
             request = InvestmentsTransactionsGetRequest(
@@ -368,8 +482,12 @@ def _update_investments(client: plaid_api.PlaidApi, root_file: str) -> List[Plai
                 start_date=date.today() - timedelta(weeks=24 * 4), # Plaid API only supports 24 months
                 end_date=date.today()
             )
-            response = client.investments_transactions_get(request)
-            accounts = {a["account_id"]: a for a in response["accounts"]}
+            with profiler.phase("plaid.investments_transactions_get"):
+                response = client.investments_transactions_get(request)
+            if accounts_cache is not None:
+                accounts_cache.store_response(item_id, access_token, response)
+            profiler.count("investment_transactions_fetched", len(response["investment_transactions"]), label=item_id)
+            accounts = {a["account_id"]: account_metadata(a) for a in response["accounts"]}
             securities = {s["security_id"]: s for s in response["securities"]}
             
             # Process each transaction
@@ -453,6 +571,8 @@ def _get_plaid_items_from_beancount(root_file: str) -> Dict[str, Tuple[str, str,
     Returns:
         Dict mapping item_id to (account_name, access_token, short_name)
     """
+    from beancount import loader
+
     entries, _, _ = loader.load_file(root_file)
     accounts = [entry for entry in entries if isinstance(entry, Open)]
 
@@ -503,9 +623,18 @@ def _update_access_token_in_beancount(root_file: str, account_name: str, new_acc
     logger.info(f"Updated access token for {account_name} in {root_file}")
 
 
-def _start_update_permissions_server(client: plaid_api.PlaidApi, root_file: str, item_id: str,
-                                     account_name: str, access_token: str, short_name: str):
+def _start_update_permissions_server(client: "plaid_api.PlaidApi", root_file: str, item_id: str,
+                                     account_name: str, access_token: str, short_name: str,
+                                     accounts_cache: Optional["AccountsCache"] = None):
     """Start Flask server for updating Plaid item permissions."""
+    import threading
+    import webbrowser
+    from flask import Flask, request, render_template_string, jsonify
+    LinkTokenCreateRequest = _plaid_model("LinkTokenCreateRequest")
+    LinkTokenCreateRequestUpdate = _plaid_model("LinkTokenCreateRequestUpdate")
+    ItemPublicTokenExchangeRequest = _plaid_model("ItemPublicTokenExchangeRequest")
+    Products = _plaid_model("Products")
+    CountryCode = _plaid_model("CountryCode")
 
     # HTML template for the update page
     HTML_TEMPLATE = """
@@ -615,6 +744,9 @@ def _start_update_permissions_server(client: plaid_api.PlaidApi, root_file: str,
 
             # Update the beancount file
             _update_access_token_in_beancount(root_file, account_name, new_access_token)
+            # The cached login-required status is stale now
+            if accounts_cache is not None:
+                accounts_cache.invalidate(item_id)
 
             logger.info(f"Successfully updated access token for {short_name}")
             return jsonify({"success": True})
@@ -635,16 +767,31 @@ def _start_update_permissions_server(client: plaid_api.PlaidApi, root_file: str,
     app.run(port=5000, debug=False)
 
 
-def _display_account_info(client: plaid_api.PlaidApi, item_id: str, access_token: str, short_name: str):
-    """Fetch and display Plaid account information for an item."""
+def _display_account_info(client: "plaid_api.PlaidApi", item_id: str, access_token: str, short_name: str,
+                          accounts_cache: Optional["AccountsCache"] = None):
+    """Fetch (or take from the accounts cache) and display Plaid account information for an item."""
+    from plaid.exceptions import ApiException
+    AccountsGetRequest = _plaid_model("AccountsGetRequest")
+
     try:
         # Get account information
-        accounts_request = AccountsGetRequest(access_token=access_token)
-        accounts_response = client.accounts_get(accounts_request)
+        cached = accounts_cache.get(item_id, access_token) if accounts_cache is not None else None
+        if cached is not None and cached["login_required"]:
+            logger.error(f"Item {item_id} needs reauthorization. Please use --update-permissions to update it.")
+            return
+        if cached is not None:
+            accounts_response = {"accounts": cached["accounts"], "item": cached["item"] or {}}
+        else:
+            accounts_request = AccountsGetRequest(access_token=access_token)
+            accounts_response = client.accounts_get(accounts_request)
+            if accounts_cache is not None:
+                accounts_cache.store(item_id, access_token, accounts_response["accounts"], accounts_response.get("item"))
 
         print(f"\n{'='*80}")
         print(f"Account Information for: {short_name}")
         print(f"Item ID: {item_id}")
+        if cached is not None:
+            print(f"(cached {datetime.fromtimestamp(cached['fetched_at']):%Y-%m-%d %H:%M:%S})")
         print(f"{'='*80}\n")
 
         if not accounts_response["accounts"]:
@@ -703,253 +850,362 @@ def _display_account_info(client: plaid_api.PlaidApi, item_id: str, access_token
     except ApiException as e:
         if e.status == 400 and "ITEM_LOGIN_REQUIRED" in str(e):
             logger.error(f"Item {item_id} needs reauthorization. Please use --update-permissions to update it.")
+            if accounts_cache is not None:
+                accounts_cache.mark_login_required(item_id, access_token)
         else:
             logger.error(f"Error getting account information for item {item_id}: {e}")
     except Exception as e:
         logger.error(f"Unexpected error getting account information: {e}")
 
 
-def _recategorize_transactions(root_file: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> int:
-    """Re-categorize existing transactions based on current categorization rules."""
+@dataclass
+class RecategorizeChange:
+    """A single expense account change proposed by the recategorization engine."""
+    file: str
+    line: int
+    date: date
+    payee: Optional[str]
+    old_account: str
+    new_account: str
+    rule: str
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "file": self.file,
+            "line": self.line,
+            "date": self.date.isoformat(),
+            "payee": self.payee,
+            "old_account": self.old_account,
+            "new_account": self.new_account,
+            "rule": self.rule,
+        }
+
+
+@dataclass
+class FileRecategorization:
+    """All proposed changes for one transaction file, plus its rewritten content."""
+    path: str
+    original_lines: List[str]
+    new_lines: List[str]
+    changes: List[RecategorizeChange]
+
+
+def _make_payee_matcher(expense_accounts: Dict[str, str]) -> Callable[[str], Tuple[Optional[str], Optional[str]]]:
+    """Build a memoized payee -> (expense account, matched rule) lookup.
+
+    Exact matches win; otherwise the first rule that contains the payee is used.
+    Most ledgers repeat a small set of payees, so results are cached per payee.
+    """
+    cache: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+    def match(payee_lc: str) -> Tuple[Optional[str], Optional[str]]:
+        if payee_lc in cache:
+            return cache[payee_lc]
+        result: Tuple[Optional[str], Optional[str]] = (None, None)
+        if payee_lc in expense_accounts:
+            result = (expense_accounts[payee_lc], payee_lc)
+        else:
+            # Check for partial matches (transaction payee should be found within the payee rule)
+            for payee_rule, account in expense_accounts.items():
+                if payee_rule and payee_lc in payee_rule:
+                    result = (account, payee_rule)
+                    break
+        cache[payee_lc] = result
+        return result
+
+    return match
+
+
+def _recategorize_entry(entry: data.Transaction, match_payee) -> Optional[Tuple[data.Transaction, str, str, str]]:
+    """Apply the current payee rules to a transaction.
+
+    Returns (updated_entry, old_account, new_account, rule), or None if the
+    transaction is already categorized correctly or no rule matches.
+    """
+    # Get the payee name for categorization
+    payee = (entry.payee or entry.narration)
+    if not payee:
+        return None
+
+    # Find the expense posting (second posting for most transactions)
+    expense_posting = None
+    for posting in entry.postings:
+        if posting.account.startswith("Expenses:"):
+            expense_posting = posting
+            break
+    if not expense_posting:
+        return None
+
+    new_expense_account, rule = match_payee(payee.lower())
+    if not new_expense_account:
+        logger.debug(f"No matching payee rule found for: {payee}")
+        return None
+    if new_expense_account == expense_posting.account:
+        logger.debug(f"Transaction already has correct account: {expense_posting.account}")
+        return None
+
+    logger.debug(f"Recategorizing transaction from {expense_posting.account} to {new_expense_account}")
+    # Create new postings with updated expense account, keeping other postings unchanged
+    new_postings = [
+        posting._replace(account=new_expense_account) if posting.account.startswith("Expenses:") else posting
+        for posting in entry.postings
+    ]
+    # Copy all metadata fields, including plaid_transaction_id
+    new_meta = dict(entry.meta) if entry.meta else {}
+    updated_entry = entry._replace(meta=new_meta, postings=new_postings)
+    return updated_entry, expense_posting.account, new_expense_account, rule
+
+
+def _transaction_identifiers(entry: data.Transaction) -> List[str]:
+    """Keys used to find a transaction in its source file: the Plaid ID (if any) and its header."""
+    identifiers = []
+    if entry.meta and 'plaid_transaction_id' in entry.meta:
+        identifiers.append(entry.meta['plaid_transaction_id'])
+    date_str = entry.date.strftime('%Y-%m-%d')
+    flag_str = entry.flag if entry.flag else ''
+    payee_str = entry.payee if entry.payee else ''
+    narration_str = entry.narration if entry.narration else ''
+    identifiers.append(f"{date_str}_{flag_str}_{payee_str}_{narration_str}")
+    return identifiers
+
+
+_PLAID_ID_PATTERN = re.compile(r'plaid_transaction_id:\s*"([^"]+)"')
+_TRANSACTION_HEADER_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})\s+([*!]?)\s*"([^"]*)"\s*"([^"]*)"')
+
+
+def _starts_transaction(stripped_line: str) -> bool:
+    return len(stripped_line) >= 10 and stripped_line[:10].replace('-', '').isdigit()
+
+
+def _rewrite_transactions(lines: List[str], transactions_to_modify: Dict[str, data.Transaction]) -> List[str]:
+    """Replace the modified transactions in a file's lines, keeping everything else verbatim."""
+    from beancount.parser import printer
+
+    new_lines = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped_line = line.strip()
+
+        # Check if this line starts a new transaction (starts with a date)
+        if not _starts_transaction(stripped_line):
+            # Keep non-transaction lines as-is
+            new_lines.append(line)
+            i += 1
+            continue
+
+        # Collect all lines that belong to this transaction
+        transaction_lines = [line]
+        j = i + 1
+        while j < len(lines):
+            next_stripped = lines[j].strip()
+
+            # If next line starts with a date, it's a new transaction
+            if _starts_transaction(next_stripped):
+                break
+
+            # If next line is empty, it might be the end of the transaction
+            if not next_stripped and j + 1 < len(lines) and _starts_transaction(lines[j + 1].strip()):
+                break
+
+            transaction_lines.append(lines[j])
+            j += 1
+
+        # Look for plaid_transaction_id in the transaction
+        transaction_identifier = None
+        for tx_line in transaction_lines:
+            if 'plaid_transaction_id:' in tx_line:
+                match = _PLAID_ID_PATTERN.search(tx_line)
+                if match:
+                    transaction_identifier = match.group(1)
+                    break
+
+        # If no transaction ID, try to match by full transaction metadata
+        # Format: date flag "payee" "narration"
+        if not transaction_identifier:
+            match = _TRANSACTION_HEADER_PATTERN.match(stripped_line)
+            if match:
+                transaction_identifier = "_".join(match.groups())
+
+        if transaction_identifier and transaction_identifier in transactions_to_modify:
+            # Replace the transaction with the modified version
+            new_lines.append(printer.format_entry(transactions_to_modify[transaction_identifier]) + '\n')
+            logger.debug(f"Modified transaction: {transaction_identifier}")
+        else:
+            # Keep the original transaction
+            new_lines.extend(transaction_lines)
+
+        # Skip to the end of this transaction
+        i = j
+    return new_lines
+
+
+def _existing_plaid_transactions(path: str, follow_includes: bool = True) -> Tuple[Optional[date], set]:
+    """Newest date and the set of Plaid transaction IDs already written to a transaction file.
+
+    With follow_includes=False only the file itself is parsed, which keeps shard lookups
+    from reparsing an account's whole history through its includes.
+    """
+    from beancount import loader
+    from beancount.parser import parser
+
+    newest_date = None
+    transaction_ids = set()
+    if not os.path.exists(path):
+        return newest_date, transaction_ids
+
+    with profiler.phase("scan_existing"):
+        if follow_includes:
+            entries, errors, options = loader.load_file(path)
+        else:
+            entries, errors, options = parser.parse_file(path)
+    profiler.count("existing_entries_scanned", len(entries))
+    if errors:
+        logger.debug(f"Validation errors loading {path} (expected when loading individual files): {errors}")
+
+    for entry in entries:
+        if isinstance(entry, data.Transaction) and entry.meta and 'plaid_transaction_id' in entry.meta:
+            if newest_date is None or entry.date > newest_date:
+                newest_date = entry.date
+            transaction_ids.add(entry.meta['plaid_transaction_id'])
+    return newest_date, transaction_ids
+
+
+def _plan_recategorization(root_file: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[FileRecategorization]:
+    """Compute every recategorization under the current rules without writing anything.
+
+    This is the single engine behind both --recategorize and its --dry-run preview,
+    so the preview shows exactly what a real run would write.
+    """
+    from beancount import loader
+    from beancount.parser import parser
+    from transactions.beancount_writer import shard_paths
+
     # Load current categorization rules
     short_names, expense_accounts, items, cursors, transaction_files = _load_beancount_accounts(root_file)
-    
+    match_payee = _make_payee_matcher(expense_accounts)
+
     # Parse date filters
-    start_dt = None
-    end_dt = None
-    if start_date:
-        start_dt = date.fromisoformat(start_date)
-    if end_date:
-        end_dt = date.fromisoformat(end_date)
-    
-    recategorized_count = 0
-    
-    # Process each transaction file
+    start_dt = date.fromisoformat(start_date) if start_date else None
+    end_dt = date.fromisoformat(end_date) if end_date else None
+
+    plans = []
     base_dir = os.path.dirname(os.path.abspath(root_file))
+    paths = []
+    index_files = set()
     for file_path in transaction_files.values():
         full_path = os.path.join(base_dir, file_path)
+        # Sharded accounts: the account file plus only the shards overlapping the window
+        paths.append(full_path)
+        if os.path.isdir(os.path.splitext(full_path)[0]):
+            index_files.add(full_path)
+            paths.extend(shard_paths(full_path, start_dt, end_dt))
+
+    for full_path in dict.fromkeys(paths):
         if not os.path.exists(full_path):
             continue
-            
+
         logger.info(f"Processing file: {full_path}")
-        
-        # Load the transaction file directly for processing (validation errors are expected)
-        entries, errors, options = loader.load_file(full_path)
+
+        # Load the transaction file directly for processing (validation errors are expected).
+        # An index file is parsed without its includes, so shards outside the window are never read.
+        with profiler.phase("load_file"):
+            if full_path in index_files:
+                entries, errors, options = parser.parse_file(full_path)
+            else:
+                entries, errors, options = loader.load_file(full_path)
+        profiler.count("entries_processed", len(entries))
         if errors:
             logger.debug(f"Validation errors loading {full_path} (expected during processing): {len(errors)} errors")
-        
-        # Filter transactions by date if specified
-        transactions_to_process = []
-        for entry in entries:
-            if isinstance(entry, data.Transaction):
-                if start_dt and entry.date < start_dt:
-                    continue
-                if end_dt and entry.date > end_dt:
-                    continue
-                transactions_to_process.append(entry)
-        
-        # Process each transaction
-        modified_entries = []
+
+        changes = []
+        transactions_to_modify = {}
+        # Beancount normalizes the filenames it records; compare resolved paths, so a
+        # transaction_file like ./accounts/checking.beancount or a symlink still matches
+        real_path = os.path.realpath(full_path)
+        own_files = {full_path: True}
         for entry in entries:
-            if isinstance(entry, data.Transaction) and entry in transactions_to_process:
-                # Get the payee name for categorization
-                payee = (entry.payee or entry.narration)
-                payee_lc = payee.lower() if payee else payee
-                
-                # Find the expense posting (second posting for most transactions)
-                expense_posting = None
-                for posting in entry.postings:
-                    if posting.account.startswith("Expenses:"):
-                        expense_posting = posting
-                        break
-                
-                if not expense_posting:
-                    continue
-                
-                # Check if payee matches any explicit payee rules
-                new_expense_account = None
-                if payee_lc:
-                    logger.debug(f"Checking payee: '{payee_lc}' against expense accounts: {list(expense_accounts.keys())}")
-                    # Check for exact match first
-                    if payee_lc in expense_accounts:
-                        new_expense_account = expense_accounts[payee_lc]
-                        logger.debug(f"Found exact match: {payee_lc} -> {new_expense_account}")
-                    else:
-                        # Check for partial matches (transaction payee should be found within the payee rule)
-                        for payee_rule, account in expense_accounts.items():
-                            if payee_rule and payee_lc in payee_rule:
-                                new_expense_account = account
-                                logger.debug(f"Found partial match: '{payee_lc}' in '{payee_rule}' -> {new_expense_account}")
-                                break
-                
-                # If we found a new categorization, update the transaction
-                if new_expense_account and new_expense_account != expense_posting.account:
-                    logger.debug(f"Recategorizing transaction from {expense_posting.account} to {new_expense_account}")
-                    # Create new postings with updated expense account
-                    new_postings = []
-                    for posting in entry.postings:
-                        if posting.account.startswith("Expenses:"):
-                            # Update the expense account
-                            new_postings.append(
-                                data.Posting(
-                                    account=new_expense_account,
-                                    units=posting.units,
-                                    cost=posting.cost,
-                                    price=posting.price,
-                                    flag=posting.flag,
-                                    meta=posting.meta
-                                )
-                            )
-                        else:
-                            # Keep other postings unchanged
-                            new_postings.append(posting)
-                    
-                    # Create updated transaction
-                    # Copy all metadata fields, including plaid_transaction_id
-                    new_meta = dict(entry.meta) if entry.meta else {}
-                    if entry.meta and 'plaid_transaction_id' in entry.meta:
-                        new_meta['plaid_transaction_id'] = entry.meta['plaid_transaction_id']
-                    updated_entry = data.Transaction(
-                        meta=new_meta,
-                        date=entry.date,
-                        flag=entry.flag,
-                        payee=entry.payee,
-                        narration=entry.narration,
-                        tags=entry.tags,
-                        links=entry.links,
-                        postings=new_postings
-                    )
-                    logger.debug(f"Modified transaction metadata: {updated_entry.meta}")
-                    modified_entries.append(updated_entry)
-                    recategorized_count += 1
-                else:
-                    if new_expense_account:
-                        logger.debug(f"Transaction already has correct account: {expense_posting.account}")
-                    else:
-                        logger.debug(f"No matching payee rule found for: {payee_lc}")
-                    modified_entries.append(entry)
-            else:
-                modified_entries.append(entry)
-        
-        # Write updated transactions back to file using inline modification
-        if recategorized_count > 0:
-            # Read the original file content
+            if not isinstance(entry, data.Transaction):
+                continue
+            # Entries pulled in through includes (e.g. shards) are planned with their own file
+            filename = entry.meta.get('filename', full_path) if entry.meta else full_path
+            if filename not in own_files:
+                own_files[filename] = os.path.realpath(filename) == real_path
+            if not own_files[filename]:
+                continue
+            if start_dt and entry.date < start_dt:
+                continue
+            if end_dt and entry.date > end_dt:
+                continue
+            result = _recategorize_entry(entry, match_payee)
+            if result is None:
+                continue
+            updated_entry, old_account, new_account, rule = result
+            changes.append(RecategorizeChange(
+                file=os.path.relpath(full_path, base_dir),
+                line=entry.meta.get('lineno', 0) if entry.meta else 0,
+                date=entry.date,
+                payee=entry.payee or entry.narration,
+                old_account=old_account,
+                new_account=new_account,
+                rule=rule,
+            ))
+            for identifier in _transaction_identifiers(updated_entry):
+                transactions_to_modify[identifier] = updated_entry
+
+        if not changes:
+            continue
+
+        with profiler.phase("rewrite"):
             with open(full_path, 'r') as f:
                 lines = f.readlines()
-            
-            # Create a mapping of transactions that need to be modified
-            transactions_to_modify = {}
-            for entry in modified_entries:
-                if isinstance(entry, data.Transaction):
-                    # Use transaction ID or full metadata to identify the transaction
-                    identifier = None
-                    meta_identifier = None
-                    if entry.meta and 'plaid_transaction_id' in entry.meta:
-                        identifier = entry.meta['plaid_transaction_id']
-                        logger.debug(f"Using plaid_transaction_id as identifier: {identifier}")
-                    # Always create the metadata identifier
-                    date_str = entry.date.strftime('%Y-%m-%d')
-                    flag_str = entry.flag if entry.flag else ''
-                    payee_str = entry.payee if entry.payee else ''
-                    narration_str = entry.narration if entry.narration else ''
-                    meta_identifier = f"{date_str}_{flag_str}_{payee_str}_{narration_str}"
-                    logger.debug(f"Using metadata as identifier: {meta_identifier}")
-                    # Add both identifiers if available
-                    if identifier:
-                        transactions_to_modify[identifier] = entry
-                        logger.debug(f"Added transaction to modifications: {identifier}")
-                    transactions_to_modify[meta_identifier] = entry
-                    logger.debug(f"Added transaction to modifications: {meta_identifier}")
-            
-            logger.debug(f"Transactions to modify: {list(transactions_to_modify.keys())}")
-            
-            # Parse the file to find transaction boundaries and modify in place
-            new_lines = []
-            i = 0
-            while i < len(lines):
-                line = lines[i]
-                stripped_line = line.strip()
-                
-                # Check if this line starts a new transaction (starts with a date)
-                if stripped_line and len(stripped_line) >= 10 and stripped_line[:10].replace('-', '').isdigit():
-                    # Try to identify this transaction
-                    transaction_identifier = None
-                    transaction_lines = [line]
-                    j = i + 1
-                    
-                    # Collect all lines that belong to this transaction
-                    while j < len(lines):
-                        next_line = lines[j]
-                        next_stripped = next_line.strip()
-                        
-                        # If next line starts with a date, it's a new transaction
-                        if next_stripped and len(next_stripped) >= 10 and next_stripped[:10].replace('-', '').isdigit():
-                            break
-                        
-                        # If next line is empty, it might be the end of the transaction
-                        if not next_stripped:
-                            # Check if the line after this is a new transaction
-                            if j + 1 < len(lines):
-                                next_next_stripped = lines[j + 1].strip()
-                                if next_next_stripped and len(next_next_stripped) >= 10 and next_next_stripped[:10].replace('-', '').isdigit():
-                                    break
-                        
-                        transaction_lines.append(next_line)
-                        j += 1
-                    
-                    # Try to extract transaction identifier from the transaction lines
-                    transaction_text = ''.join(transaction_lines)
-                    
-                    # Look for plaid_transaction_id in the transaction
-                    import re
-                    for tx_line in transaction_lines:
-                        if 'plaid_transaction_id:' in tx_line:
-                            match = re.search(r'plaid_transaction_id:\s*"([^"]+)"', tx_line)
-                            if match:
-                                transaction_identifier = match.group(1)
-                                break
-                    
-                    # If no transaction ID, try to match by full transaction metadata
-                    if not transaction_identifier:
-                        # Extract the full transaction metadata from the first line
-                        # Format: date flag "payee" "narration"
-                        tx_pattern = r'^(\d{4}-\d{2}-\d{2})\s+([*!]?)\s*"([^"]*)"\s*"([^"]*)"'
-                        match = re.match(tx_pattern, stripped_line)
-                        if match:
-                            date_part, flag_part, payee_part, narration_part = match.groups()
-                            # Create a unique identifier from the full transaction metadata
-                            transaction_identifier = f"{date_part}_{flag_part}_{payee_part}_{narration_part}"
-                    
-                    # Check if this transaction needs to be modified
-                    if transaction_identifier and transaction_identifier in transactions_to_modify:
-                        # Replace the transaction with the modified version
-                        modified_entry = transactions_to_modify[transaction_identifier]
-                        new_lines.append(printer.format_entry(modified_entry) + '\n')
-                        logger.debug(f"Modified transaction: {transaction_identifier}")
-                    else:
-                        # Keep the original transaction
-                        new_lines.extend(transaction_lines)
-                        if transaction_identifier:
-                            logger.debug(f"Transaction not found in modifications: {transaction_identifier}")
-                        else:
-                            logger.debug(f"Could not identify transaction")
-                    
-                    # Skip to the end of this transaction
-                    i = j
-                else:
-                    # Keep non-transaction lines as-is
-                    new_lines.append(line)
-                    i += 1
-            
-            # Write the modified content back to file
-            with open(full_path, 'w') as f:
-                f.writelines(new_lines)
-            
-            logger.info(f"Updated {recategorized_count} transactions in {full_path}")
-    
+            new_lines = _rewrite_transactions(lines, transactions_to_modify)
+        plans.append(FileRecategorization(full_path, lines, new_lines, changes))
+
+    return plans
+
+
+def _preview_recategorization(root_file: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                              output_format: str = "diff", out: Optional[TextIO] = None) -> int:
+    """Print the changes --recategorize would make, as a unified diff or JSON lines."""
+    out = out or sys.stdout
+    base_dir = os.path.dirname(os.path.abspath(root_file))
+    change_count = 0
+    for plan in _plan_recategorization(root_file, start_date, end_date):
+        change_count += len(plan.changes)
+        if output_format == "json":
+            for change in plan.changes:
+                out.write(json.dumps(change.to_dict()) + "\n")
+        else:
+            relative_path = os.path.relpath(plan.path, base_dir)
+            out.writelines(difflib.unified_diff(
+                plan.original_lines, plan.new_lines,
+                fromfile=f"a/{relative_path}", tofile=f"b/{relative_path}",
+            ))
+    return change_count
+
+
+def _recategorize_transactions(root_file: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> int:
+    """Re-categorize existing transactions based on current categorization rules."""
+    from beancount import loader
+
+    recategorized_count = 0
+    with profiler.phase("plan"):
+        plans = _plan_recategorization(root_file, start_date, end_date)
+    for plan in plans:
+        # Write the modified content back to file
+        with profiler.phase("write"), open(plan.path, 'w') as f:
+            f.writelines(plan.new_lines)
+            profiler.count("bytes_written", f.tell())
+        profiler.count("files_written")
+        recategorized_count += len(plan.changes)
+        logger.info(f"Updated {len(plan.changes)} transactions in {plan.path}")
+    profiler.count("entries_recategorized", recategorized_count)
+
     # Always validate the entire setup by loading the root file (which includes all transaction files)
     logger.info("Validating recategorization by loading root file...")
-    root_entries, root_errors, root_options = loader.load_file(root_file)
+    with profiler.phase("validate"):
+        root_entries, root_errors, root_options = loader.load_file(root_file)
     if root_errors:
         # Filter out errors that aren't related to recategorization
         recategorization_errors = []
@@ -964,7 +1220,7 @@ def _recategorize_transactions(root_file: str, start_date: Optional[str] = None,
                 continue
             # Include other validation errors
             recategorization_errors.append(error)
-        
+
         if recategorization_errors:
             logger.error(f"Validation errors after recategorization: {recategorization_errors}")
             return -1  # Indicate failure
@@ -972,13 +1228,149 @@ def _recategorize_transactions(root_file: str, start_date: Optional[str] = None,
             logger.info("Recategorization validation successful - only non-critical errors found")
     else:
         logger.info("Recategorization validation successful - no errors")
-    
+
     return recategorized_count
 
 
+def _record_cursor_ages(cursors_file: str, cursor_directives: List[Custom]):
+    """Record how old each item's cursor is once this sync's cursors are written.
+
+    Items that got a new cursor are current; the others keep the age of the cursor
+    in the existing cursors file, i.e. the time since they last synced.
+    """
+    from beancount.parser import parser
+
+    previous = {}
+    if os.path.exists(cursors_file):
+        entries, _, _ = parser.parse_file(cursors_file)
+        for entry in entries:
+            if isinstance(entry, Custom) and entry.type == "plaid_cursor" and len(entry.values) > 2:
+                item_id = entry.values[2][0]
+                if item_id not in previous or entry.date > previous[item_id]:
+                    previous[item_id] = entry.date
+
+    now = datetime.now()
+    synced = {directive.values[2][0] for directive in cursor_directives}
+    for item_id, cursor_date in previous.items():
+        if item_id not in synced:
+            age = now - datetime.combine(cursor_date, datetime.min.time())
+            profiler.gauge("cursor_age_seconds", item_id, age.total_seconds())
+    for item_id in synced:
+        profiler.gauge("cursor_age_seconds", item_id, 0.0)
+
+
+def _write_metrics(path: str, succeeded: bool):
+    """Write the run's profile and Plaid API stats as a Prometheus textfile."""
+    from instrumentation import PrometheusTextfile
+
+    report = profiler.report()
+    metrics = PrometheusTextfile()
+    metrics.gauge("plaid2beancount_last_run_timestamp_seconds", "When the last run finished.", time.time())
+    metrics.gauge("plaid2beancount_last_run_success", "Whether the last run finished without an error.", int(succeeded))
+    metrics.gauge("plaid2beancount_run_duration_seconds", "Wall time of the last run.", report["wall_seconds"])
+    for phase, stats in report["phases"].items():
+        metrics.gauge("plaid2beancount_phase_duration_seconds", "Wall time of each phase of the last run.",
+                      stats["wall_seconds"], phase=phase)
+    metrics.gauge("plaid2beancount_ledger_parse_seconds", "Time spent loading the root ledger in the last run.",
+                  sum(stats["wall_seconds"] for phase, stats in report["phases"].items() if phase.endswith("load_ledger")))
+    for name, help in (
+        ("transactions_fetched", "Transactions fetched per item in the last run."),
+        ("investment_transactions_fetched", "Investment transactions fetched per item in the last run."),
+    ):
+        for item_id, count in report["labeled_counters"].get(name, {}).items():
+            metrics.gauge(f"plaid2beancount_{name}", help, count, item_id=item_id)
+    for name, help in (
+        ("entries_written", "Entries written per file in the last run."),
+        ("bytes_written", "Bytes written per file in the last run."),
+    ):
+        for file, count in report["labeled_counters"].get(name, {}).items():
+            metrics.gauge(f"plaid2beancount_{name}", help, count, file=file)
+    for item_id, age in report["gauges"].get("cursor_age_seconds", {}).items():
+        metrics.gauge("plaid2beancount_cursor_age_seconds", "Age of each item's sync cursor after the last run.",
+                      age, item_id=item_id)
+
+    for endpoint, stats in plaid_api_stats.endpoints.items():
+        metrics.gauge("plaid2beancount_plaid_api_requests", "Plaid API requests per endpoint in the last run.",
+                      stats.requests, endpoint=endpoint)
+        for code, count in stats.error_codes.items():
+            metrics.gauge("plaid2beancount_plaid_api_errors", "Plaid API errors per endpoint and error code in the last run.",
+                          count, endpoint=endpoint, code=code)
+        metrics.histogram("plaid2beancount_plaid_api_request_duration_seconds", "Plaid API request latency in the last run.",
+                          dict(zip(LATENCY_BUCKETS + (float("inf"),), stats.latency_buckets)), stats.seconds,
+                          endpoint=endpoint)
+    metrics.write(path)
+
+
+def _route_entries(entries: List[Directive], accounts: List[Account]) -> Dict[str, List[data.Transaction]]:
+    """Group rendered entries by the transaction file of the account they belong to.
+
+    An entry belongs to the account of its first posting that is either one of the
+    accounts, or a sub-account of one (e.g. Assets:Vanguard:Brokerage:Cash belongs to
+    Assets:Vanguard:Brokerage). When several accounts share a name, the first wins.
+    """
+    # Account name -> first account with that name
+    by_name = {}
+    for account in accounts:
+        by_name.setdefault(account.beancount_name, account)
+    # Earliest position of each name, to pick the first account when several prefixes match
+    positions = {}
+    for position, account in enumerate(accounts):
+        positions.setdefault(account.beancount_name, position)
+
+    account_entries = {}
+    for entry in entries:
+        # Check all postings to determine which file to write to
+        if isinstance(entry, data.Transaction) and entry.postings:
+            logger.debug(f"Processing entry: {entry}")
+            matching_account = None
+
+            for posting in entry.postings:
+                name = posting.account
+                # First check for an exact match
+                matching_account = by_name.get(name)
+                if matching_account:
+                    break
+
+                # Then check the accounts this posting's account is a sub-account of
+                components = name.split(":")
+                parents = [":".join(components[:i]) for i in range(1, len(components))]
+                parents = [parent for parent in parents if parent in by_name]
+                if parents:
+                    matching_account = by_name[min(parents, key=positions.__getitem__)]
+                    break
+
+            if matching_account and matching_account.transaction_file:
+                account_entries.setdefault(matching_account.transaction_file, []).append(entry)
+            else:
+                logger.warning(f"No matching account found for {entry}")
+        else:
+            logger.debug(f"Skipping entry: {entry}")
+            logger.debug(f"Entry type: {type(entry)}")
+            logger.debug(f"Entry postings: {entry.postings}")
+    return account_entries
+
+
 def main():
     args = _parse_args_and_load_config()
-
+    if args.profile or args.memory_profile or args.metrics_file:
+        profiler.enable(memory=bool(args.memory_profile))
+        plaid_api_stats.reset()
+        profiler.add_section("plaid_api", plaid_api_stats.report)
+    succeeded = False
+    try:
+        _run(args)
+        succeeded = True
+    finally:
+        if args.profile:
+            profiler.write_report(args.profile)
+        if args.memory_profile and args.memory_profile != args.profile:
+            profiler.write_report(args.memory_profile)
+        if args.metrics_file:
+            _write_metrics(args.metrics_file, succeeded)
+        profiler.disable()
+
+
+def _run(args: argparse.Namespace):
     # Set up debug logging if requested
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -988,17 +1380,6 @@ def main():
     config = configparser.ConfigParser()
     config.read(os.path.expanduser(args.config_file))
 
-    # Initialize Plaid client
-    configuration = Configuration(
-        host=Environment.Production,
-        api_key={
-            "clientId": config["PLAID"]["client_id"],
-            "secret": config["PLAID"]["secret"],
-        },
-    )
-    api_client = ApiClient(configuration)
-    client = plaid_api.PlaidApi(api_client)
-
     if args.update_permissions:
         # Extract all Plaid items from beancount file
         items = _get_plaid_items_from_beancount(args.root_file)
@@ -1038,12 +1419,13 @@ def main():
 
         # Start the webserver
         _start_update_permissions_server(
-            client,
+            _plaid_client(config),
             args.root_file,
             selected_item_id,
             account_name,
             access_token,
-            short_name
+            short_name,
+            AccountsCache.from_config(config),
         )
         return
 
@@ -1082,130 +1464,158 @@ def main():
 
         # Get selected item details and display account info
         selected_item_id, (account_name, access_token, short_name) = item_list[index]
-        _display_account_info(client, selected_item_id, access_token, short_name)
+        _display_account_info(_plaid_client(config), selected_item_id, access_token, short_name,
+                              AccountsCache.from_config(config))
         return
 
-    if args.sync_transactions:
+    if args.sync_transactions or args.replay:
+        from beancount.parser import printer
+        from plaid_journal import JournalingPlaidApi, JournalWriter, ReplayPlaidApi
+
         # Fetch transactions
-        transactions, cursor_directives = _update_transactions(client, args.root_file, args.debug)        
-        investment_transactions = _update_investments(client, args.root_file)
+        journal = None
+        accounts_cache = None
+        if args.replay:
+            client = InstrumentedPlaidApi(ReplayPlaidApi(args.replay))
+            logger.info(f"Replaying run {client.run} from {args.replay}")
+        else:
+            client = _plaid_client(config)
+            accounts_cache = AccountsCache.from_config(config)
+            if args.journal:
+                journal = JournalWriter(args.journal)
+                client = JournalingPlaidApi(client, journal)
+        try:
+            with profiler.phase("fetch_transactions"):
+                transactions, cursor_directives = _update_transactions(client, args.root_file, args.debug, accounts_cache)
+            with profiler.phase("fetch_investments"):
+                investment_transactions = _update_investments(client, args.root_file, accounts_cache)
+        finally:
+            if journal is not None:
+                journal.close()
+                logger.info(f"Recorded {journal.calls} Plaid calls in {args.journal}")
         
         # Generate Beancount entries
-        from transactions.beancount_renderer import BeancountRenderer
-        renderer = BeancountRenderer(transactions, investment_transactions)
-        entries = [renderer._to_beancount(transaction) for transaction in transactions] + [renderer._to_investment_beancount(transaction) for transaction in investment_transactions]
+        from transactions.beancount_renderer import BeancountRenderer, format_entry
+        from transactions.beancount_writer import AccountFileWriter, ensure_shards_included, shard_path
+        with profiler.phase("render"):
+            renderer = BeancountRenderer(transactions, investment_transactions)
+            entries = [renderer._to_beancount(transaction) for transaction in transactions] + [renderer._to_investment_beancount(transaction) for transaction in investment_transactions]
+        profiler.count("entries_rendered", len(entries))
         logger.info(f"Generated {len(entries)} entries")
                 
         # Group transactions by account
-        account_entries = {}
-        for entry in entries:
-            # Check all postings to determine which file to write to
-            if isinstance(entry, data.Transaction) and entry.postings:
-                logger.debug(f"Processing entry: {entry}")
-                matching_account = None
-
-                # Try to find a matching account by checking all postings
-                for posting in entry.postings:
-                    account = posting.account
-                    # Find the corresponding Account object for this beancount account name
-                    # First check for exact match
-                    matching_account = next((t.account for t in transactions + investment_transactions
-                                          if t.account.beancount_name == account), None)
-                    if matching_account:
-                        break
-
-                    # Then check if the transaction account is a prefix of the posting account
-                    # (e.g., Assets:Vanguard:Brokerage matches Assets:Vanguard:Brokerage:Cash)
-                    matching_account = next((t.account for t in transactions + investment_transactions
-                                          if account.startswith(t.account.beancount_name + ":")), None)
-                    if matching_account:
-                        break
-
-                if matching_account and matching_account.transaction_file:
-                    if matching_account.transaction_file not in account_entries:
-                        account_entries[matching_account.transaction_file] = []
-                    account_entries[matching_account.transaction_file].append(entry)
-                else:
-                    logger.warning(f"No matching account found for {entry}")
-            else:
-                logger.debug(f"Skipping entry: {entry}")
-                logger.debug(f"Entry type: {type(entry)}")
-                logger.debug(f"Entry postings: {entry.postings}")
-        
+        with profiler.phase("route"):
+            account_entries = _route_entries(entries, [t.account for t in transactions + investment_transactions])
+
         # Write transactions to their respective account files
         base_dir = os.path.dirname(os.path.abspath(args.root_file))
-        for file_path, account_transactions in account_entries.items():
-            logger.info(f"Looking for transactions to write for {file_path}")
-            # Ensure the full path exists
-            full_path = os.path.join(base_dir, file_path)
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            
-            # Find the newest transaction date and collect existing transaction IDs
-            newest_date = None
-            existing_transaction_ids = set()
-            if os.path.exists(full_path):
-                entries, errors, options = loader.load_file(full_path)
-                if errors:
-                    logger.debug(f"Validation errors loading {full_path} (expected when loading individual files): {errors}")
-                
-                # Find the newest transaction and collect all transaction IDs
-                for entry in entries:
-                    if isinstance(entry, data.Transaction) and entry.meta and 'plaid_transaction_id' in entry.meta:
-                        if newest_date is None or entry.date > newest_date:
-                            newest_date = entry.date
-                        existing_transaction_ids.add(entry.meta['plaid_transaction_id'])
-            
-            # Filter transactions to only include those newer than the newest existing transaction
-            # and not already in the file
-            new_transactions = []
-            if newest_date is None:
-                new_transactions = account_transactions
-            else:
-                for transaction in account_transactions:
-                    if (transaction.date > newest_date and 
-                        transaction.meta.get('plaid_transaction_id') not in existing_transaction_ids):
+        merge = args.insert_mode == "merge"
+        writer = AccountFileWriter(fsync=args.fsync, merge=merge)
+        account_shards = {}
+        with profiler.phase("dedup"):
+            for file_path, account_transactions in account_entries.items():
+                logger.info(f"Looking for transactions to write for {file_path}")
+                # Ensure the full path exists
+                full_path = os.path.join(base_dir, file_path)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+                if not args.shard_by:
+                    targets = {full_path: account_transactions}
+                    newest_date, existing_transaction_ids = _existing_plaid_transactions(full_path)
+                else:
+                    # Only the account file's own entries and the shards being written to are
+                    # parsed; the account file's includes are not followed.
+                    targets = {}
+                    for transaction in account_transactions:
+                        targets.setdefault(shard_path(full_path, transaction.date, args.shard_by), []).append(transaction)
+                    account_shards[full_path] = list(targets)
+                    newest_date, existing_transaction_ids = _existing_plaid_transactions(full_path, follow_includes=False)
+
+                for target_path, target_transactions in targets.items():
+                    target_newest_date, target_transaction_ids = newest_date, existing_transaction_ids
+                    if target_path != full_path:
+                        shard_newest_date, shard_transaction_ids = _existing_plaid_transactions(target_path, follow_includes=False)
+                        target_transaction_ids = existing_transaction_ids | shard_transaction_ids
+                        if shard_newest_date is not None and (newest_date is None or shard_newest_date > newest_date):
+                            target_newest_date = shard_newest_date
+
+                    # Filter out transactions already in the file. When appending, also skip anything
+                    # not newer than the newest existing transaction; merging inserts late-posting
+                    # transactions at their chronological position instead.
+                    new_transactions = []
+                    for transaction in target_transactions:
+                        if transaction.meta.get('plaid_transaction_id') in target_transaction_ids:
+                            continue
+                        if not merge and target_newest_date is not None and transaction.date <= target_newest_date:
+                            continue
                         new_transactions.append(transaction)
-            
-            # Write new transactions to file
-            if new_transactions:
-                # Sort transactions by date in ascending order
-                new_transactions.sort(key=lambda x: x.date)
-                with open(full_path, 'a') as f:
-                    for transaction in new_transactions:
-                        f.write(printer.format_entry(transaction) + '\n')
-                logger.info(f"Successfully wrote {len(new_transactions)} transactions to {full_path}")
+                    profiler.count("duplicates_skipped", len(target_transactions) - len(new_transactions))
 
-        # Write cursor directives to file
-        cursors_file = os.path.join(base_dir, "plaid_cursors.beancount")
-        with open(cursors_file, 'w') as f:
-            # Group cursor directives by account
-            account_cursors = {}
-            for directive in cursor_directives:
-                account = directive.values[0][0]
-                if account not in account_cursors or directive.date > account_cursors[account].date:
-                    account_cursors[account] = directive
-
-            # Store cursors for investment transactions
-            for transaction in investment_transactions:
-                cursor_directive = Custom(
-                    date=date.today(),
-                    meta={"plaid_transaction_id": f"cursor_{date.today()}"},
-                    type="plaid_cursor",
-                    values=[(transaction.account.beancount_name, "string"), (transaction.investment_transaction_id, "string"), (transaction.account.item.item_id, "string")]
-                )
-                # Update account cursors with investment transaction cursors
-                account = transaction.account.beancount_name
-                if account not in account_cursors or cursor_directive.date > account_cursors[account].date:
-                    account_cursors[account] = cursor_directive
+                    # Queue new transactions for this file, sorted by date in ascending order
+                    new_transactions.sort(key=lambda x: x.date)
+                    for transaction in new_transactions:
+                        writer.add(target_path, format_entry(transaction) + '\n', transaction.date)
+
+        # Write each file's new transactions in a single batch
+        with profiler.phase("write"):
+            results = writer.flush()
+        for result in results:
+            relative_path = os.path.relpath(result.path, base_dir)
+            profiler.count("files_written")
+            profiler.count("entries_written", result.entries, label=relative_path)
+            profiler.count("bytes_written", result.bytes, label=relative_path)
+            logger.info(f"Successfully wrote {result.entries} transactions ({result.bytes} bytes) to {result.path}")
+
+        # Make sure every shard that now exists is included from its account file
+        for full_path, shards in account_shards.items():
+            added = ensure_shards_included(full_path, [shard for shard in shards if os.path.exists(shard)])
+            if added:
+                logger.info(f"Added includes for {', '.join(added)} to {full_path}")
+
+        if args.replay:
+            # The journal's cursors are those of an earlier run; writing them would
+            # rewind every item, and drop the cursors of items the journal lacks
+            logger.info(f"Leaving plaid_cursors.beancount unchanged when replaying {args.replay}")
+        else:
+            # Write cursor directives to file
+            cursors_file = os.path.join(base_dir, "plaid_cursors.beancount")
+            if profiler.enabled:
+                _record_cursor_ages(cursors_file, cursor_directives)
+            with profiler.phase("write_cursors"), open(cursors_file, 'w') as f:
+                # Group cursor directives by account
+                account_cursors = {}
+                for directive in cursor_directives:
+                    account = directive.values[0][0]
+                    if account not in account_cursors or directive.date > account_cursors[account].date:
+                        account_cursors[account] = directive
+
+                # Store cursors for investment transactions
+                for transaction in investment_transactions:
+                    cursor_directive = Custom(
+                        date=date.today(),
+                        meta={"plaid_transaction_id": f"cursor_{date.today()}"},
+                        type="plaid_cursor",
+                        values=[(transaction.account.beancount_name, "string"), (transaction.investment_transaction_id, "string"), (transaction.account.item.item_id, "string")]
+                    )
+                    # Update account cursors with investment transaction cursors
+                    account = transaction.account.beancount_name
+                    if account not in account_cursors or cursor_directive.date > account_cursors[account].date:
+                        account_cursors[account] = cursor_directive
 
-            # Write only the latest cursor for each account
-            for directive in account_cursors.values():
-                logger.debug(f"Writing cursor directive: {directive}")
-                f.write(printer.format_entry(directive) + '\n')
+                # Write only the latest cursor for each account
+                for directive in account_cursors.values():
+                    logger.debug(f"Writing cursor directive: {directive}")
+                    f.write(printer.format_entry(directive) + '\n')
 
-        logger.info(f"Successfully synced {len(account_cursors)} cursors to {cursors_file}")
+            logger.info(f"Successfully synced {len(account_cursors)} cursors to {cursors_file}")
+        for line in plaid_api_stats.summary_lines():
+            logger.info(line)
 
     if args.recategorize:
+        if args.dry_run:
+            change_count = _preview_recategorization(args.root_file, args.start_date, args.end_date, args.dry_run_format)
+            logger.info(f"{change_count} transactions would be recategorized")
+            return
         recategorized_count = _recategorize_transactions(args.root_file, args.start_date, args.end_date)
         logger.info(f"Recategorized {recategorized_count} transactions")
 
@@ -0,0 +1,263 @@
+"""A journal of raw Plaid responses, and a client that replays one.
+
+A sync run with --journal appends every Plaid call it makes to a gzip-compressed
+JSON lines file. --replay reads a journal back through ReplayPlaidApi, which
+answers the same calls from it, so the categorize, render and write pipeline can
+be rerun without API calls (after a renderer fix, or as a repeatable workload).
+
+The journal is content-addressed: each response body is stored once, as a "blob"
+record keyed by the SHA-256 of its raw bytes, and "call" records refer to it by
+that hash. Requests are stored with the access token replaced by its SHA-256, so
+a journal holds no credentials; the journal still holds the account data itself,
+and is created readable by its owner only. Records look like:
+
+    {"type": "run", "run": "...", "started": "2026-01-05T06:00:00"}
+    {"type": "blob", "sha256": "...", "body": {...}}
+    {"type": "call", "run": "...", "endpoint": "transactions_sync", "token": "...",
+     "request": {...}, "response": "<blob sha256>"}
+    {"type": "call", ..., "error": {"status": 400, "reason": "...", "body": "..."}}
+
+Each run appends a new gzip member. A truncated last member (from a run that was
+killed) is ignored when reading, and cut off before the next run appends its own.
+"""
+import gzip
+import hashlib
+import json
+import os
+import uuid
+import zlib
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+JOURNAL_VERSION = 1
+
+# Request fields that identify the caller rather than the request
+_CREDENTIALS = ("access_token", "client_id", "secret")
+
+
+def hash_token(access_token: str) -> str:
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    # Plaid SDK enums (e.g. AccountType) hold their value in .value
+    if hasattr(value, "value"):
+        return value.value
+    return str(value)
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=_json_default, sort_keys=True, separators=(",", ":"))
+
+
+def _request_fields(request) -> Dict[str, object]:
+    if request is None:
+        return {}
+    fields = request.to_dict() if hasattr(request, "to_dict") else dict(request)
+    return {key: value for key, value in fields.items() if key not in _CREDENTIALS}
+
+
+def _complete_length(path: str) -> int:
+    """Length of the journal's leading complete gzip members, in bytes."""
+    end = offset = 0
+    decompressor = zlib.decompressobj(wbits=31)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                return end
+            while chunk:
+                try:
+                    decompressor.decompress(chunk)
+                except zlib.error:
+                    return end
+                if decompressor.eof:
+                    offset += len(chunk) - len(decompressor.unused_data)
+                    end = offset
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+                else:
+                    offset += len(chunk)
+                    chunk = b""
+
+
+def read_journal(path: str) -> Iterator[dict]:
+    """Yield the journal's records, stopping at a truncated last gzip member."""
+    with gzip.open(path, "rt") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, zlib.error, gzip.BadGzipFile, json.JSONDecodeError):
+            return
+
+
+class JournalWriter:
+    """Appends one run's Plaid calls to a journal."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.run = uuid.uuid4().hex
+        self.calls = 0
+        self._blobs = set()
+        if os.path.exists(path):
+            # Cut off a killed run's truncated member, or this run would be unreadable after it
+            length = _complete_length(path)
+            if length < os.path.getsize(path):
+                os.truncate(path, length)
+            self._blobs = {record["sha256"] for record in read_journal(path) if record["type"] == "blob"}
+        else:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._file = gzip.open(path, "at")
+        self._write({"type": "run", "run": self.run, "started": datetime.now().isoformat(timespec="seconds"),
+                     "version": JOURNAL_VERSION})
+
+    def _write(self, record: dict):
+        self._file.write(_dumps(record) + "\n")
+
+    def _blob(self, raw: bytes) -> str:
+        sha256 = hashlib.sha256(raw).hexdigest()
+        if sha256 not in self._blobs:
+            self._blobs.add(sha256)
+            self._write({"type": "blob", "sha256": sha256, "body": json.loads(raw)})
+        return sha256
+
+    def record(self, endpoint: str, request, raw_response: Optional[bytes] = None,
+               response=None, error: Optional[Exception] = None):
+        """Record a call and its raw response body, or the Plaid error it failed with.
+
+        Without the raw body (clients other than the Plaid SDK's), the response
+        object is serialized instead.
+        """
+        access_token = request.get("access_token") if hasattr(request, "get") else None
+        record = {
+            "type": "call",
+            "run": self.run,
+            "endpoint": endpoint,
+            "token": hash_token(access_token) if access_token else None,
+            "request": json.loads(_dumps(_request_fields(request))),
+        }
+        if error is not None:
+            record["error"] = {
+                "status": getattr(error, "status", None),
+                "reason": getattr(error, "reason", None) or str(error),
+                "body": getattr(error, "body", None),
+            }
+        else:
+            if raw_response is None:
+                raw_response = _dumps(response).encode()
+            record["response"] = self._blob(raw_response)
+        self._write(record)
+        self.calls += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class JournalingPlaidApi:
+    """Wraps a PlaidApi client, recording every endpoint call in a JournalWriter.
+
+    Raw response bodies come from the SDK's last raw response, so one wrapped
+    client must not be shared between threads.
+    """
+
+    def __init__(self, client, journal: JournalWriter):
+        self._client = client
+        self.journal = journal
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def call(request=None, *args, **kwargs):
+            from plaid.exceptions import ApiException
+
+            try:
+                response = attribute(request, *args, **kwargs) if request is not None else attribute(*args, **kwargs)
+            except ApiException as e:
+                self.journal.record(name, request, error=e)
+                raise
+            self.journal.record(name, request, self._raw_response(), response)
+            return response
+
+        return call
+
+    def _raw_response(self) -> Optional[bytes]:
+        last_response = getattr(getattr(self._client, "api_client", None), "last_response", None)
+        data = getattr(last_response, "data", None)
+        # The SDK decodes the body to str
+        return data.encode() if isinstance(data, str) else data
+
+
+class ReplayPlaidApi:
+    """Answers Plaid calls from a journal instead of the API.
+
+    Calls are answered per endpoint and item, in the order they were recorded,
+    from the journal's last run unless another run is given. Responses are the
+    recorded JSON bodies as plain dicts, the shape the sync code reads them in;
+    recorded errors are raised again as ApiExceptions, as is a call the journal
+    has no (more) responses for.
+    """
+
+    def __init__(self, path: str, run: Optional[str] = None):
+        self.path = path
+        blobs = {}
+        calls: Dict[str, List[dict]] = {}
+        runs = []
+        for record in read_journal(path):
+            if record["type"] == "blob":
+                blobs[record["sha256"]] = record["body"]
+            elif record["type"] == "run":
+                runs.append(record["run"])
+                calls[record["run"]] = []
+            elif record["type"] == "call":
+                calls.setdefault(record["run"], []).append(record)
+        if run is None:
+            if not runs:
+                raise ValueError(f"{path} has no recorded runs")
+            run = runs[-1]
+        elif run not in calls:
+            raise ValueError(f"{path} has no run {run}")
+        self.run = run
+        self.calls = 0
+        self._blobs = blobs
+        self._queues: Dict[Tuple[str, Optional[str]], deque] = {}
+        for record in calls[run]:
+            self._queues.setdefault((record["endpoint"], record["token"]), deque()).append(record)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(request=None, *args, **kwargs):
+            from plaid.exceptions import ApiException
+
+            access_token = request.get("access_token") if hasattr(request, "get") else None
+            queue = self._queues.get((name, hash_token(access_token) if access_token else None))
+            if not queue:
+                raise ApiException(reason=f"{self.path} has no recorded {name} response for this item")
+            record = queue.popleft()
+            self.calls += 1
+            if "error" in record:
+                error = ApiException(status=record["error"]["status"], reason=record["error"]["reason"])
+                error.body = record["error"]["body"]
+                raise error
+            return self._blobs[record["response"]]
+
+        return call
@@ -30,26 +30,31 @@ import sys
 from beancount import loader
 from beancount.core.data import Open
 
+from accounts_cache import AccountsCache
+from instrumentation import InstrumentedPlaidApi, plaid_api_stats
+
 # Global variables (will be set by command-line args)
 config = None
 client = None
 root_file = None
+accounts_cache = None
 
 def load_config_and_client(config_file):
     """Load config and initialize Plaid client."""
-    global config, client
+    global config, client, accounts_cache
     config = configparser.ConfigParser()
     config.read(os.path.expanduser(config_file))
 
     configuration = Configuration(
-        host=Environment.Production,
+        host=config["PLAID"].get("host", Environment.Production),
         api_key={
             "clientId": config["PLAID"]["client_id"],
             "secret": config["PLAID"]["secret"],
         },
     )
     api_client = ApiClient(configuration)
-    client = plaid_api.PlaidApi(api_client)
+    client = InstrumentedPlaidApi(plaid_api.PlaidApi(api_client))
+    accounts_cache = AccountsCache.from_config(config)
 
 def get_plaid_items_from_beancount(beancount_file):
     """Extract Plaid items from beancount file.
@@ -201,22 +206,35 @@ def index():
         all_items = get_plaid_items_from_beancount(root_file)
 
         for item_id, (account_name, access_token, short_name) in all_items.items():
-            try:
-                # Try to get account information to check if reauth is needed
-                accounts_request = AccountsGetRequest(
-                    access_token=access_token
-                )
-                client.accounts_get(accounts_request)
-            except ApiException as e:
-                if e.status == 400 and "ITEM_LOGIN_REQUIRED" in str(e):
-                    items_needing_auth.append({
-                        "item_id": item_id,
-                        "account_name": account_name,
-                        "access_token": access_token,
-                        "short_name": short_name
-                    })
-                else:
-                    print(f"Error checking item {short_name}: {e}")
+            # A fresh cached status saves the health check
+            cached = accounts_cache.get(item_id, access_token) if accounts_cache is not None else None
+            if cached is not None:
+                login_required = cached["login_required"]
+            else:
+                login_required = False
+                try:
+                    # Try to get account information to check if reauth is needed
+                    accounts_request = AccountsGetRequest(
+                        access_token=access_token
+                    )
+                    accounts_response = client.accounts_get(accounts_request)
+                    if accounts_cache is not None:
+                        accounts_cache.store(item_id, access_token, accounts_response["accounts"],
+                                             accounts_response.get("item"))
+                except ApiException as e:
+                    if e.status == 400 and "ITEM_LOGIN_REQUIRED" in str(e):
+                        login_required = True
+                        if accounts_cache is not None:
+                            accounts_cache.mark_login_required(item_id, access_token)
+                    else:
+                        print(f"Error checking item {short_name}: {e}")
+            if login_required:
+                items_needing_auth.append({
+                    "item_id": item_id,
+                    "account_name": account_name,
+                    "access_token": access_token,
+                    "short_name": short_name
+                })
     except Exception as e:
         print(f"Error getting items: {e}")
         return f"Error loading items from {root_file}: {e}"
@@ -267,6 +285,11 @@ def exchange_token():
 
         # Update the beancount file
         update_access_token_in_beancount(root_file, account_name, new_access_token)
+        # The item's cached login-required status is stale now
+        if accounts_cache is not None:
+            for item_id, (item_account_name, _, _) in get_plaid_items_from_beancount(root_file).items():
+                if item_account_name == account_name:
+                    accounts_cache.invalidate(item_id)
 
         return jsonify({"success": True})
     except Exception as e:
@@ -304,4 +327,8 @@ if __name__ == '__main__':
     print(f"Using root file: {root_file}")
     print(f"Open http://localhost:{args.port} in your browser")
 
-    app.run(port=args.port, debug=False) 
\ No newline at end of file
+    app.run(port=args.port, debug=False)
+
+    # The server has been stopped (Ctrl-C); report the Plaid calls it made
+    for line in plaid_api_stats.summary_lines():
+        print(line)
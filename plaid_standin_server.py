@@ -0,0 +1,358 @@
+"""A local stand-in for the Plaid API, for offline development and load testing.
+
+Implements the endpoints this project calls (/accounts/get, /transactions/sync,
+/investments/transactions/get, /link/token/create and /item/public_token/exchange)
+with responses the Plaid SDK accepts. Point a client at it by setting `host` in the
+[PLAID] section of the config file:
+
+    [PLAID]
+    client_id = anything
+    secret = anything
+    host = http://localhost:5001
+
+Any access token is accepted; its item's accounts and transactions are generated
+from the token, so the same token always sees the same data. Items can also be
+loaded from a JSON file with --fixtures.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from flask import Flask, jsonify, request
+
+# Plaid caps both endpoints' page sizes at 500
+MAX_SYNC_COUNT = 500
+MAX_INVESTMENTS_COUNT = 500
+
+PAYEES = ["STARBUCKS", "WHOLE FOODS", "SHELL", "AMAZON", "TARGET", "COSTCO", "UBER", "NETFLIX", "PG&E", "CVS"]
+
+CATEGORIES = [
+    ("FOOD_AND_DRINK", "FOOD_AND_DRINK_COFFEE"),
+    ("FOOD_AND_DRINK", "FOOD_AND_DRINK_GROCERIES"),
+    ("TRANSPORTATION", "TRANSPORTATION_GAS"),
+    ("GENERAL_MERCHANDISE", "GENERAL_MERCHANDISE_ONLINE_MARKETPLACES"),
+    ("ENTERTAINMENT", "ENTERTAINMENT_TV_AND_MOVIES"),
+    ("RENT_AND_UTILITIES", "RENT_AND_UTILITIES_GAS_AND_ELECTRICITY"),
+]
+
+SECURITIES = [("VTSAX", False), ("VBTLX", False), ("VMFXX", True)]
+
+
+def _account(account_id: str, name: str, type_: str, subtype: str) -> dict:
+    return {
+        "account_id": account_id,
+        # /investments/transactions/get requires margin_loan_amount on every account it returns
+        "balances": {"available": None, "current": 1000.0, "limit": None, "margin_loan_amount": None,
+                     "iso_currency_code": "USD", "unofficial_currency_code": None},
+        "mask": account_id[-4:],
+        "name": name,
+        "official_name": None,
+        "type": type_,
+        "subtype": subtype,
+    }
+
+
+def _transaction(rng: random.Random, transaction_id: str, account_id: str, day: date) -> dict:
+    payee = rng.choice(PAYEES)
+    primary, detailed = rng.choice(CATEGORIES)
+    return {
+        "transaction_id": transaction_id,
+        "account_id": account_id,
+        "amount": rng.randrange(100, 20000) / 100,
+        "iso_currency_code": "USD",
+        "unofficial_currency_code": None,
+        "date": day.isoformat(),
+        "datetime": None,
+        "authorized_date": day.isoformat(),
+        "authorized_datetime": None,
+        "name": payee,
+        "merchant_name": payee.title(),
+        "website": None,
+        "check_number": None,
+        "pending": False,
+        "payment_channel": "in store",
+        "transaction_code": None,
+        "personal_finance_category": {"primary": primary, "detailed": detailed, "confidence_level": "HIGH"},
+    }
+
+
+def _security(ticker: str, is_cash_equivalent: bool) -> dict:
+    return {
+        "security_id": f"security-{ticker}",
+        "isin": None,
+        "cusip": None,
+        "sedol": None,
+        "institution_security_id": None,
+        "institution_id": None,
+        "proxy_security_id": None,
+        "name": f"{ticker} Fund",
+        "ticker_symbol": ticker,
+        "is_cash_equivalent": is_cash_equivalent,
+        "type": "cash" if is_cash_equivalent else "mutual fund",
+        "close_price": None,
+        "close_price_as_of": None,
+        "iso_currency_code": "USD",
+        "unofficial_currency_code": None,
+        "market_identifier_code": None,
+        "sector": None,
+        "industry": None,
+        "cfi_code": None,
+        "figi": None,
+        "option_contract": None,
+        "fixed_income": None,
+    }
+
+
+def _investment_transaction(rng: random.Random, transaction_id: str, account_id: str, day: date) -> dict:
+    ticker, _ = rng.choice(SECURITIES)
+    type_, subtype = rng.choice([("buy", "buy"), ("sell", "sell"), ("cash", "dividend")])
+    quantity = rng.randrange(1, 1000) / 10
+    price = rng.randrange(1000, 50000) / 100
+    return {
+        "investment_transaction_id": transaction_id,
+        "account_id": account_id,
+        "security_id": f"security-{ticker}",
+        "date": day.isoformat(),
+        "name": f"{subtype.upper()} {ticker}",
+        "quantity": quantity,
+        "amount": round(quantity * price, 2),
+        "price": price,
+        "fees": None,
+        "type": type_,
+        "subtype": subtype,
+        "iso_currency_code": "USD",
+        "unofficial_currency_code": None,
+        "cancel_transaction_id": None,
+    }
+
+
+def synthesize_item(access_token: str, accounts: int = 2, transactions: int = 500,
+                    investment_transactions: int = 100, end: Optional[date] = None) -> dict:
+    """Generate an item for an access token: `accounts` depository accounts and one
+    investment account, with transactions spread over the year before `end`."""
+    rng = random.Random(access_token)
+    end = end or date.today()
+    item_id = f"item-{uuid.UUID(int=rng.getrandbits(128)).hex[:12]}"
+    bank_accounts = [
+        _account(f"{item_id}-account-{i}", f"Checking {i}", "depository", "checking") for i in range(accounts)
+    ]
+    brokerage = _account(f"{item_id}-brokerage", "Brokerage", "investment", "brokerage")
+    return {
+        "item_id": item_id,
+        "accounts": bank_accounts + [brokerage],
+        "transactions": [
+            _transaction(rng, f"{item_id}-txn-{n}", rng.choice(bank_accounts)["account_id"],
+                         end - timedelta(days=rng.randrange(365)))
+            for n in range(transactions)
+        ],
+        "investment_transactions": [
+            _investment_transaction(rng, f"{item_id}-inv-{n}", brokerage["account_id"],
+                                    end - timedelta(days=rng.randrange(365)))
+            for n in range(investment_transactions)
+        ],
+        "securities": [_security(ticker, cash) for ticker, cash in SECURITIES],
+    }
+
+
+class PlaidError(Exception):
+    """An error returned in Plaid's error format."""
+
+    def __init__(self, status: int, error_type: str, error_code: str, error_message: str):
+        super().__init__(error_message)
+        self.status = status
+        self.error_type = error_type
+        self.error_code = error_code
+        self.error_message = error_message
+
+
+class StandIn:
+    """The stand-in's items and fault injection.
+
+    latency: seconds added to every request, plus up to `jitter` more.
+    rate_limit_every: every Nth request fails with RATE_LIMIT_EXCEEDED (0: never).
+    login_required: access tokens or item ids whose requests fail with ITEM_LOGIN_REQUIRED.
+    """
+
+    def __init__(self, items: Optional[Dict[str, dict]] = None, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit_every: int = 0, login_required=(), accounts: int = 2, transactions: int = 500,
+                 investment_transactions: int = 100):
+        self.items = dict(items or {})
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.login_required = set(login_required)
+        self.synthesize = {"accounts": accounts, "transactions": transactions,
+                           "investment_transactions": investment_transactions}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def item(self, access_token: Optional[str]) -> dict:
+        if not access_token:
+            raise PlaidError(400, "INVALID_REQUEST", "MISSING_FIELDS", "the following required fields are missing: access_token")
+        with self._lock:
+            if access_token not in self.items:
+                self.items[access_token] = synthesize_item(access_token, **self.synthesize)
+            item = self.items[access_token]
+        if access_token in self.login_required or item["item_id"] in self.login_required:
+            raise PlaidError(400, "ITEM_ERROR", "ITEM_LOGIN_REQUIRED",
+                             "the login details of this item have changed (credentials, MFA, or required user action) "
+                             "and a user login is required to update this information")
+        return item
+
+    def before_request(self):
+        """Apply latency and rate limiting; raise PlaidError for a rate-limited request."""
+        with self._lock:
+            self.requests += 1
+            count = self.requests
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.rate_limit_every and count % self.rate_limit_every == 0:
+            raise PlaidError(429, "RATE_LIMIT_EXCEEDED", "TRANSACTIONS_SYNC_LIMIT",
+                             "rate limit exceeded for attempts to access this item. please try again later")
+
+
+def _item_summary(item: dict) -> dict:
+    return {
+        "item_id": item["item_id"],
+        "webhook": None,
+        "error": None,
+        "available_products": [],
+        "billed_products": ["transactions", "investments"],
+        "consent_expiration_time": None,
+        "update_type": "background",
+    }
+
+
+def create_app(standin: StandIn) -> Flask:
+    app = Flask(__name__)
+
+    def request_id() -> str:
+        return uuid.uuid4().hex[:16]
+
+    @app.errorhandler(PlaidError)
+    def plaid_error(e):
+        return jsonify({
+            "error_type": e.error_type,
+            "error_code": e.error_code,
+            "error_message": e.error_message,
+            "display_message": None,
+            "request_id": request_id(),
+        }), e.status
+
+    @app.before_request
+    def before_request():
+        standin.before_request()
+
+    @app.route("/accounts/get", methods=["POST"])
+    def accounts_get():
+        item = standin.item(request.get_json().get("access_token"))
+        return jsonify({"accounts": item["accounts"], "item": _item_summary(item), "request_id": request_id()})
+
+    @app.route("/transactions/sync", methods=["POST"])
+    def transactions_sync():
+        body = request.get_json()
+        item = standin.item(body.get("access_token"))
+        # Cursors are the offset of the next transaction to send
+        cursor = body.get("cursor") or ""
+        try:
+            offset = int(cursor.split("-")[-1]) if cursor else 0
+        except ValueError:
+            raise PlaidError(400, "INVALID_REQUEST", "INVALID_FIELD", "cursor is invalid")
+        count = min(body.get("count") or 100, MAX_SYNC_COUNT)
+        added = item["transactions"][offset:offset + count]
+        next_offset = offset + len(added)
+        return jsonify({
+            "transactions_update_status": "HISTORICAL_UPDATE_COMPLETE",
+            "accounts": item["accounts"],
+            "added": added,
+            "modified": [],
+            "removed": [],
+            "next_cursor": f"standin-cursor-{next_offset}",
+            "has_more": next_offset < len(item["transactions"]),
+            "request_id": request_id(),
+        })
+
+    @app.route("/investments/transactions/get", methods=["POST"])
+    def investments_transactions_get():
+        body = request.get_json()
+        item = standin.item(body.get("access_token"))
+        start, end = body.get("start_date"), body.get("end_date")
+        options = body.get("options") or {}
+        offset = options.get("offset", 0)
+        count = min(options.get("count", 100), MAX_INVESTMENTS_COUNT)
+        matching = [
+            transaction for transaction in item["investment_transactions"]
+            if (not start or transaction["date"] >= start) and (not end or transaction["date"] <= end)
+        ]
+        return jsonify({
+            "item": _item_summary(item),
+            "accounts": item["accounts"],
+            "securities": item["securities"],
+            "investment_transactions": matching[offset:offset + count],
+            "total_investment_transactions": len(matching),
+            "request_id": request_id(),
+        })
+
+    @app.route("/link/token/create", methods=["POST"])
+    def link_token_create():
+        body = request.get_json()
+        if body.get("access_token"):
+            # Update mode: the token has to belong to an item
+            standin.item(body["access_token"])
+        expiration = datetime.now(timezone.utc) + timedelta(hours=4)
+        return jsonify({
+            "link_token": f"link-standin-{uuid.uuid4()}",
+            "expiration": expiration.isoformat().replace("+00:00", "Z"),
+            "request_id": request_id(),
+        })
+
+    @app.route("/item/public_token/exchange", methods=["POST"])
+    def item_public_token_exchange():
+        public_token = request.get_json().get("public_token")
+        if not public_token:
+            raise PlaidError(400, "INVALID_REQUEST", "MISSING_FIELDS", "the following required fields are missing: public_token")
+        access_token = f"access-standin-{public_token}"
+        item = standin.item(access_token)
+        return jsonify({"access_token": access_token, "item_id": item["item_id"], "request_id": request_id()})
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Plaid API stand-in')
+    parser.add_argument('--port', type=int, default=5001, help='Port to run the server on (default: 5001)')
+    parser.add_argument('--fixtures', help='JSON file mapping access tokens to items, instead of generated items')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many more seconds per request (default: 0)')
+    parser.add_argument('--rate-limit-every', type=int, default=0,
+                        help='Fail every Nth request with RATE_LIMIT_EXCEEDED (default: never)')
+    parser.add_argument('--login-required', action='append', default=[], metavar='TOKEN_OR_ITEM_ID',
+                        help='Fail requests for this item with ITEM_LOGIN_REQUIRED (can be given more than once)')
+    parser.add_argument('--transactions', type=int, default=500,
+                        help='Transactions per generated item (default: 500)')
+    parser.add_argument('--investment-transactions', type=int, default=100,
+                        help='Investment transactions per generated item (default: 100)')
+    args = parser.parse_args()
+
+    items = None
+    if args.fixtures:
+        with open(args.fixtures) as f:
+            items = json.load(f)
+
+    standin = StandIn(
+        items=items,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_every=args.rate_limit_every,
+        login_required=args.login_required,
+        transactions=args.transactions,
+        investment_transactions=args.investment_transactions,
+    )
+    print(f"Starting Plaid stand-in on http://localhost:{args.port}")
+    # Threaded, so concurrent syncs are served concurrently
+    create_app(standin).run(port=args.port, threaded=True)
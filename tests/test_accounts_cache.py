@@ -0,0 +1,165 @@
+"""
+The accounts_get cache shared by syncs, --show-accounts and the link server.
+"""
+import configparser
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from plaid.exceptions import ApiException
+from plaid.model.account_type import AccountType
+
+import main
+import plaid_link_server
+import accounts_cache
+from accounts_cache import AccountsCache
+from test_import import DummyPlaidApi, create_temp_beancount_file
+
+
+def _accounts(*account_ids, current=100.0):
+    return [
+        {"account_id": account_id, "type": "depository", "subtype": "checking", "mask": "0000",
+         "name": account_id, "balances": {"current": current, "available": None, "iso_currency_code": "USD"}}
+        for account_id in account_ids
+    ]
+
+
+def test_entries_expire_persist_and_are_keyed_by_token():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "cache", "accounts.json")
+        cache = AccountsCache(path, ttl=60)
+        assert cache.get("item-1", "token-1") is None
+
+        cache.store("item-1", "token-1", _accounts("acc1", "acc2"), {"item_id": "item-1", "institution_id": "ins_1"})
+        fetched_at = cache.get("item-1", "token-1")["fetched_at"]
+        # Another response listing only some accounts refreshes those and keeps the
+        # rest, without renewing the entry
+        cache.store_response("item-1", "token-1", {"accounts": _accounts("acc2", current=50.0)})
+        assert cache.get("item-1", "token-1")["fetched_at"] == fetched_at
+
+        entry = AccountsCache(path, ttl=60).get("item-1", "token-1")
+        assert [account["account_id"] for account in entry["accounts"]] == ["acc1", "acc2"]
+        assert entry["accounts"][1]["balances"]["current"] == 50.0
+        assert entry["item"]["institution_id"] == "ins_1"
+        assert not entry["login_required"]
+        assert AccountsCache(path, ttl=60).get("item-1", "token-2") is None
+
+        with mock.patch("time.time", return_value=entry["fetched_at"] + 61):
+            assert cache.get("item-1", "token-1") is None
+
+        cache.mark_login_required("item-1", "token-1")
+        assert cache.get("item-1", "token-1")["login_required"]
+        cache.invalidate("item-1")
+        assert cache.get("item-1", "token-1") is None
+
+        with open(path) as f:
+            assert "token-1" not in f.read()
+
+
+def test_cache_is_configured_by_ttl():
+    config = configparser.ConfigParser()
+    config["PLAID"] = {"client_id": "id", "secret": "secret"}
+    assert AccountsCache.from_config(config) is None
+    config["PLAID"]["accounts_cache_ttl"] = "300"
+    config["PLAID"]["accounts_cache"] = "/tmp/accounts.json"
+    cache = AccountsCache.from_config(config)
+    assert (cache.path, cache.ttl) == ("/tmp/accounts.json", 300.0)
+
+
+class CountingPlaidApi(DummyPlaidApi):
+    def __init__(self, login_required=False):
+        self.login_required = login_required
+        self.accounts_gets = 0
+
+    def accounts_get(self, request):
+        self.accounts_gets += 1
+        if self.login_required:
+            error = ApiException(status=400, reason="Bad Request")
+            error.body = json.dumps({"error_code": "ITEM_LOGIN_REQUIRED"})
+            raise error
+        # As the Plaid SDK returns them
+        response = super().accounts_get(request)
+        for account in response["accounts"]:
+            account["type"] = AccountType(account["type"])
+        return response
+
+
+class PagedSyncPlaidApi(DummyPlaidApi):
+    """Serves the dummy transactions in one-transaction pages, each listing the item's accounts."""
+
+    def transactions_sync(self, request):
+        response = super().transactions_sync(request)
+        page = int(request["cursor"] or 0)
+        return {
+            "added": response["added"][page:page + 1],
+            "accounts": _accounts("acc1", current=100.0 - page),
+            "has_more": page + 1 < len(response["added"]),
+            "next_cursor": str(page + 1),
+        }
+
+
+def test_sync_uses_cached_accounts():
+    temp_dir, root_file = create_temp_beancount_file()
+    try:
+        cache = AccountsCache(os.path.join(temp_dir, "accounts.json"), ttl=3600)
+        client = CountingPlaidApi()
+        first, _ = main._update_transactions(client, root_file, accounts_cache=cache)
+        second, _ = main._update_transactions(client, root_file, accounts_cache=cache)
+        assert client.accounts_gets == 1
+        # Live and cached accounts give the same plain string types
+        assert [t.account.type for t in second] == [t.account.type for t in first] == ["depository", "depository"]
+        assert {type(t.account.type) for t in first + second} == {str}
+
+        # Syncs don't cache that an item needs a new login, and check one that was
+        # marked elsewhere (e.g. by the link server) again
+        expired = CountingPlaidApi(login_required=True)
+        cache.invalidate("item1")
+        for _ in range(2):
+            assert main._update_transactions(expired, root_file, accounts_cache=cache) == ([], [])
+        assert expired.accounts_gets == 2
+        assert cache.get("item1", "access_token_123") is None
+        cache.mark_login_required("item1", "access_token_123")
+        recovered = CountingPlaidApi()
+        assert len(main._update_transactions(recovered, root_file, accounts_cache=cache)[0]) == 2
+        assert recovered.accounts_gets == 1
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_sync_stores_the_synced_accounts_once_per_item():
+    temp_dir, root_file = create_temp_beancount_file()
+    try:
+        cache = AccountsCache(os.path.join(temp_dir, "accounts.json"), ttl=3600)
+        with mock.patch.object(cache, "_save", wraps=cache._save) as save, \
+                mock.patch.object(accounts_cache, "time") as clock:
+            clock.time.side_effect = [1000.0, 2000.0]
+            transactions, _ = main._update_transactions(PagedSyncPlaidApi(), root_file, accounts_cache=cache)
+        assert len(transactions) == 2
+        # One write for accounts_get, one for the accounts of every sync page
+        assert save.call_count == 2
+        entry = cache._entries["item1"]
+        accounts = {account["account_id"]: account for account in entry["accounts"]}
+        assert accounts["acc1"]["balances"]["current"] == 99.0
+        # The sync lists all of the item's accounts, so a closed one drops out, and
+        # only accounts_get renews the entry
+        assert "acc2" not in accounts
+        assert entry["fetched_at"] == 1000.0
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_link_server_health_check_uses_cache():
+    temp_dir, root_file = create_temp_beancount_file()
+    try:
+        cache = AccountsCache(os.path.join(temp_dir, "accounts.json"), ttl=3600)
+        client = CountingPlaidApi()
+        with mock.patch.multiple(plaid_link_server, root_file=root_file, client=client, accounts_cache=cache):
+            test_client = plaid_link_server.app.test_client()
+            for _ in range(3):
+                assert test_client.get("/").status_code == 200
+        assert client.accounts_gets == 1
+        assert cache.get("item1", "access_token_123")["accounts"][0]["account_id"] == "acc1"
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,129 @@
+import os
+import sys
+from decimal import Decimal
+from datetime import date
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beancount.core.data import Cost
+from beancount.parser import printer
+
+from plaid_models import PlaidTransaction, FinanceCategory, Account, PlaidItem
+from test_investment_transactions import create_test_account, create_test_security, create_test_transaction_type
+from transaction_models import PlaidInvestmentTransaction
+from transactions.beancount_renderer import BeancountRenderer, _format_simple_transaction, format_entry
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "plaid_transactions.beancount")
+
+
+def create_test_transaction(transaction_id, name, amount, merchant_name=None, expense_account=None,
+                            detailed="FOOD_AND_DRINK_GROCERIES", currency="USD",
+                            beancount_name="Assets:Bank:Checking", txn_date=date(2024, 1, 15)):
+    """Create a PlaidTransaction like the ones built by main._update_transactions."""
+    category = None
+    if detailed is not None:
+        category = FinanceCategory(
+            primary=detailed.split("_")[0],
+            detailed=detailed,
+            description="Unknown (Plaid added a new category!)",
+            expense_account=expense_account,
+        )
+    account = Account(
+        name="Checking",
+        beancount_name=beancount_name,
+        plaid_id="acc1",
+        transaction_file="accounts/Bank/Checking.beancount",
+        item=PlaidItem(name="Bank", item_id="item1", access_token="token"),
+        type="depository",
+    )
+    return PlaidTransaction(
+        date=txn_date,
+        datetime=None,
+        authorized_date=None,
+        authorized_datetime=None,
+        name=name,
+        merchant_name=merchant_name,
+        website=None,
+        amount=Decimal(amount),
+        currency=currency,
+        check_number=None,
+        transaction_id=transaction_id,
+        account=account,
+        personal_finance_category=category,
+        personal_finance_confidence="HIGH",
+        pending=False,
+    )
+
+
+def golden_transactions():
+    """The transactions rendered in tests/golden/plaid_transactions.beancount, in order."""
+    return [
+        create_test_transaction("txn1", "STARBUCKS 1234", "5.75", merchant_name="Starbucks",
+                                expense_account="Expenses:Food:Coffee"),
+        create_test_transaction("txn2", "PAYROLL DEPOSIT", "-2500", detailed="INCOME_WAGES"),
+        create_test_transaction("txn3", 'JOE\'S "FAMOUS" PIZZA', "23.1", detailed=None),
+        create_test_transaction("txn4", "BACKSLASH \\ STORE", "0.01",
+                                expense_account="Expenses:Shopping:General-Merchandise:Online-Marketplaces"),
+        create_test_transaction("txn5", "CANADIAN TIRE", "1234567.89", currency="CAD",
+                                beancount_name="Liabilities:Credit-Card:Chase:Sapphire",
+                                expense_account="Expenses:Home"),
+        create_test_transaction("txn6", "REFUND", "-0.50", merchant_name="Amazon",
+                                txn_date=date(2024, 12, 31)),
+    ]
+
+
+def test_render_transaction_matches_golden_file():
+    """The fast renderer and beancount's printer both reproduce the golden file byte for byte."""
+    with open(GOLDEN_FILE, "r") as f:
+        golden = f.read()
+
+    renderer = BeancountRenderer(golden_transactions(), [])
+    entries = [renderer._to_beancount(t) for t in renderer.transactions]
+
+    assert "\n".join(printer.format_entry(entry) for entry in entries) == golden
+    assert "\n".join(renderer.render_transaction(t) for t in renderer.transactions) == golden
+    assert "\n".join(renderer.print()) == golden
+
+
+def test_format_entry_matches_printer_for_many_amounts():
+    """Alignment of the amount column matches the printer across magnitudes and precisions."""
+    amounts = ["0", "1", "-1", "0.1", "-0.01", "10.10", "999999.999", "-123456789.12", "1E+3", "0.0000001"]
+    renderer = BeancountRenderer([], [])
+    for amount in amounts:
+        entry = renderer._to_beancount(create_test_transaction("txn", "TEST", amount))
+        assert format_entry(entry) == printer.format_entry(entry), amount
+
+
+def test_format_entry_matches_printer_for_tags_and_links():
+    """Tags and links on a bank transaction come out as beancount's printer writes them."""
+    entry = BeancountRenderer([], [])._to_beancount(create_test_transaction("txn", "TEST", "1.00"))
+    entry = entry._replace(tags={"travel"}, links={"trip-2024"})
+    assert format_entry(entry) == printer.format_entry(entry)
+
+
+def test_format_entry_falls_back_for_investment_entries():
+    """Postings with a price or a cost are delegated to beancount's printer."""
+    transaction = PlaidInvestmentTransaction(
+        date=date(2024, 9, 1),
+        name="Buy VTI",
+        quantity=Decimal("2"),
+        price=Decimal("25.00"),
+        amount=Decimal("50.00"),
+        security=create_test_security("VTI"),
+        fees=Decimal("0"),
+        cancel_transaction_id=None,
+        investment_transaction_id="buy_001",
+        iso_currency_code="USD",
+        type=create_test_transaction_type("buy", "buy"),
+        account=create_test_account(),
+    )
+    entry = BeancountRenderer([], [transaction])._to_investment_beancount(transaction)
+    assert entry.postings[1].price is not None
+    assert _format_simple_transaction(entry) is None
+    assert format_entry(entry) == printer.format_entry(entry)
+
+    held = entry.postings[1]._replace(cost=Cost(Decimal("25.00"), "USD", date(2024, 9, 1), None), price=None)
+    entry = entry._replace(postings=[entry.postings[0], held])
+    assert _format_simple_transaction(entry) is None
+    assert format_entry(entry) == printer.format_entry(entry)
@@ -0,0 +1,154 @@
+import os
+import sys
+import tempfile
+import shutil
+from datetime import date
+from unittest import mock
+
+import pytest
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transactions.beancount_writer import AccountFileWriter, ensure_shards_included, shard_path, shard_paths
+
+
+def test_writer_appends_batches_per_file():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        checking = os.path.join(temp_dir, "accounts/Bank/Checking.beancount")
+        savings = os.path.join(temp_dir, "accounts/Bank/Savings.beancount")
+        os.makedirs(os.path.dirname(checking))
+        with open(checking, "w") as f:
+            f.write("; existing\n")
+
+        writer = AccountFileWriter(max_workers=2)
+        writer.add(checking, "2024-01-01 entry one\n")
+        writer.add(savings, "2024-01-02 entry two\n")
+        writer.add(checking, "2024-01-03 entry three\n")
+        results = {result.path: result for result in writer.flush()}
+
+        with open(checking) as f:
+            assert f.read() == "; existing\n2024-01-01 entry one\n2024-01-03 entry three\n"
+        with open(savings) as f:
+            assert f.read() == "2024-01-02 entry two\n"
+        assert results[checking].entries == 2
+        assert results[checking].bytes == len("2024-01-01 entry one\n2024-01-03 entry three\n")
+        assert results[savings].entries == 1
+
+        # Flushing again writes nothing
+        assert writer.flush() == []
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_writer_uses_one_write_and_fsync_per_file():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, "accounts/Bank/Checking.beancount")
+        writer = AccountFileWriter(fsync=True, max_workers=1)
+        for i in range(100):
+            writer.add(path, f"2024-01-01 entry {i}\n")
+
+        with mock.patch("os.write", wraps=os.write) as write, mock.patch("os.fsync", wraps=os.fsync) as fsync:
+            results = writer.flush()
+
+        assert write.call_count == 1
+        # One fsync for the file, one for the directory entry of the new file
+        assert fsync.call_count == 2
+        assert results[0].entries == 100
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_merge_inserts_entries_in_date_order():
+    existing = '''option "operating_currency" "USD"
+
+2024-01-01 * "A" "First"
+  Assets:Checking  -1.00 USD
+  Expenses:Food  1.00 USD
+
+; A comment before the third entry
+2024-01-10 * "C" "Third"
+  Assets:Checking  -3.00 USD
+  Expenses:Food  3.00 USD
+'''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, "Checking.beancount")
+        with open(path, "w") as f:
+            f.write(existing)
+
+        writer = AccountFileWriter(merge=True)
+        writer.add(path, '2024-01-20 * "D" "Fourth"\n\n', date(2024, 1, 20))
+        writer.add(path, '2024-01-05 * "B" "Second"\n\n', date(2024, 1, 5))
+        writer.add(path, '2024-01-10 * "C2" "Same day"\n\n', date(2024, 1, 10))
+        results = writer.flush()
+
+        with open(path) as f:
+            content = f.read()
+        headers = [line for line in content.splitlines() if line[:4].isdigit()]
+        assert headers == [
+            '2024-01-01 * "A" "First"',
+            '2024-01-05 * "B" "Second"',
+            '2024-01-10 * "C" "Third"',
+            '2024-01-10 * "C2" "Same day"',
+            '2024-01-20 * "D" "Fourth"',
+        ]
+        assert content.startswith('option "operating_currency" "USD"\n')
+        assert "; A comment before the third entry\n" in content
+        assert results[0].entries == 3
+        # No temporary files are left behind
+        assert os.listdir(temp_dir) == ["Checking.beancount"]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_merge_requires_entry_dates():
+    writer = AccountFileWriter(merge=True)
+    with pytest.raises(ValueError):
+        writer.add("Checking.beancount", "2024-01-01 * \"A\" \"First\"\n")
+
+
+def test_shard_path():
+    path = os.path.join("accounts", "Bank", "Checking.beancount")
+    assert shard_path(path, date(2026, 3, 5), "year") == os.path.join("accounts", "Bank", "Checking", "2026.beancount")
+    assert shard_path(path, date(2026, 3, 5), "month") == os.path.join("accounts", "Bank", "Checking", "2026-03.beancount")
+
+
+def test_shard_paths_filters_by_window():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        account_file = os.path.join(temp_dir, "Checking.beancount")
+        shard_dir = os.path.join(temp_dir, "Checking")
+        os.makedirs(shard_dir)
+        for name in ["2024.beancount", "2025-02.beancount", "2025-12.beancount", "notes.beancount"]:
+            open(os.path.join(shard_dir, name), "w").close()
+
+        names = lambda paths: [os.path.basename(p) for p in paths]
+        assert names(shard_paths(account_file)) == ["2024.beancount", "2025-02.beancount", "2025-12.beancount"]
+        assert names(shard_paths(account_file, start=date(2025, 3, 1))) == ["2025-12.beancount"]
+        assert names(shard_paths(account_file, end=date(2025, 2, 1))) == ["2024.beancount", "2025-02.beancount"]
+        assert names(shard_paths(account_file, date(2024, 6, 1), date(2024, 6, 30))) == ["2024.beancount"]
+        assert shard_paths(os.path.join(temp_dir, "Savings.beancount")) == []
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_ensure_shards_included_adds_missing_includes_once():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        account_file = os.path.join(temp_dir, "Checking.beancount")
+        with open(account_file, "w") as f:
+            f.write('include "Checking/2024.beancount"')
+        shards = [os.path.join(temp_dir, "Checking", name) for name in ["2024.beancount", "2025.beancount"]]
+
+        assert ensure_shards_included(account_file, shards) == [os.path.join("Checking", "2025.beancount")]
+        assert ensure_shards_included(account_file, shards) == []
+        with open(account_file) as f:
+            assert f.read() == (
+                'include "Checking/2024.beancount"\n'
+                f'include "{os.path.join("Checking", "2025.beancount")}"\n'
+            )
+    finally:
+        shutil.rmtree(temp_dir)
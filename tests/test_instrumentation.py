@@ -0,0 +1,255 @@
+"""
+Per-phase timing and counters, and main's --profile and --metrics-file reports.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from unittest import mock
+
+import main
+from instrumentation import (
+    ApiStats,
+    InstrumentedPlaidApi,
+    Profiler,
+    PrometheusTextfile,
+    instrument_plaid_client,
+    profiler,
+)
+from test_import import DummyPlaidApi, create_temp_beancount_file
+
+
+def test_disabled_profiler_records_nothing():
+    disabled = Profiler()
+    first, second = disabled.phase("load"), disabled.phase("write")
+    # The same shared no-op context manager every time
+    assert first is second
+    with first:
+        disabled.count("entries", 10)
+    assert disabled.phases == {}
+    assert disabled.counters == {}
+
+
+def test_nested_phases_and_counters():
+    enabled = Profiler()
+    enabled.enable()
+    for _ in range(3):
+        with enabled.phase("sync"):
+            with enabled.phase("fetch"):
+                enabled.count("transactions_fetched", 5)
+            with enabled.phase("write"):
+                enabled.count("bytes_written", 100)
+
+    report = enabled.report()
+    assert list(report["phases"]) == ["sync", "sync/fetch", "sync/write"]
+    assert report["phases"]["sync/fetch"]["calls"] == 3
+    assert report["phases"]["sync"]["wall_seconds"] >= report["phases"]["sync/fetch"]["wall_seconds"]
+    assert report["counters"] == {"transactions_fetched": 15, "bytes_written": 300}
+
+
+def test_memory_profile_traces_top_level_phases():
+    memory_profiler = Profiler()
+    memory_profiler.enable(memory=True)
+    try:
+        with memory_profiler.phase("load"):
+            with memory_profiler.phase("parse"):
+                retained = [str(i) * 10 for i in range(20000)]
+        with memory_profiler.phase("render"):
+            temporary = [str(i) * 10 for i in range(20000)]
+            del temporary
+        report = memory_profiler.report()
+    finally:
+        memory_profiler.disable()
+    assert not tracemalloc.is_tracing()
+
+    memory = report["memory"]
+    # Only top-level phases are snapshotted
+    assert list(memory["phases"]) == ["load", "render"]
+    load, render = memory["phases"]["load"], memory["phases"]["render"]
+    assert load["retained_bytes"] > 500000
+    assert abs(render["retained_bytes"]) < load["retained_bytes"] / 10
+    # render freed its list, but the list still shows in its peak
+    assert render["traced_peak_bytes"] - render["traced_bytes"] > 500000
+    assert load["top_allocations"][0]["site"][0].startswith(__file__)
+    assert memory["peak_rss_bytes"] is None or memory["peak_rss_bytes"] > 0
+    assert len(retained) == 20000
+
+
+def test_recategorize_profile_report():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root_file = os.path.join(temp_dir, "root.beancount")
+        os.makedirs(os.path.join(temp_dir, "accounts"))
+        with open(root_file, "w") as f:
+            f.write(
+                '2024-01-01 open Assets:Checking\n'
+                '  plaid_account_id: "acc1"\n'
+                '  transaction_file: "accounts/checking.beancount"\n'
+                '2024-01-01 open Expenses:Food:Restaurants\n'
+                '2024-01-01 open Expenses:Food:Coffee\n'
+                '  payees: "STARBUCKS"\n'
+                'include "accounts/checking.beancount"\n'
+            )
+        with open(os.path.join(temp_dir, "accounts", "checking.beancount"), "w") as f:
+            f.write(
+                '2024-01-10 * "STARBUCKS" "Coffee"\n'
+                '  plaid_transaction_id: "txn1"\n'
+                '  Assets:Checking  -5.00 USD\n'
+                '  Expenses:Food:Restaurants  5.00 USD\n'
+            )
+        report_file = os.path.join(temp_dir, "profile.json")
+
+        argv = ["plaid2beancount", "--recategorize", "--root-file", root_file, "--profile", report_file]
+        try:
+            with mock.patch.object(sys, "argv", argv):
+                main.main()
+        finally:
+            profiler.disable()
+
+        with open(report_file) as f:
+            report = json.load(f)
+
+    assert {"plan", "plan/load_ledger", "plan/load_file", "plan/rewrite", "write", "validate"} <= set(report["phases"])
+    assert report["counters"]["entries_recategorized"] == 1
+    assert report["counters"]["files_written"] == 1
+    assert report["counters"]["bytes_written"] > 0
+    assert report["wall_seconds"] >= report["phases"]["validate"]["wall_seconds"]
+
+
+class FakePlaidApi:
+    """Answers accounts_get with its item and fails transactions_sync as told."""
+
+    api_client = None
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+
+    def accounts_get(self, request):
+        return {"accounts": [], "item": {"item_id": "item-1", "institution_id": "ins_1"}}
+
+    def transactions_sync(self, request):
+        if self.failures:
+            raise self.failures.pop(0)
+        return {"added": [], "has_more": False, "next_cursor": "c"}
+
+
+class FakeApiException(Exception):
+    def __init__(self, status, body=None):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+
+
+def test_plaid_calls_are_accounted_per_endpoint_and_item():
+    stats = ApiStats()
+    client = InstrumentedPlaidApi(FakePlaidApi(failures=[
+        FakeApiException(429, json.dumps({"error_type": "RATE_LIMIT_EXCEEDED", "error_code": "TRANSACTIONS_LIMIT"})),
+        FakeApiException(500),
+    ]), stats)
+
+    client.accounts_get({"access_token": "token-1"})
+    for _ in range(3):
+        try:
+            client.transactions_sync({"access_token": "token-1"})
+        except FakeApiException:
+            pass
+    client.transactions_sync({"access_token": "token-2"})
+
+    report = stats.report()
+    assert report["requests"] == 5
+    sync = report["endpoints"]["transactions_sync"]
+    assert sync["requests"] == 4
+    assert sync["errors"] == 2
+    # The second and third syncs for token-1 each followed a failure
+    assert sync["retries"] == 2
+    assert sync["error_codes"] == {"TRANSACTIONS_LIMIT": 1, "HTTP 500": 1}
+    assert sum(sync["latency_histogram"].values()) == 4
+
+    # token-1's item was learned from the accounts_get response; token-2's is unknown
+    assert report["items"]["item-1"]["requests"] == 4
+    assert report["items"]["item-1"]["institution_id"] == "ins_1"
+    assert report["items"]["unknown"]["requests"] == 1
+    assert {item["item_id"] for item in report["slowest_institutions"]} == {"item-1", "unknown"}
+    assert stats.summary_lines()[0].startswith("Plaid API: 5 requests (2 failed)")
+
+
+def test_instrumented_client_passes_other_attributes_through():
+    plaid_client = FakePlaidApi()
+    client = instrument_plaid_client(plaid_client, ApiStats())
+    assert client.api_client is None
+    assert client.failures is plaid_client.failures
+    assert instrument_plaid_client(client) is client
+
+
+def test_prometheus_textfile_format():
+    metrics = PrometheusTextfile()
+    metrics.gauge("runs", "Runs.", 1)
+    metrics.gauge("written", "Entries written.", 3, file='a "b"\\c.beancount')
+    metrics.gauge("written", "Entries written.", 4, file="d.beancount")
+    metrics.histogram("latency", "Latency.", {0.1: 2, 1.0: 0, float("inf"): 1}, 2.5, endpoint="sync")
+
+    assert metrics.render().splitlines() == [
+        "# HELP runs Runs.",
+        "# TYPE runs gauge",
+        "runs 1",
+        "# HELP written Entries written.",
+        "# TYPE written gauge",
+        'written{file="a \\"b\\"\\\\c.beancount"} 3',
+        'written{file="d.beancount"} 4',
+        "# HELP latency Latency.",
+        "# TYPE latency histogram",
+        'latency_bucket{endpoint="sync",le="0.1"} 2',
+        'latency_bucket{endpoint="sync",le="1.0"} 2',
+        'latency_bucket{endpoint="sync",le="+Inf"} 3',
+        'latency_sum{endpoint="sync"} 2.5',
+        'latency_count{endpoint="sync"} 3',
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "plaid2beancount.prom")
+        metrics.write(path)
+        assert os.listdir(temp_dir) == ["plaid2beancount.prom"]
+        with open(path) as f:
+            assert f.read() == metrics.render()
+
+
+class SyncPlaidApi(DummyPlaidApi):
+    def investments_transactions_get(self, request):
+        return {"accounts": [], "securities": [], "investment_transactions": []}
+
+
+def test_sync_metrics_file():
+    temp_dir, root_file = create_temp_beancount_file()
+    try:
+        config_file = os.path.join(temp_dir, "config")
+        with open(config_file, "w") as f:
+            f.write("[PLAID]\nclient_id = id\nsecret = secret\n")
+        # item2 was not synced this run, so its cursor keeps aging
+        with open(os.path.join(temp_dir, "plaid_cursors.beancount"), "w") as f:
+            f.write('2000-01-01 custom "plaid_cursor" "access_token_456" "old-cursor" "item2"\n')
+        metrics_file = os.path.join(temp_dir, "plaid2beancount.prom")
+
+        argv = ["plaid2beancount", "--sync-transactions", "--root-file", root_file,
+                "--config-file", config_file, "--metrics-file", metrics_file]
+        try:
+            with mock.patch("plaid.api.plaid_api.PlaidApi", return_value=SyncPlaidApi()), \
+                    mock.patch.object(sys, "argv", argv):
+                main.main()
+        finally:
+            profiler.disable()
+
+        with open(metrics_file) as f:
+            samples = dict(line.rsplit(" ", 1) for line in f.read().splitlines() if not line.startswith("#"))
+    finally:
+        shutil.rmtree(temp_dir)
+
+    assert samples["plaid2beancount_last_run_success"] == "1"
+    assert float(samples["plaid2beancount_ledger_parse_seconds"]) > 0
+    assert 'plaid2beancount_phase_duration_seconds{phase="write"}' in samples
+    assert samples['plaid2beancount_transactions_fetched{item_id="item1"}'] == "2"
+    assert samples['plaid2beancount_entries_written{file="accounts/checking/checking.beancount"}'] == "2"
+    assert samples['plaid2beancount_plaid_api_requests{endpoint="transactions_sync"}'] == "1"
+    assert samples['plaid2beancount_plaid_api_request_duration_seconds_count{endpoint="accounts_get"}'] == "1"
+    assert float(samples['plaid2beancount_cursor_age_seconds{item_id="item1"}']) == 0
+    assert float(samples['plaid2beancount_cursor_age_seconds{item_id="item2"}']) > 365 * 24 * 3600
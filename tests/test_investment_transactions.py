@@ -4,6 +4,9 @@ from decimal import Decimal
 from datetime import date
 from enum import Enum
 
+import pytest
+from beancount.core.data import Amount, Posting
+
 # Add the project root to the Python path
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parent_dir)
@@ -410,3 +413,96 @@ def test_multiple_account_structures():
 
         assert dividend_posting.account == expected_dividend_account, \
             f"For account {account_name}, expected {expected_dividend_account}, got {dividend_posting.account}"
+
+
+def test_unknown_transaction_type_raises():
+    """Transactions without a matching handler are rejected."""
+    transaction = PlaidInvestmentTransaction(
+        date=date(2024, 9, 1),
+        name="Stock split",
+        quantity=Decimal("10"),
+        price=Decimal("0"),
+        amount=Decimal("0"),
+        security=create_test_security("VTI"),
+        fees=Decimal("0"),
+        cancel_transaction_id=None,
+        investment_transaction_id="split_001",
+        iso_currency_code="USD",
+        type=create_test_transaction_type('transfer', 'stock split'),
+        account=create_test_account()
+    )
+
+    renderer = BeancountRenderer([], [transaction])
+    with pytest.raises(ValueError):
+        renderer._to_investment_beancount(transaction)
+
+
+def test_custom_investment_handler():
+    """Brokerage-specific handlers can be added without touching the defaults."""
+    def reinvest(transaction, accounts, ticker):
+        return (
+            Posting(accounts.dividends(ticker), Amount(-transaction.amount, "USD"), None, None, None, None),
+            Posting(accounts.ticker(ticker), Amount(transaction.quantity, ticker), None,
+                    Amount(transaction.price, "USD"), None, None),
+            None,
+        )
+
+    transaction = PlaidInvestmentTransaction(
+        date=date(2024, 9, 1),
+        name="Reinvestment",
+        quantity=Decimal("2"),
+        price=Decimal("25.00"),
+        amount=Decimal("50.00"),
+        security=create_test_security("VTI"),
+        fees=Decimal("0"),
+        cancel_transaction_id=None,
+        investment_transaction_id="reinvest_001",
+        iso_currency_code="USD",
+        type=create_test_transaction_type('buy', 'dividend reinvestment'),
+        account=create_test_account()
+    )
+
+    renderer = BeancountRenderer([], [transaction], investment_handlers={
+        ('buy', 'dividend reinvestment', None): reinvest,
+    })
+    beancount_tx = renderer._to_investment_beancount(transaction)
+
+    assert beancount_tx.postings[0].account == "Income:Vanguard:Brokerage:VTI:Dividends"
+    assert beancount_tx.postings[1].account == "Assets:Vanguard:Brokerage:VTI"
+    assert beancount_tx.postings[1].units.number == Decimal("2")
+
+    # Other buys still use the default handler
+    default_renderer = BeancountRenderer([], [transaction])
+    assert default_renderer._to_investment_beancount(transaction).postings[0].account == "Assets:Vanguard:Brokerage:Cash"
+
+
+def test_investment_handler_matches_name_with_any_subtype():
+    """A (type, None, name) key matches that name whatever the subtype."""
+    def sweep(transaction, accounts, ticker):
+        return (
+            Posting(accounts.cash, Amount(transaction.amount, "USD"), None, None, None, None),
+            Posting("Assets:Sweep", Amount(-transaction.amount, "USD"), None, None, None, None),
+            None,
+        )
+
+    transaction = PlaidInvestmentTransaction(
+        date=date(2024, 9, 1),
+        name="Sweep in",
+        quantity=Decimal("0"),
+        price=Decimal("1.00"),
+        amount=Decimal("50.00"),
+        security=create_test_security("VMFXX"),
+        fees=Decimal("0"),
+        cancel_transaction_id=None,
+        investment_transaction_id="sweep_001",
+        iso_currency_code="USD",
+        type=create_test_transaction_type('cash', 'account fee'),
+        account=create_test_account()
+    )
+
+    renderer = BeancountRenderer([], [transaction], investment_handlers={
+        ('cash', None, 'Sweep in'): sweep,
+    })
+    beancount_tx = renderer._to_investment_beancount(transaction)
+
+    assert beancount_tx.postings[1].account == "Assets:Sweep"
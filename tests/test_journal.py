@@ -0,0 +1,115 @@
+"""
+Recording a sync's Plaid responses with --journal and replaying them with --replay.
+"""
+import gzip
+import json
+import os
+import sys
+import tempfile
+from unittest import mock
+
+import pytest
+from plaid.exceptions import ApiException
+
+import main
+from plaid_journal import JournalWriter, ReplayPlaidApi, hash_token, read_journal
+from test_standin_server import _write_ledger, standin  # noqa: F401
+
+
+def _sync(root_file, *options, client=None):
+    config_file = os.path.join(os.path.dirname(root_file), "config")
+    with open(config_file, "w") as f:
+        f.write("[PLAID]\nclient_id = id\nsecret = secret\n")
+    argv = ["plaid2beancount", "--root-file", root_file, "--config-file", config_file, *options]
+    with mock.patch.object(main, "_plaid_client", return_value=client), mock.patch.object(sys, "argv", argv):
+        main.main()
+
+
+def _files(directory):
+    contents = {}
+    for parent, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(".beancount"):
+                path = os.path.join(parent, name)
+                with open(path) as f:
+                    contents[os.path.relpath(path, directory)] = f.read()
+    return contents
+
+
+def test_replay_reproduces_the_recorded_sync(standin):  # noqa: F811
+    standin, client = standin
+    with tempfile.TemporaryDirectory() as recorded_dir, tempfile.TemporaryDirectory() as replayed_dir:
+        journal = os.path.join(recorded_dir, "plaid.journal.gz")
+        _sync(_write_ledger(recorded_dir, "access-test-1"), "--sync-transactions", "--journal", journal, client=client)
+        requests = standin.requests
+
+        # A replay must not rewind the cursors a later real sync continues from
+        replayed_root = _write_ledger(replayed_dir, "access-test-1")
+        newer_cursors = '2026-01-01 custom "plaid_cursor" "Assets:Bank:Checking" "newer-cursor" "item-1"\n'
+        with open(os.path.join(replayed_dir, "plaid_cursors.beancount"), "w") as f:
+            f.write(newer_cursors)
+        _sync(replayed_root, "--replay", journal)
+
+        assert standin.requests == requests
+        recorded, replayed = _files(recorded_dir), _files(replayed_dir)
+        assert "newer-cursor" not in recorded.pop("plaid_cursors.beancount")
+        assert replayed.pop("plaid_cursors.beancount") == newer_cursors
+        assert len(recorded) > 2
+        assert replayed == recorded
+
+        with open(journal, "rb") as f:
+            raw = f.read()
+    assert b"access-test-1" not in gzip.decompress(raw)
+
+
+def test_journal_stores_each_body_once_and_replays_errors():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "plaid.journal.gz")
+        with JournalWriter(path) as journal:
+            for _ in range(2):
+                journal.record("accounts_get", {"access_token": "token-1"}, b'{"accounts": []}')
+        error = ApiException(status=400, reason="Bad Request")
+        error.body = '{"error_code": "ITEM_LOGIN_REQUIRED"}'
+        with JournalWriter(path) as journal:
+            journal.record("accounts_get", {"access_token": "token-1"}, b'{"accounts": []}')
+            journal.record("accounts_get", {"access_token": "token-1"}, error=error)
+        # A run that was killed mid-write leaves a truncated gzip member
+        with open(path, "ab") as f:
+            f.write(gzip.compress(b'{"type": "run"}\n')[:15])
+
+        records = list(read_journal(path))
+        assert oct(os.stat(path).st_mode & 0o777) == "0o600"
+
+        assert [record["type"] for record in records].count("blob") == 1
+        assert {record["token"] for record in records if record["type"] == "call"} == {hash_token("token-1")}
+
+        # The last complete run is replayed: one response, then the error
+        replay = ReplayPlaidApi(path)
+        assert replay.accounts_get({"access_token": "token-1"}) == {"accounts": []}
+        with pytest.raises(ApiException) as e:
+            replay.accounts_get({"access_token": "token-1"})
+        assert e.value.status == 400
+        assert "ITEM_LOGIN_REQUIRED" in str(e.value)
+        with pytest.raises(ApiException):
+            replay.accounts_get({"access_token": "token-1"})
+
+        first_run = next(record["run"] for record in records if record["type"] == "run")
+        assert len([ReplayPlaidApi(path, run=first_run).accounts_get({"access_token": "token-1"})]) == 1
+        assert json.dumps(records)
+
+
+def test_run_after_a_killed_run_is_replayed():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "plaid.journal.gz")
+        with JournalWriter(path) as journal:
+            journal.record("accounts_get", {"access_token": "token-1"}, b'{"accounts": ["first"]}')
+        with open(path, "ab") as f:
+            f.write(gzip.compress(b'{"type": "run", "run": "killed"}\n')[:15])
+
+        with JournalWriter(path) as journal:
+            journal.record("accounts_get", {"access_token": "token-1"}, b'{"accounts": ["latest"]}')
+
+        replay = ReplayPlaidApi(path)
+        assert replay.run == journal.run
+        assert replay.accounts_get({"access_token": "token-1"}) == {"accounts": ["latest"]}
+        assert "killed" not in {record.get("run") for record in read_journal(path)}
@@ -0,0 +1,223 @@
+"""
+Performance regression gates for the sync's and recategorize's hot paths.
+
+The gates count operations rather than time them, so they give the same answer on a
+loaded CI runner as on an idle laptop. The unit is a function call: every Python and
+C function the code under test calls (through sys.setprofile), which covers loops
+that call anything per item, as the hot paths' loops all do.
+
+Two kinds of checks:
+
+- Scaling checks count the calls of a function at n and 4n items and fail when the
+  count grows much faster than the input, which catches quadratic loops.
+- Baseline checks count the calls of a function on a fixed workload and compare the
+  count with tests/performance_baselines.json. A check fails when a count exceeds
+  its baseline by more than the stored tolerance.
+
+After an intended change in performance (or a Beancount upgrade), rewrite the
+baselines with:
+
+    PERF_UPDATE_BASELINES=1 pytest -m perf tests/test_performance.py
+
+All tests here are marked `perf` and skipped by default; `pytest -m perf` runs them.
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from benchmarks import generators  # noqa: E402
+from transactions.beancount_renderer import BeancountRenderer  # noqa: E402
+
+pytestmark = pytest.mark.perf
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "performance_baselines.json")
+UPDATE_BASELINES = os.environ.get("PERF_UPDATE_BASELINES") == "1"
+
+# Growing the input 4x may grow the call count at most this much (linear is 4, or a
+# little less with fixed overhead; quadratic 16)
+MAX_SCALING = 6.0
+
+
+def _calls(fn):
+    """Number of Python and C function calls made while running fn."""
+    calls = 0
+
+    def count(frame, event, arg):
+        nonlocal calls
+        if event in ("call", "c_call"):
+            calls += 1
+
+    sys.setprofile(count)
+    try:
+        fn()
+    finally:
+        sys.setprofile(None)
+    return calls
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    """check(name, calls) compares a call count against the stored baseline for name."""
+    with open(BASELINES_FILE) as f:
+        stored = json.load(f)
+    measured = {}
+
+    def check(name, calls):
+        measured[name] = calls
+        if UPDATE_BASELINES:
+            return
+        assert name in stored["baselines"], f"No baseline for {name}; run with PERF_UPDATE_BASELINES=1"
+        limit = stored["baselines"][name] * stored["tolerance"]
+        assert calls <= limit, (
+            f"{name} made {calls} calls; the baseline is {stored['baselines'][name]} "
+            f"with a tolerance of {stored['tolerance']}x"
+        )
+
+    yield check
+
+    if UPDATE_BASELINES and measured:
+        stored["baselines"].update(measured)
+        with open(BASELINES_FILE, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+def _check_scaling(name, fn, n):
+    """Fail when fn(4 * n) makes more than MAX_SCALING times as many calls as fn(n)."""
+    # Leave one-off work (imports, compiled regexes, caches) out of the counts
+    fn(n)
+    small = _calls(lambda: fn(n))
+    large = _calls(lambda: fn(4 * n))
+    assert large <= small * MAX_SCALING, (
+        f"{name} made {small} calls for {n} items but {large} for {4 * n}; "
+        f"growing the input 4x should grow the calls at most {MAX_SCALING}x"
+    )
+
+
+@pytest.fixture(scope="module", autouse=True)
+def quiet_logging():
+    # The sync logs every entry at debug and info level
+    logging.disable(logging.INFO)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def no_load_cache():
+    # Beancount caches parsed files next to them; count the parsing instead
+    from beancount import loader
+    loader.initialize(use_cache=False)
+    yield
+    loader.initialize(use_cache=True)
+
+
+@pytest.fixture(scope="module")
+def workdir():
+    directory = tempfile.mkdtemp()
+    yield directory
+    shutil.rmtree(directory)
+
+
+@pytest.fixture(scope="module")
+def fetched(workdir):
+    """Transactions and investment transactions fetched from synthetic Plaid responses."""
+    ledger = generators.generate_ledger(os.path.join(workdir, "sync"), accounts=12, years=0)
+    client = generators.SyntheticPlaidApi(
+        ledger,
+        generators.transactions_sync_pages(ledger, transactions=4000, duplicate_fraction=0),
+        generators.investments_transactions_pages(ledger, transactions=400),
+    )
+    transactions, _ = main._update_transactions(client, ledger.root_file)
+    investment_transactions = main._update_investments(client, ledger.root_file)
+    return transactions, investment_transactions
+
+
+def _ledger(workdir, entries_per_day):
+    """A ledger with one account file holding a year of entries_per_day entries a day."""
+    directory = os.path.join(workdir, f"ledger-{entries_per_day}")
+    if not os.path.exists(directory):
+        generators.generate_ledger(directory, accounts=1, years=1, entries_per_day=entries_per_day)
+    return os.path.join(directory, "root.beancount")
+
+
+def _account_file(root_file):
+    return os.path.join(os.path.dirname(root_file), "accounts", "Bank0", "Checking0.beancount")
+
+
+def _copy_ledger(workdir, root_file, name):
+    target = os.path.join(workdir, name)
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(os.path.dirname(root_file), target)
+    return os.path.join(target, "root.beancount")
+
+
+def test_load_beancount_accounts(baseline, workdir):
+    def load(entries_per_day):
+        return main._load_beancount_accounts(_ledger(workdir, entries_per_day))
+
+    _check_scaling("_load_beancount_accounts", load, 2)
+    baseline("load_beancount_accounts_2920", _calls(lambda: load(8)))
+
+
+def test_route_entries(baseline, fetched):
+    transactions, investment_transactions = fetched
+    renderer = BeancountRenderer([], [])
+    entries = [renderer._to_beancount(transaction) for transaction in transactions]
+    investment_entries = [renderer._to_investment_beancount(transaction) for transaction in investment_transactions]
+
+    def route(n):
+        # As in a sync, with one investment transaction for every ten others. Their first
+        # postings are sub-accounts, e.g. Assets:Bank0:Brokerage2:Cash, which is what
+        # made the old lookup scan every transaction for every entry.
+        routed_transactions = transactions[:n] + investment_transactions[:n // 10]
+        return main._route_entries(entries[:n] + investment_entries[:n // 10],
+                                   [transaction.account for transaction in routed_transactions])
+
+    assert sum(len(routed) for routed in route(4000).values()) > 4000
+    _check_scaling("_route_entries", route, 1000)
+    baseline("route_entries_4k", _calls(lambda: route(4000)))
+
+
+def test_render(baseline, fetched):
+    transactions, investment_transactions = fetched
+    renderer = BeancountRenderer([], [])
+
+    def render(n):
+        return [renderer._to_beancount(transaction) for transaction in transactions[:n]]
+
+    def render_investments(n):
+        return [renderer._to_investment_beancount(transaction) for transaction in investment_transactions[:n]]
+
+    _check_scaling("_to_beancount", render, 1000)
+    _check_scaling("_to_investment_beancount", render_investments, 100)
+    baseline("to_beancount_4k", _calls(lambda: render(4000)))
+    baseline("to_investment_beancount_400", _calls(lambda: render_investments(400)))
+
+
+def test_dedup(baseline, workdir):
+    def scan(entries_per_day):
+        return main._existing_plaid_transactions(_account_file(_ledger(workdir, entries_per_day)))
+
+    _check_scaling("_existing_plaid_transactions", scan, 2)
+    _, existing_transaction_ids = scan(8)
+    assert len(existing_transaction_ids) == 365 * 8
+    baseline("dedup_2920", _calls(lambda: scan(8)))
+
+
+def test_recategorize(baseline, workdir):
+    def recategorize(entries_per_day):
+        root_file = _copy_ledger(workdir, _ledger(workdir, entries_per_day), "recategorize")
+        return main._recategorize_transactions(root_file)
+
+    _check_scaling("_recategorize_transactions", recategorize, 2)
+    recategorized = []
+    baseline("recategorize_2920", _calls(lambda: recategorized.append(recategorize(8))))
+    assert recategorized[0] > 0
@@ -1,8 +1,15 @@
 import os
 import tempfile
 import shutil
-from main import _recategorize_transactions
+import io
+import json
+import sys
+from unittest import mock
+import pytest
+import main
+from main import _recategorize_transactions, _preview_recategorization, _plan_recategorization
 from beancount import loader
+from beancount.parser import parser
 
 def test_recategorize_payee_rule():
     # Step 1: Create a root file and a transaction file with no payee rule
@@ -487,4 +494,177 @@ def test_inline_modification_without_plaid_transaction_id():
         assert any('2024-01-12 * "DUNKIN"' in line for line in lines)
         
     finally:
-        shutil.rmtree(temp_dir) 
\ No newline at end of file
+        shutil.rmtree(temp_dir)
+
+
+def test_recategorize_dry_run_does_not_modify_files():
+    """Dry run reports the same changes a real run makes, without writing anything."""
+    root_content = '''
+2024-01-01 open Assets:Checking
+  plaid_account_id: "acc1"
+  transaction_file: "accounts/checking/checking.beancount"
+2024-01-01 open Expenses:Food:Restaurants
+  plaid_category: "FOOD_AND_DRINK_RESTAURANTS"
+2024-01-01 open Expenses:Food:Bars
+  payees: "STARBUCKS"
+
+include "accounts/checking/checking.beancount"
+'''
+    tx_content = '''
+2024-01-10 * "STARBUCKS" "Coffee"
+  plaid_transaction_id: "txn1"
+  Assets:Checking  -5.00 USD
+  Expenses:Food:Restaurants  5.00 USD
+
+2024-01-11 * "DUNKIN" "Donuts"
+  plaid_transaction_id: "txn2"
+  Assets:Checking  -3.00 USD
+  Expenses:Food:Restaurants  3.00 USD
+'''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        root_file = os.path.join(temp_dir, "root.beancount")
+        tx_dir = os.path.join(temp_dir, "accounts/checking")
+        os.makedirs(tx_dir)
+        tx_file = os.path.join(tx_dir, "checking.beancount")
+        with open(root_file, "w") as f:
+            f.write(root_content)
+        with open(tx_file, "w") as f:
+            f.write(tx_content)
+
+        out = io.StringIO()
+        change_count = _preview_recategorization(root_file, output_format="json", out=out)
+        assert change_count == 1
+        changes = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert changes == [{
+            "file": "accounts/checking/checking.beancount",
+            "line": 2,
+            "date": "2024-01-10",
+            "payee": "STARBUCKS",
+            "old_account": "Expenses:Food:Restaurants",
+            "new_account": "Expenses:Food:Bars",
+            "rule": "starbucks",
+        }]
+
+        out = io.StringIO()
+        _preview_recategorization(root_file, output_format="diff", out=out)
+        diff = out.getvalue()
+        assert "--- a/accounts/checking/checking.beancount" in diff
+        assert "-  Expenses:Food:Restaurants  5.00 USD" in diff
+        assert "Expenses:Food:Bars" in diff
+        assert '-2024-01-11 * "DUNKIN"' not in diff
+
+        # Nothing was written
+        with open(tx_file) as f:
+            assert f.read() == tx_content
+
+        # The real run writes exactly what the preview showed
+        plans = _plan_recategorization(root_file)
+        assert _recategorize_transactions(root_file) == 1
+        with open(tx_file) as f:
+            assert f.read() == "".join(plans[0].new_lines)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_recategorize_sharded_account_only_touches_window():
+    """Sharded accounts are recategorized shard by shard, limited to the date window."""
+    root_content = '''
+2024-01-01 open Assets:Checking
+  plaid_account_id: "acc1"
+  transaction_file: "accounts/checking.beancount"
+2024-01-01 open Expenses:Food:Restaurants
+2024-01-01 open Expenses:Food:Coffee
+  payees: "STARBUCKS"
+
+include "accounts/checking.beancount"
+'''
+    shard_template = '''
+{date} * "STARBUCKS" "Coffee"
+  plaid_transaction_id: "{id}"
+  Assets:Checking  -5.00 USD
+  Expenses:Food:Restaurants  5.00 USD
+'''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        root_file = os.path.join(temp_dir, "root.beancount")
+        shard_dir = os.path.join(temp_dir, "accounts/checking")
+        os.makedirs(shard_dir)
+        with open(root_file, "w") as f:
+            f.write(root_content)
+        with open(os.path.join(temp_dir, "accounts/checking.beancount"), "w") as f:
+            f.write('include "checking/2024.beancount"\ninclude "checking/2025.beancount"\n')
+        with open(os.path.join(shard_dir, "2024.beancount"), "w") as f:
+            f.write(shard_template.format(date="2024-05-01", id="txn1"))
+        with open(os.path.join(shard_dir, "2025.beancount"), "w") as f:
+            f.write(shard_template.format(date="2025-05-01", id="txn2"))
+
+        # Only the index file and the shard inside the window are parsed while planning
+        rules = main._load_beancount_accounts(root_file)
+        parsed = []
+        parse_file = parser.parse_file
+
+        def recording_parse_file(filename, *args, **kwargs):
+            parsed.append(os.path.relpath(filename, temp_dir))
+            return parse_file(filename, *args, **kwargs)
+
+        with mock.patch.object(main, "_load_beancount_accounts", return_value=rules), \
+                mock.patch.object(parser, "parse_file", recording_parse_file):
+            plans = _plan_recategorization(root_file, start_date="2025-01-01")
+        assert sorted(parsed) == ["accounts/checking.beancount", "accounts/checking/2025.beancount"]
+        assert [os.path.relpath(plan.path, temp_dir) for plan in plans] == ["accounts/checking/2025.beancount"]
+        assert plans[0].changes[0].file == "accounts/checking/2025.beancount"
+
+        assert _recategorize_transactions(root_file, start_date="2025-01-01") == 1
+        with open(os.path.join(shard_dir, "2024.beancount")) as f:
+            assert "Expenses:Food:Restaurants" in f.read()
+        with open(os.path.join(shard_dir, "2025.beancount")) as f:
+            assert "Expenses:Food:Coffee" in f.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_recategorize_dot_prefixed_transaction_file():
+    """A transaction_file written as ./accounts/... still has its entries recategorized."""
+    root_content = '''
+2024-01-01 open Assets:Checking
+  plaid_account_id: "acc1"
+  transaction_file: "./accounts/checking/checking.beancount"
+2024-01-01 open Expenses:Food:Restaurants
+2024-01-01 open Expenses:Food:Coffee
+  payees: "STARBUCKS"
+
+include "accounts/checking/checking.beancount"
+'''
+    tx_content = '''
+2024-01-10 * "STARBUCKS" "Coffee"
+  plaid_transaction_id: "txn1"
+  Assets:Checking  -5.00 USD
+  Expenses:Food:Restaurants  5.00 USD
+'''
+    temp_dir = tempfile.mkdtemp()
+    try:
+        root_file = os.path.join(temp_dir, "root.beancount")
+        tx_dir = os.path.join(temp_dir, "accounts/checking")
+        os.makedirs(tx_dir)
+        tx_file = os.path.join(tx_dir, "checking.beancount")
+        with open(root_file, "w") as f:
+            f.write(root_content)
+        with open(tx_file, "w") as f:
+            f.write(tx_content)
+
+        assert _recategorize_transactions(root_file) == 1
+        with open(tx_file) as f:
+            assert "Expenses:Food:Coffee" in f.read()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_dry_run_requires_recategorize():
+    """--dry-run on its own is rejected rather than running a real sync."""
+    for argv in (["plaid2beancount", "--dry-run"], ["plaid2beancount", "--sync-transactions", "--dry-run"]):
+        with mock.patch.object(sys, "argv", argv), pytest.raises(SystemExit) as e:
+            main._parse_args_and_load_config()
+        assert e.value.code == 2
+    with mock.patch.object(sys, "argv", ["plaid2beancount", "--recategorize", "--dry-run"]):
+        assert main._parse_args_and_load_config().dry_run
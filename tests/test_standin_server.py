@@ -0,0 +1,113 @@
+"""
+The Plaid stand-in server, driven through the real Plaid SDK.
+"""
+import configparser
+import os
+import tempfile
+import threading
+
+import pytest
+from plaid.exceptions import ApiException
+from werkzeug.serving import make_server
+
+import main
+from plaid_standin_server import StandIn, create_app, synthesize_item
+
+
+@pytest.fixture
+def standin():
+    """Serve a StandIn on a free port; yields (standin, client)."""
+    standin = StandIn(transactions=1100, investment_transactions=30)
+    server = make_server("127.0.0.1", 0, create_app(standin), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+
+    config = configparser.ConfigParser()
+    config["PLAID"] = {"client_id": "id", "secret": "secret", "host": f"http://127.0.0.1:{server.server_port}"}
+    try:
+        yield standin, main._plaid_client(config)
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def _write_ledger(directory, access_token):
+    item = synthesize_item(access_token)
+    lines = []
+    for account in item["accounts"]:
+        name = "Brokerage" if account["type"] == "investment" else account["name"].replace(" ", "")
+        lines.append(
+            f'2020-01-01 open Assets:Bank:{name}\n'
+            f'  plaid_account_id: "{account["account_id"]}"\n'
+            f'  plaid_item_id: "{item["item_id"]}"\n'
+            f'  plaid_access_token: "{access_token}"\n'
+            f'  transaction_file: "accounts/{name}.beancount"\n\n'
+        )
+    root_file = os.path.join(directory, "root.beancount")
+    with open(root_file, "w") as f:
+        f.writelines(lines)
+    return root_file
+
+
+def test_sync_pages_through_all_transactions(standin):
+    standin, client = standin
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root_file = _write_ledger(temp_dir, "access-test-1")
+        transactions, cursor_directives = main._update_transactions(client, root_file)
+        investment_transactions = main._update_investments(client, root_file)
+
+    assert len(transactions) == 1100
+    assert len({t.transaction_id for t in transactions}) == 1100
+    assert cursor_directives[-1].values[1][0] == "standin-cursor-1100"
+    assert len(investment_transactions) == 30
+    # accounts_get, 3 pages of up to 500 transactions, then one investments page
+    assert standin.requests == 5
+
+
+def test_rate_limit_errors(standin):
+    standin, client = standin
+    standin.rate_limit_every = 2
+    AccountsGetRequest = main._plaid_model("AccountsGetRequest")
+
+    client.accounts_get(AccountsGetRequest(access_token="access-test-1"))
+    with pytest.raises(ApiException) as e:
+        client.accounts_get(AccountsGetRequest(access_token="access-test-1"))
+    assert e.value.status == 429
+    assert "RATE_LIMIT_EXCEEDED" in e.value.body
+
+
+def test_item_login_required(standin):
+    standin, client = standin
+    standin.login_required.add("access-test-1")
+    AccountsGetRequest = main._plaid_model("AccountsGetRequest")
+
+    with pytest.raises(ApiException) as e:
+        client.accounts_get(AccountsGetRequest(access_token="access-test-1"))
+    assert e.value.status == 400
+    assert "ITEM_LOGIN_REQUIRED" in str(e.value)
+
+    # The sync reports the item and carries on
+    with tempfile.TemporaryDirectory() as temp_dir:
+        transactions, _ = main._update_transactions(client, _write_ledger(temp_dir, "access-test-1"))
+    assert transactions == []
+
+
+def test_link_token_and_public_token_exchange(standin):
+    _, client = standin
+    LinkTokenCreateRequest = main._plaid_model("LinkTokenCreateRequest")
+    ItemPublicTokenExchangeRequest = main._plaid_model("ItemPublicTokenExchangeRequest")
+    Products = main._plaid_model("Products")
+    CountryCode = main._plaid_model("CountryCode")
+
+    link_token = client.link_token_create(LinkTokenCreateRequest(
+        user={"client_user_id": "user-id"},
+        client_name="Plaid2Beancount",
+        products=[Products("transactions")],
+        country_codes=[CountryCode("US")],
+        language="en",
+    ))["link_token"]
+    assert link_token.startswith("link-standin-")
+
+    exchange = client.item_public_token_exchange(ItemPublicTokenExchangeRequest(public_token="public-1"))
+    assert exchange["access_token"] == "access-standin-public-1"
+    assert exchange["item_id"] == synthesize_item("access-standin-public-1")["item_id"]
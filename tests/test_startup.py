@@ -0,0 +1,81 @@
+"""
+Startup cost of the CLI: modes should only import the heavy dependencies they use.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Extra time --help may take over starting a bare interpreter
+HELP_STARTUP_BUDGET = 0.15
+
+LAZY_MODULES = ["plaid", "flask", "webbrowser", "beancount.loader"]
+
+RUN_AND_LIST_MODULES = """
+import json, sys
+sys.argv = ["plaid2beancount"] + json.loads(sys.argv[1])
+import main
+try:
+    main.main()
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def _modules_loaded_by(args):
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_AND_LIST_MODULES, json.dumps(args)],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+    )
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def _loaded(modules, name):
+    return name in modules or any(module.startswith(name + ".") for module in modules)
+
+
+def _best_time(args, runs=5):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(args, cwd=PROJECT_ROOT, capture_output=True, check=True)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_help_does_not_import_heavy_dependencies():
+    modules = _modules_loaded_by(["--help"])
+    for name in LAZY_MODULES:
+        assert not _loaded(modules, name), f"--help imported {name}"
+
+
+def test_recategorize_does_not_import_plaid_or_flask():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        root_file = os.path.join(temp_dir, "root.beancount")
+        with open(root_file, "w") as f:
+            f.write('2024-01-01 open Assets:Checking\n')
+        config_file = os.path.join(temp_dir, "config")
+        with open(config_file, "w") as f:
+            f.write("[PLAID]\nclient_id = x\nsecret = y\n")
+
+        modules = _modules_loaded_by(["--recategorize", "--root-file", root_file, "--config-file", config_file])
+        assert _loaded(modules, "beancount.loader")
+        assert not _loaded(modules, "plaid")
+        assert not _loaded(modules, "flask")
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_help_startup_budget():
+    bare = _best_time([sys.executable, "-c", "pass"])
+    help_time = _best_time([sys.executable, "main.py", "--help"])
+    assert help_time - bare < HELP_STARTUP_BUDGET, \
+        f"--help took {help_time - bare:.3f}s over a bare interpreter (budget {HELP_STARTUP_BUDGET}s)"
@@ -1,31 +1,229 @@
 from decimal import Decimal
-from typing import List
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import re
 import sys
 import os
 # Import from parent directory's transaction_models.py module
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from transaction_models import PlaidTransaction, PlaidInvestmentTransaction
+from beancount.core import display_context
 from beancount.core.data import Transaction, Amount, Posting, Price, Balance, CostSpec
+from beancount.parser import printer
 from beancount.parser.printer import EntryPrinter
+from beancount.utils.misc_utils import escape_string
 import logging
 
 logger = logging.getLogger(__name__)
 
+# The number format EntryPrinter uses when it is not given a display context.
+_DFORMAT = display_context.DEFAULT_DISPLAY_CONTEXT.build(precision=display_context.Precision.MOST_COMMON)
+_UPPERCASE = re.compile('[A-Z]').search
+
+
+def _format_simple_transaction(entry) -> Optional[str]:
+    """Render a transaction whose postings are all plain amounts, or return None.
+
+    This reproduces EntryPrinter's output byte for byte for the shape produced by
+    BeancountRenderer._to_beancount (string/None metadata, no tags, links, costs,
+    prices or posting metadata) without its general alignment machinery.
+    """
+    if not isinstance(entry, Transaction) or entry.tags or entry.links or not entry.postings:
+        return None
+
+    accounts = []
+    numbers = []
+    currencies = []
+    for posting in entry.postings:
+        units = posting.units
+        if (posting.flag or posting.meta or posting.cost is not None or posting.price is not None
+                or not isinstance(units, Amount) or not isinstance(units.number, Decimal)
+                or not isinstance(units.currency, str) or not 'A' <= units.currency[:1] <= 'Z'):
+            return None
+        number = _DFORMAT.format(units.number, units.currency)
+        if _UPPERCASE(number):
+            # EntryPrinter aligns on the first capital letter, e.g. the E in 1E+3
+            return None
+        accounts.append(posting.account)
+        numbers.append(number + ' ')
+        currencies.append(units.currency)
+
+    strings = []
+    if entry.payee:
+        strings.append('"' + escape_string(entry.payee) + '"')
+    if entry.narration:
+        strings.append('"' + escape_string(entry.narration) + '"')
+    elif entry.payee:
+        strings.append('""')
+    lines = [f"{entry.date} {entry.flag} {' '.join(strings)}\n"]
+
+    if entry.meta:
+        for key, value in entry.meta.items():
+            if key in EntryPrinter.META_IGNORE:
+                continue
+            if isinstance(value, str):
+                lines.append(f'  {key}: "{escape_string(value)}"\n')
+            elif value is None:
+                lines.append(f"  {key}: \n")
+            else:
+                return None
+
+    width_account = max(map(len, accounts))
+    width_number = max(map(len, numbers))
+    for account, number, currency in zip(accounts, numbers, currencies):
+        lines.append(f"  {account:<{width_account}}  {number:>{width_number}}{currency}\n")
+    return ''.join(lines)
+
+
+def format_entry(entry) -> str:
+    """Format an entry exactly as beancount.parser.printer.format_entry does.
+
+    Bank transactions take a fast, template-based path; anything else falls back
+    to beancount's printer.
+    """
+    text = _format_simple_transaction(entry)
+    if text is None:
+        return printer.format_entry(entry)
+    return text
+
+
+def _enum_value(value):
+    """Plaid SDK models wrap types in enums; Django models store plain strings."""
+    return getattr(value, 'value', value)
+
+
+class InvestmentAccounts:
+    """Account names derived from an investment account, built once and cached per ticker."""
+
+    def __init__(self, account: str):
+        self.account = account
+        self.cash = account + ":Cash"
+        self.income = account.replace("Assets", "Income")
+        self._tickers = {}
+        self._dividends = {}
+        self._capital_gains = {}
+
+    def ticker(self, ticker: str) -> str:
+        name = self._tickers.get(ticker)
+        if name is None:
+            name = self._tickers[ticker] = self.account + ":" + ticker
+        return name
+
+    def dividends(self, ticker: str) -> str:
+        name = self._dividends.get(ticker)
+        if name is None:
+            name = self._dividends[ticker] = self.income + ":" + ticker + ":Dividends"
+        return name
+
+    def capital_gains(self, ticker: str) -> str:
+        name = self._capital_gains.get(ticker)
+        if name is None:
+            name = self._capital_gains[ticker] = self.income + "Capital-Gains" + ticker
+        return name
+
+
+# A handler turns an investment transaction into (source posting, sink posting, gains account or None).
+InvestmentHandler = Callable[[PlaidInvestmentTransaction, InvestmentAccounts, str], Tuple[Posting, Posting, Optional[str]]]
+
+
+def _buy(transaction, accounts: InvestmentAccounts, ticker: str):
+    """Cash -> security. Also used for sweep ins and miscellaneous fees."""
+    # For some reason, dividends and sweeps are not being recorded as a quantity
+    quantity = transaction.quantity or transaction.amount
+    price = transaction.price or Decimal('1.0')
+    return (
+        Posting(accounts.cash, Amount(-transaction.amount, "USD"), None, None, None, None),
+        Posting(accounts.ticker(ticker), Amount(quantity, ticker), None, Amount(price, "USD"), None, None),
+        None,
+    )
+
+
+def _sell(transaction, accounts: InvestmentAccounts, ticker: str):
+    return (
+        Posting(accounts.ticker(ticker), Amount(-transaction.quantity, ticker), None, Amount(transaction.price, "USD"), None, None),
+        Posting(accounts.cash, Amount(transaction.amount, "USD"), None, None, None, None),
+        accounts.capital_gains(ticker),
+    )
+
+
+def _dividend(transaction, accounts: InvestmentAccounts, ticker: str):
+    return (
+        Posting(accounts.dividends(ticker), Amount(transaction.amount, "USD"), None, None, None, None),
+        Posting(accounts.cash, Amount(-transaction.amount, "USD"), None, None, None, None),
+        None,
+    )
+
+
+def _sweep_out(transaction, accounts: InvestmentAccounts, ticker: str):
+    """Security (money market fund) -> cash."""
+    return (
+        Posting(accounts.ticker(ticker), Amount(transaction.amount, ticker), None, Amount(transaction.price, "USD"), None, None),
+        Posting(accounts.cash, Amount(-transaction.amount, "USD"), None, None, None, None),
+        None,
+    )
+
+
+def _transfer_in(transaction, accounts: InvestmentAccounts, ticker: str):
+    return (
+        Posting("Assets:Transfer", Amount(transaction.amount, "USD"), None, None, None, None),
+        Posting(accounts.cash, Amount(-transaction.amount, "USD"), None, None, None, None),
+        None,
+    )
+
+
+def _transfer_out(transaction, accounts: InvestmentAccounts, ticker: str):
+    return (
+        Posting(accounts.cash, Amount(-transaction.amount, "USD"), None, None, None, None),
+        Posting("Assets:Transfer", Amount(transaction.amount, "USD"), None, None, None, None),
+        None,
+    )
+
+
+# Investment handlers keyed by (type, subtype, transaction name). A None subtype or
+# name is a wildcard. Keys are tried in the order (type, subtype, name),
+# (type, subtype, None), (type, None, name), (type, None, None).
+INVESTMENT_HANDLERS: Dict[Tuple[str, Optional[str], Optional[str]], InvestmentHandler] = {
+    ('buy', None, None): _buy,
+    ('fee', 'miscellaneous fee', None): _buy,
+    ('sell', None, None): _sell,
+    ('fee', 'dividend', None): _dividend,
+    # This is really a sweep out
+    ('fee', 'interest', None): _sweep_out,
+    ('cash', 'deposit', 'Sweep out'): _sweep_out,
+    ('cash', 'deposit', None): _transfer_in,
+    ('cash', 'withdrawal', 'Sweep in'): _buy,
+    ('cash', 'withdrawal', None): _transfer_out,
+    ('cash', 'dividend', None): _dividend,
+    # At some point Vanguard started using the transfer type for sweep in/out...
+    ('transfer', 'transfer', 'Sweep in'): _buy,
+    ('transfer', 'transfer', 'Sweep out'): _sweep_out,
+}
+
 
 class BeancountRenderer:
-    def __init__(self, transactions: List[PlaidTransaction], investment_transactions: List[PlaidInvestmentTransaction]):
+    def __init__(self, transactions: List[PlaidTransaction], investment_transactions: List[PlaidInvestmentTransaction],
+                 investment_handlers: Optional[Dict[Tuple[str, Optional[str], Optional[str]], InvestmentHandler]] = None):
+        """investment_handlers adds to or overrides INVESTMENT_HANDLERS, e.g. for a brokerage's own naming."""
         self.transactions = transactions
         self.investment_transactions = investment_transactions
         self._printer = EntryPrinter()
+        self._investment_handlers = {**INVESTMENT_HANDLERS, **(investment_handlers or {})}
+        self._resolved_handlers = {}
+        self._investment_accounts = {}
 
     def print(self) -> List[str]:
         """Convert transactions to Beancount format and print them."""
-        beancount_transactions = []
+        return list(self.iter_print())
+
+    def iter_print(self) -> Iterator[str]:
+        """Like print(), but renders one entry at a time, e.g. to stream a queryset's .iterator()."""
         for transaction in self.transactions:
-            beancount_transactions.append(self._to_beancount(transaction))
+            yield self.render_transaction(transaction)
         for transaction in self.investment_transactions:
-            beancount_transactions.append(self._to_investment_beancount(transaction))
-        return [self._printer(transaction) for transaction in beancount_transactions]
+            yield self._printer(self._to_investment_beancount(transaction))
+
+    def render_transaction(self, transaction: PlaidTransaction) -> str:
+        """Render a PlaidTransaction to Beancount text, identical to printer.format_entry."""
+        return format_entry(self._to_beancount(transaction))
 
     def _to_beancount(self, transaction: PlaidTransaction) -> Transaction:
         if transaction.personal_finance_category and transaction.personal_finance_category.expense_account:
@@ -64,115 +262,43 @@ class BeancountRenderer:
             ],
         )
         
-    def _to_investment_beancount(self, transaction: PlaidInvestmentTransaction) -> Transaction:                        
+    def _investment_accounts_for(self, account: str) -> "InvestmentAccounts":
+        accounts = self._investment_accounts.get(account)
+        if accounts is None:
+            accounts = self._investment_accounts[account] = InvestmentAccounts(account)
+        return accounts
+
+    def _investment_handler_for(self, type_value: str, subtype_value: Optional[str], name: str) -> Optional[InvestmentHandler]:
+        """Resolve the most specific handler for (type, subtype, name), caching the result."""
+        key = (type_value, subtype_value, name)
+        try:
+            return self._resolved_handlers[key]
+        except KeyError:
+            pass
+        handlers = self._investment_handlers
+        handler = (handlers.get(key)
+                   or handlers.get((type_value, subtype_value, None))
+                   or handlers.get((type_value, None, name))
+                   or handlers.get((type_value, None, None)))
+        self._resolved_handlers[key] = handler
+        return handler
+
+    def _to_investment_beancount(self, transaction: PlaidInvestmentTransaction) -> Transaction:
         """Convert a PlaidInvestmentTransaction to a Beancount Transaction."""
         if transaction.account.beancount_name is not None:
             account = transaction.account.beancount_name
         else:
             account = "Unknown"
-            
+
         ticker = transaction.security.ticker_symbol
-        
-        gains_account = None
-        source_posting = None
-        sink_posting = None
-            
-        # buy or sweep in
-        if transaction.type.type.value == 'buy' or (transaction.type.type.value == 'fee' and transaction.type.subtype.value == 'miscellaneous fee'):            
-            source_posting = Posting(
-                account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None
-            )
-            # For some reason, dividends are not being recorded as a quantity
-            quantity = transaction.quantity or transaction.amount
-            price = transaction.price or Decimal('1.0')
-                                                
-            sink_posting = Posting(
-                account + ":" + ticker, Amount(quantity, ticker), None, Amount(price, "USD"), None, None
-            )
-        elif transaction.type.type.value == 'sell':            
-            source_posting = Posting(
-                account + ":" + ticker, Amount(-transaction.quantity, ticker), None, Amount(transaction.price, "USD"), None, None
-            )
-            sink_posting = Posting(
-                account + ":" + "Cash", Amount(transaction.amount, "USD"), None, None, None, None
-            )            
-            gains_account = account.replace("Assets", "Income") + "Capital-Gains" + ticker
-            
-        elif transaction.type.type.value == 'fee':
-            if transaction.type.subtype.value == 'dividend':
-                source_posting = Posting(
-                    account.replace("Assets", "Income") + ":" + ticker + ":Dividends", Amount(transaction.amount, "USD"), None, None, None, None
-                )
-                sink_posting = Posting(
-                    account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None
-                )
-        
-            # This is really a sweep out
-            elif transaction.type.subtype.value == 'interest':
-                source_posting = Posting(
-                    account + ":" + ticker, Amount(transaction.amount, ticker), None, Amount(transaction.price, "USD"), None, None
-                )
-                sink_posting = Posting(
-                    account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None    
-                )                            
-        elif transaction.type.type.value == 'cash':
-            if transaction.type.subtype.value == 'deposit':
-                if transaction.name == 'Sweep out':
-                    source_posting = Posting(
-                        account + ":" + ticker, Amount(transaction.amount, ticker), None, Amount(transaction.price, "USD"), None, None
-                    )
-                else:
-                    source_posting = Posting(
-                        "Assets:Transfer", Amount(transaction.amount, "USD"), None, None, None, None
-                    )
-                sink_posting = Posting(
-                    account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None
-                )
-            elif transaction.type.subtype.value == 'withdrawal':                
-                source_posting = Posting(
-                    account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None
-                )
-                if transaction.name == 'Sweep in':
-                    # For some reason, this is not being recorded as a quantity
-                    quantity = transaction.quantity or transaction.amount
-                    price = transaction.price or Decimal('1.0')
-                    sink_posting = Posting(account + ":" + ticker, Amount(quantity, ticker), None, Amount(price, "USD"), None, None)
-                else:
-                    sink_posting = Posting(
-                        "Assets:Transfer", Amount(transaction.amount, "USD"), None, None, None, None
-                    )
-            elif transaction.type.subtype.value == 'dividend':
-                source_posting = Posting(
-                    account.replace("Assets", "Income") + ":" + ticker + ":Dividends", Amount(transaction.amount, "USD"), None, None, None, None
-                )
-                sink_posting = Posting(
-                    account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None
-                )
-        elif transaction.type.type.value == 'transfer':
-            # At some point Vanguard started using the transfer type for sweep in/out...
-            if transaction.type.subtype.value == 'transfer':
-                if transaction.name == 'Sweep in':
-                    source_posting = Posting(
-                        account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None
-                    )
-                    # For some reason, this is not being recorded as a quantity
-                    quantity = transaction.quantity or transaction.amount
-                    price = transaction.price or Decimal('1.0')
-                                                        
-                    sink_posting = Posting(
-                        account + ":" + ticker, Amount(quantity, ticker), None, Amount(price, "USD"), None, None
-                    )
-                elif transaction.name == 'Sweep out':
-                    source_posting = Posting(
-                        account + ":" + ticker, Amount(transaction.amount, ticker), None, Amount(transaction.price, "USD"), None, None
-                    )
-                    sink_posting = Posting(
-                        account + ":" + "Cash", Amount(-transaction.amount, "USD"), None, None, None, None    
-                    )                   
-                    
-        if source_posting is None or sink_posting is None:
-            print(transaction)
+        handler = self._investment_handler_for(
+            _enum_value(transaction.type.type), _enum_value(transaction.type.subtype), transaction.name
+        )
+        if handler is None:
+            logger.error(f"No investment handler for transaction: {transaction}")
             raise ValueError(f"Unknown transaction type: {transaction.type.type} - {transaction.type.subtype}")
+
+        source_posting, sink_posting, gains_account = handler(transaction, self._investment_accounts_for(account), ticker)
         postings = [source_posting, sink_posting]
         if gains_account is not None:
             postings.append(Posting(
@@ -180,7 +306,7 @@ class BeancountRenderer:
             ))
         return Transaction(
             meta={"plaid_transaction_id": transaction.investment_transaction_id},
-            date=transaction.date,            
+            date=transaction.date,
             payee=ticker,
             narration=transaction.name,
             flag="!",
@@ -188,4 +314,3 @@ class BeancountRenderer:
             links=set(),
             postings=postings,
         )
-        
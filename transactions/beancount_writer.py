@@ -0,0 +1,198 @@
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A line that starts a dated directive, e.g. '2024-01-15 * "Payee" "Narration"'
+_ENTRY_START = re.compile(r'(\d{4}-\d{2}-\d{2})\s')
+
+# Shard file names for each --shard-by period, e.g. 2026.beancount or 2026-03.beancount
+SHARD_FORMATS = {"year": "%Y", "month": "%Y-%m"}
+_SHARD_NAME = re.compile(r'(\d{4})(?:-(\d{2}))?\.beancount')
+_INCLUDE = re.compile(r'\s*include\s+"([^"]+)"')
+
+
+def shard_path(path: str, entry_date: date, shard_by: str) -> str:
+    """Shard file for an entry: accounts/Bank/Checking.beancount -> accounts/Bank/Checking/2026.beancount."""
+    return os.path.join(os.path.splitext(path)[0], entry_date.strftime(SHARD_FORMATS[shard_by]) + '.beancount')
+
+
+def shard_paths(path: str, start: Optional[date] = None, end: Optional[date] = None) -> List[str]:
+    """Existing shard files of an account file that overlap [start, end], oldest first."""
+    directory = os.path.splitext(path)[0]
+    if not os.path.isdir(directory):
+        return []
+    shards = []
+    for name in sorted(os.listdir(directory)):
+        match = _SHARD_NAME.fullmatch(name)
+        if not match:
+            continue
+        year, month = int(match.group(1)), match.group(2)
+        if month:
+            first = date(year, int(month), 1)
+            last = (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        else:
+            first, last = date(year, 1, 1), date(year, 12, 31)
+        if (start and last < start) or (end and first > end):
+            continue
+        shards.append(os.path.join(directory, name))
+    return shards
+
+
+def ensure_shards_included(index_path: str, shards: List[str]) -> List[str]:
+    """Append include directives for any shards the account's index file doesn't include yet.
+
+    Returns the include paths that were added, relative to the index file.
+    """
+    index_dir = os.path.dirname(index_path)
+    included = set()
+    ends_with_newline = True
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                match = _INCLUDE.match(line)
+                if match:
+                    included.add(os.path.normpath(match.group(1)))
+                ends_with_newline = line.endswith('\n')
+
+    missing = sorted({os.path.relpath(shard, index_dir) for shard in shards} - included)
+    if missing:
+        with open(index_path, 'a', encoding='utf-8') as f:
+            if not ends_with_newline:
+                f.write('\n')
+            for relative_path in missing:
+                f.write(f'include "{relative_path}"\n')
+        logger.debug(f"Added includes for {missing} to {index_path}")
+    return missing
+
+
+@dataclass
+class WriteResult:
+    path: str
+    entries: int
+    bytes: int
+
+
+class AccountFileWriter:
+    """Collects rendered entries per account file and appends each file's batch at once.
+
+    Every file gets a single buffered write (and, with fsync=True, a single fsync),
+    and files are written concurrently on a small thread pool.
+
+    With merge=True, entries are instead inserted at their chronological position:
+    the existing file is streamed alongside the sorted new entries in one pass and
+    atomically replaced.
+    """
+
+    def __init__(self, fsync: bool = False, max_workers: int = 4, merge: bool = False):
+        self.fsync = fsync
+        self.max_workers = max_workers
+        self.merge = merge
+        self._pending: Dict[str, List[Tuple[Optional[date], str]]] = {}
+
+    def add(self, path: str, text: str, entry_date: Optional[date] = None):
+        """Queue rendered entry text for path. entry_date is required in merge mode."""
+        if self.merge and entry_date is None:
+            raise ValueError("entry_date is required when merging entries into account files")
+        self._pending.setdefault(path, []).append((entry_date, text))
+
+    def flush(self) -> List[WriteResult]:
+        """Write all queued entries and return what was written to each file."""
+        pending, self._pending = self._pending, {}
+        if len(pending) <= 1 or self.max_workers <= 1:
+            return [self._write(path, items) for path, items in pending.items()]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as pool:
+            return list(pool.map(lambda item: self._write(*item), pending.items()))
+
+    def _write(self, path: str, items: List[Tuple[Optional[date], str]]) -> WriteResult:
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        created = not os.path.exists(path)
+        if self.merge and not created:
+            return self._merge(path, items)
+
+        texts = [text for _, text in items]
+        buffer = ''.join(texts).encode('utf-8')
+
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(buffer)
+            while view:
+                # A single write for regular files; loop only on short writes
+                view = view[os.write(fd, view):]
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if self.fsync and created:
+            # Make the new directory entry durable too
+            self._fsync_directory(directory)
+
+        logger.debug(f"Wrote {len(texts)} entries ({len(buffer)} bytes) to {path}")
+        return WriteResult(path=path, entries=len(texts), bytes=len(buffer))
+
+    def _merge(self, path: str, items: List[Tuple[Optional[date], str]]) -> WriteResult:
+        """Rewrite path with the new entries inserted in date order.
+
+        New entries go after existing entries with the same date. Only the current
+        line of the existing file is held in memory.
+        """
+        new_entries = sorted(((entry_date.isoformat(), text) for entry_date, text in items), key=lambda item: item[0])
+        directory = os.path.dirname(path) or '.'
+        written = 0
+        position = 0
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8') as out, open(path, 'r', encoding='utf-8') as existing:
+                last_line = '\n'
+                for line in existing:
+                    match = _ENTRY_START.match(line)
+                    if match:
+                        existing_date = match.group(1)
+                        while position < len(new_entries) and new_entries[position][0] < existing_date:
+                            if not last_line.endswith('\n'):
+                                out.write('\n')
+                            text = new_entries[position][1]
+                            out.write(text)
+                            written += len(text.encode('utf-8'))
+                            last_line = text
+                            position += 1
+                    out.write(line)
+                    last_line = line
+                for _, text in new_entries[position:]:
+                    if not last_line.endswith('\n'):
+                        out.write('\n')
+                    out.write(text)
+                    written += len(text.encode('utf-8'))
+                    last_line = text
+                out.flush()
+                if self.fsync:
+                    os.fsync(out.fileno())
+            shutil.copymode(path, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        if self.fsync:
+            self._fsync_directory(directory)
+
+        logger.debug(f"Merged {len(new_entries)} entries ({written} bytes) into {path}")
+        return WriteResult(path=path, entries=len(new_entries), bytes=written)
+
+    @staticmethod
+    def _fsync_directory(directory: str):
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -1,8 +1,38 @@
 # forms.py
+from datetime import date
+
 from django import forms
 from .models import Account
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _clean_cursor(value):
+    """Parse a keyset cursor, '<date>:<id>' of the last row shown, into (date, id)."""
+    if not value:
+        return None
+    try:
+        day, pk = value.split(':')
+        return date.fromisoformat(day), int(pk)
+    except ValueError:
+        raise forms.ValidationError("Invalid page cursor.")
+
+
 class TransactionFilterForm(forms.Form):
     account = forms.ModelChoiceField(queryset=Account.objects.all())
     start_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
-    end_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
\ No newline at end of file
+    end_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    page_size = forms.IntegerField(required=False, min_value=1, max_value=MAX_PAGE_SIZE,
+                                   widget=forms.NumberInput(attrs={'placeholder': DEFAULT_PAGE_SIZE}))
+    after = forms.CharField(required=False, widget=forms.HiddenInput())
+    investment_after = forms.CharField(required=False, widget=forms.HiddenInput())
+
+    def clean_page_size(self):
+        return self.cleaned_data['page_size'] or DEFAULT_PAGE_SIZE
+
+    def clean_after(self):
+        return _clean_cursor(self.cleaned_data['after'])
+
+    def clean_investment_after(self):
+        return _clean_cursor(self.cleaned_data['investment_after'])
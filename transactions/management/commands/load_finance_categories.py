@@ -1,5 +1,6 @@
 import csv
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from transactions.models import FinanceCategory
 
 class Command(BaseCommand):
@@ -12,12 +13,30 @@ class Command(BaseCommand):
         with open(options['csv_file'], 'r') as f:
             reader = csv.reader(f)
             next(reader)  # Skip the header row
-            for row in reader:
-                _, created = FinanceCategory.objects.get_or_create(
-                    primary=row[0],
-                    detailed=row[1],
-                    description=row[2],
-                    expense_account=None
-                )
-                if created:
-                    self.stdout.write(self.style.SUCCESS(f'Created finance category {row[1]}'))
\ No newline at end of file
+            # detailed is the unique key; primary and description come from Plaid
+            rows = {row[1]: (row[0], row[2]) for row in reader if row}
+
+        created, updated = [], []
+        with transaction.atomic():
+            existing = FinanceCategory.objects.in_bulk(list(rows), field_name='detailed')
+            for detailed, (primary, description) in rows.items():
+                category = existing.get(detailed)
+                if category is None:
+                    created.append(FinanceCategory(primary=primary, detailed=detailed, description=description))
+                elif (category.primary, category.description) != (primary, description):
+                    # expense_account mappings are ours, so they're left as they are
+                    category.primary = primary
+                    category.description = description
+                    updated.append(category)
+
+            FinanceCategory.objects.bulk_create(created)
+            FinanceCategory.objects.bulk_update(updated, ['primary', 'description'])
+
+        for category in created:
+            self.stdout.write(self.style.SUCCESS(f'Created finance category {category.detailed}'))
+        for category in updated:
+            self.stdout.write(f'Updated finance category {category.detailed}')
+        self.stdout.write(
+            f'{len(created)} created, {len(updated)} updated, '
+            f'{len(rows) - len(created) - len(updated)} unchanged'
+        )
@@ -140,6 +140,7 @@ class Command(AccountsCommand):
         # Get the Plaid configuration from the TOML file
         client_id = config["PLAID"]["client_id"]
         secret = config["PLAID"]["secret"]
+        host = config["PLAID"].get("host", Environment.Production)
 
         # Remove the Plaid configuration from the TOML file
         del config["PLAID"]
@@ -181,7 +182,7 @@ class Command(AccountsCommand):
                     account.save()
 
         configuration = Configuration(
-            host=Environment.Production,
+            host=host,
             api_key={
                 "clientId": client_id,
                 "secret": secret,
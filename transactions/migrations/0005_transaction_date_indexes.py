@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_account_transaction_file'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='plaidinvestmenttransaction',
+            index=models.Index(fields=['account', 'date'], name='plaidinvtxn_account_date'),
+        ),
+        migrations.AddIndex(
+            model_name='plaidtransaction',
+            index=models.Index(fields=['account', 'date', 'pending'], name='plaidtxn_account_date_pending'),
+        ),
+    ]
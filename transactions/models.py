@@ -68,6 +68,14 @@ class PlaidTransaction(models.Model):
     personal_finance_category = models.ForeignKey(FinanceCategory, on_delete=models.SET_NULL, null=True, default=None)
     personal_finance_confidence = models.CharField(max_length=10, choices=CONFIDENCE_CHOICES, default='UNKNOWN')
     pending = models.BooleanField()
+
+    class Meta:
+        indexes = [
+            # transaction_filter and update_beancount: one account's posted transactions by date.
+            # pending comes last since pending=False compiles to NOT pending, which SQLite
+            # can't use as an index prefix; it's still checked from the index.
+            models.Index(fields=['account', 'date', 'pending'], name='plaidtxn_account_date_pending'),
+        ]
     
     def __str__(self) -> str:
         return f'{self.name} - {self.merchant_name} - {self.date} - {self.amount}'
@@ -110,5 +118,11 @@ class PlaidInvestmentTransaction(models.Model):
     type = models.ForeignKey(PlaidInvestmentTransactionType, on_delete=models.CASCADE)
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # transaction_filter and update_beancount: one account's transactions by date
+            models.Index(fields=['account', 'date'], name='plaidinvtxn_account_date'),
+        ]
+
     def __str__(self) -> str:
         return f'{self.name} - {self.type} - {self.date} - {self.amount}'
\ No newline at end of file
@@ -10,31 +10,173 @@ from plaid.model.investments_transactions_get_request_options import (
 import datetime
 from datetime import date, timedelta
 
+from django.db.transaction import atomic
+
+from instrumentation import instrument_plaid_client
+
 from .models import PlaidItem, Account, FinanceCategory, PlaidTransaction, PlaidInvestmentTransaction, PlaidSecurity, PlaidInvestmentTransactionType
 
-def fetch_investments(client: plaid_api.PlaidApi, start_date=None, end_date=None):
+
+def is_rate_limit_error(e: ApiException) -> bool:
+    """Whether Plaid rejected a request for exceeding a rate limit (RATE_LIMIT_EXCEEDED)."""
+    return e.status == 429 or "RATE_LIMIT_EXCEEDED" in str(e.body or "")
+
+def _investment_pages(client: plaid_api.PlaidApi, access_token, start_date, end_date):
+    """Yield each /investments/transactions/get response until all transactions are fetched."""
+    request = InvestmentsTransactionsGetRequest(
+        access_token=access_token,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    response = client.investments_transactions_get(request)
+    yield response
+    fetched = len(response["investment_transactions"])
+
+    while fetched < response["total_investment_transactions"]:
+        request = InvestmentsTransactionsGetRequest(
+            access_token=access_token,
+            start_date=start_date,
+            end_date=end_date,
+            options=InvestmentsTransactionsGetRequestOptions(
+                offset=fetched
+            ),
+        )
+        response = client.investments_transactions_get(request)
+        if not response["investment_transactions"]:
+            break
+        yield response
+        fetched += len(response["investment_transactions"])
+
+
+def _securities_for(securities, plaid_securities):
+    """Bulk-create the page's securities missing from the security_id -> PlaidSecurity cache."""
+    missing = [security for security in plaid_securities if security["security_id"] not in securities]
+    if not missing:
+        return
+    PlaidSecurity.objects.bulk_create([
+        PlaidSecurity(
+            security_id=security["security_id"],
+            name=security["name"],
+            ticker_symbol=security["ticker_symbol"],
+            type=security["type"],
+            market_identifier_code=security["market_identifier_code"],
+            is_cash_equivalent=security["is_cash_equivalent"],
+            isin=security["isin"],
+            cusip=security["cusip"],
+        )
+        for security in missing
+    ], ignore_conflicts=True)
+    securities.update(
+        (security.security_id, security)
+        for security in PlaidSecurity.objects.filter(security_id__in=[security["security_id"] for security in missing])
+    )
+
+
+def _transaction_types_for(transaction_types, transactions):
+    """Bulk-create the page's (type, subtype) pairs missing from the transaction type cache."""
+    missing = {
+        (str(transaction["type"]), str(transaction["subtype"])) for transaction in transactions
+    } - transaction_types.keys()
+    if not missing:
+        return
+    PlaidInvestmentTransactionType.objects.bulk_create([
+        PlaidInvestmentTransactionType(type=type, subtype=subtype) for type, subtype in missing
+    ], ignore_conflicts=True)
+    transaction_types.update(
+        ((transaction_type.type, transaction_type.subtype), transaction_type)
+        for transaction_type in PlaidInvestmentTransactionType.objects.filter(type__in={type for type, _ in missing})
+    )
+
+
+# Everything but the key is refreshed when Plaid sends an investment transaction we already have
+_INVESTMENT_TRANSACTION_UPDATE_FIELDS = [
+    "date",
+    "name",
+    "quantity",
+    "amount",
+    "price",
+    "account",
+    "security",
+    "fees",
+    "cancel_transaction_id",
+    "type",
+]
+
+
+def _upsert_investment_transactions(transactions, accounts, securities, transaction_types):
+    """Insert or update one page of Plaid investment transactions in bulk."""
+    rows = {}
+    for transaction in transactions:
+        if transaction["security_id"] is None:
+            print(
+                "Skipping investment transaction {0} without a security".format(
+                    transaction["investment_transaction_id"]
+                )
+            )
+            continue
+        # Keyed by ID so a transaction repeated on a page is only written once
+        rows[transaction["investment_transaction_id"]] = PlaidInvestmentTransaction(
+            investment_transaction_id=transaction["investment_transaction_id"],
+            date=transaction["date"],
+            name=transaction["name"],
+            quantity=transaction["quantity"],
+            amount=transaction["amount"],
+            price=transaction["price"],
+            account=accounts[transaction["account_id"]],
+            security=securities[transaction["security_id"]],
+            fees=transaction["fees"],
+            cancel_transaction_id=transaction["cancel_transaction_id"],
+            type=transaction_types[(str(transaction["type"]), str(transaction["subtype"]))],
+        )
+    if not rows:
+        return []
+
+    return PlaidInvestmentTransaction.objects.bulk_create(
+        list(rows.values()),
+        update_conflicts=True,
+        unique_fields=["investment_transaction_id"],
+        update_fields=_INVESTMENT_TRANSACTION_UPDATE_FIELDS,
+    )
+
+
+def fetch_investments(client: plaid_api.PlaidApi, start_date=None, end_date=None, items=None, raise_rate_limits=False):
+    """Fetch investment transactions for items (default: all items).
+
+    Plaid errors are reported and the item skipped, except rate limits when
+    raise_rate_limits is set, so a caller can retry later. Requests are accounted
+    per item in the client's ApiStats (plaid_api_stats for an uninstrumented client).
+    """
+    client = instrument_plaid_client(client)
     new_transactions = []
-    for item in PlaidItem.objects.all():
+    # Securities and transaction types are shared by every item, so load them once
+    securities = {security.security_id: security for security in PlaidSecurity.objects.all()}
+    transaction_types = {
+        (transaction_type.type, transaction_type.subtype): transaction_type
+        for transaction_type in PlaidInvestmentTransactionType.objects.all()
+    }
+    for item in (PlaidItem.objects.all() if items is None else items):
         access_token = item.access_token
+        client.stats.register_item(access_token, item.item_id)
         if start_date is None:
             # If date not set, set to today minus 2 years
             start_date = date.today() - timedelta(days=365 * 2)
         if end_date is None:
             end_date = date.today()
 
-        request = InvestmentsTransactionsGetRequest(
-            access_token=access_token,
-            start_date=start_date,
-            end_date=end_date,
-        )
-
+        accounts = {}
         try:
-            response = client.investments_transactions_get(request)
-            investment_transactions = response["investment_transactions"]
-            securities = {
-                security["security_id"]: security for security in response["securities"]
-            }
+            for response in _investment_pages(client, access_token, start_date, end_date):
+                investment_transactions = response["investment_transactions"]
+                with atomic():
+                    _accounts_for(accounts, item, investment_transactions)
+                    _securities_for(securities, response["securities"])
+                    _transaction_types_for(transaction_types, investment_transactions)
+                    new_transactions.extend(_upsert_investment_transactions(
+                        investment_transactions, accounts, securities, transaction_types
+                    ))
         except ApiException as e:
+            if raise_rate_limits and is_rate_limit_error(e):
+                raise
             print(e)
             print(
                 "Error getting investment transactions for item {0}".format(
@@ -43,90 +185,141 @@ def fetch_investments(client: plaid_api.PlaidApi, start_date=None, end_date=None
             )
             continue
 
-        while len(investment_transactions) < response["total_investment_transactions"]:
-            request = InvestmentsTransactionsGetRequest(
-                access_token=access_token,
-                start_date=start_date,
-                end_date=end_date,
-                options=InvestmentsTransactionsGetRequestOptions(
-                    offset=len(investment_transactions)
-                ),
-            )
-            response = client.investments_transactions_get(request)            
-            securities |= {
-                security["security_id"]: security for security in response["securities"]
-            }
-            investment_transactions.extend(response["transactions"])
-
-        for transaction in investment_transactions:
-            # print(transaction)
-            account, created = Account.objects.get_or_create(
-                plaid_id=transaction["account_id"],
-                defaults={
-                    "name": "Unknown account found during Plaid sync!",
-                    "item": item,
-                },
-            )
-            if created:
-                account.save()
-
-            if transaction["security_id"] is not None:
-                plaid_security = securities.get(transaction["security_id"])
-                security, created = PlaidSecurity.objects.get_or_create(
-                    security_id=plaid_security["security_id"],                    
-                    defaults={
-                        "name": plaid_security["name"],                        
-                        "ticker_symbol": plaid_security["ticker_symbol"],
-                        "type": plaid_security["type"],
-                        "market_identifier_code": plaid_security["market_identifier_code"],
-                        "is_cash_equivalent": plaid_security["is_cash_equivalent"],
-                        "isin": plaid_security["isin"],
-                        "cusip": plaid_security["cusip"],
-                    },
-                )
-                
-                if created:
-                    security.save()
-            transaction_type, created = PlaidInvestmentTransactionType.objects.get_or_create(
-                type=transaction["type"],
-                subtype=transaction["subtype"],
+    return new_transactions
+
+
+def _categories_for(categories, transactions):
+    """Add the FinanceCategory for every category on a page to the detailed -> category cache.
+
+    Only categories not already cached are queried, and any Plaid added since the
+    categories were loaded are created in one bulk insert.
+    """
+    wanted = {}
+    for transaction in transactions:
+        finance_category = transaction["personal_finance_category"]
+        if finance_category is not None and finance_category["detailed"] not in categories:
+            wanted[finance_category["detailed"]] = finance_category["primary"]
+    if not wanted:
+        return
+
+    categories.update(
+        (category.detailed, category) for category in FinanceCategory.objects.filter(detailed__in=wanted)
+    )
+    missing = [detailed for detailed in wanted if detailed not in categories]
+    if missing:
+        # Uh oh! Plaid added a new category...
+        FinanceCategory.objects.bulk_create([
+            FinanceCategory(
+                detailed=detailed,
+                primary=wanted[detailed],
+                description="Unknown (Plaid added a new category!)",
             )
-            
-            if created:
-                transaction_type.save()
-                
-            new_transaction, created = PlaidInvestmentTransaction.objects.get_or_create(
-                investment_transaction_id=transaction["investment_transaction_id"],
-                defaults={
-                    "date": transaction["date"],
-                    "name": transaction["name"],
-                    "quantity": transaction["quantity"],
-                    "amount": transaction["amount"],
-                    "price": transaction["price"],
-                    "account": account,
-                    "security": security,
-                    "fees": transaction["fees"],
-                    "cancel_transaction_id": transaction["cancel_transaction_id"],
-                    "type": transaction_type,
-                },
+            for detailed in missing
+        ], ignore_conflicts=True)
+        categories.update(
+            (category.detailed, category) for category in FinanceCategory.objects.filter(detailed__in=missing)
+        )
+
+
+def _accounts_for(accounts, item, transactions):
+    """Add the Account for every account on a page to the plaid_id -> account cache.
+
+    Accounts Plaid returns that we don't know about yet are created in one bulk insert.
+    """
+    wanted = {transaction["account_id"] for transaction in transactions} - accounts.keys()
+    if not wanted:
+        return
+
+    accounts.update((account.plaid_id, account) for account in Account.objects.filter(plaid_id__in=wanted))
+    missing = wanted - accounts.keys()
+    if missing:
+        Account.objects.bulk_create([
+            Account(
+                plaid_id=plaid_id,
+                name="Unknown account found during Plaid sync!",
+                item=item,
             )
-            
-            if created:
-                new_transaction.save()
-            new_transactions.append(new_transaction)            
+            for plaid_id in missing
+        ], ignore_conflicts=True)
+        accounts.update((account.plaid_id, account) for account in Account.objects.filter(plaid_id__in=missing))
+
+
+# Everything but the key is refreshed when Plaid sends a transaction we already have
+_TRANSACTION_UPDATE_FIELDS = [
+    "date",
+    "datetime",
+    "authorized_date",
+    "authorized_datetime",
+    "name",
+    "merchant_name",
+    "website",
+    "amount",
+    "check_number",
+    "account",
+    "personal_finance_category",
+    "personal_finance_confidence",
+    "pending",
+]
 
-    return new_transactions     
 
+def _upsert_transactions(transactions, accounts, categories):
+    """Insert or update one page of Plaid transactions with a single query."""
+    rows = {}
+    for transaction in transactions:
+        finance_category = transaction["personal_finance_category"]
+        category = None
+        confidence = "UNKNOWN"
+        if finance_category is not None:
+            category = categories[finance_category["detailed"]]
+            confidence = finance_category["confidence_level"] or "UNKNOWN"
 
-def fetch_transactions(client: plaid_api.PlaidApi):
+        # Keyed by ID so a transaction repeated on a page is only written once
+        rows[transaction["transaction_id"]] = PlaidTransaction(
+            transaction_id=transaction["transaction_id"],
+            date=transaction["date"],
+            datetime=transaction["datetime"],
+            authorized_date=transaction["authorized_date"],
+            authorized_datetime=transaction["authorized_datetime"],
+            name=transaction["name"],
+            merchant_name=transaction["merchant_name"],
+            website=transaction["website"],
+            amount=transaction["amount"],
+            check_number=transaction["check_number"],
+            account=accounts[transaction["account_id"]],
+            personal_finance_category=category,
+            personal_finance_confidence=confidence,
+            pending=transaction["pending"],
+        )
+    if not rows:
+        return []
+
+    return PlaidTransaction.objects.bulk_create(
+        list(rows.values()),
+        update_conflicts=True,
+        unique_fields=["transaction_id"],
+        update_fields=_TRANSACTION_UPDATE_FIELDS,
+    )
+
+
+def fetch_transactions(client: plaid_api.PlaidApi, items=None, raise_rate_limits=False):
+    """Sync transactions for items (default: all items) from each item's cursor.
+
+    Plaid errors are reported and the item skipped, except rate limits when
+    raise_rate_limits is set, so a caller can retry later. Requests are accounted
+    per item in the client's ApiStats (plaid_api_stats for an uninstrumented client).
+    """
+    client = instrument_plaid_client(client)
     new_transactions = []
     updated_accounts = set()
-    for item in PlaidItem.objects.all():
+    categories = {}
+    for item in (PlaidItem.objects.all() if items is None else items):
         print("About to update transactions for item {0}".format(item.item_id))
         access_token = item.access_token
+        client.stats.register_item(access_token, item.item_id)
         cursor = item.cursor
         if cursor is None:
             cursor = ""
+        accounts = {}
         has_more = True
         try:
             while has_more:
@@ -142,67 +335,20 @@ def fetch_transactions(client: plaid_api.PlaidApi):
                 # Update cursor to the next cursor
                 cursor = response["next_cursor"]
 
-                for transaction in transactions:
-                    #print(transaction)                
-                        
-                    if transaction["personal_finance_category"] is not None:
-                        category, created = FinanceCategory.objects.get_or_create(
-                            detailed=transaction["personal_finance_category"]["detailed"],
-                            defaults={
-                                "primary": transaction["personal_finance_category"][
-                                    "primary"
-                                ],
-                                "description": "Unknown (Plaid added a new category!)",
-                            },
-                        )
-                        if created:
-                            # Uh oh! Plaid added a new category...
-                            category.save()
-
-                        confidence = transaction["personal_finance_category"][
-                            "confidence_level"
-                        ]
-
-                    account, created = Account.objects.get_or_create(
-                        plaid_id=transaction["account_id"],
-                        defaults={
-                            "name": "Unknown account found during Plaid sync!",
-                            "item": item,
-                        },
-                    )
-                    updated_accounts.add(account)
-                    if created:
-                        account.save()
-                        
-                    new_transaction, created = PlaidTransaction.objects.get_or_create(
-                        transaction_id=transaction["transaction_id"],
-                        defaults={
-                            "date": transaction["date"],
-                            "datetime": transaction["datetime"],
-                            "authorized_date": transaction["authorized_date"],
-                            "authorized_datetime": transaction["authorized_datetime"],
-                            "name": transaction["name"],
-                            "merchant_name": transaction["merchant_name"],
-                            "website": transaction["website"],
-                            "amount": transaction["amount"],
-                            "check_number": transaction["check_number"],                    
-                            "account": account,
-                            "personal_finance_category": category,
-                            "personal_finance_confidence": confidence,
-                            "pending": transaction["pending"],
-                        }
-                    )
-                    new_transactions.append(new_transaction)
-                    new_transaction.save()
-
-                # Save the cursor for the next time we sync
-                item.cursor = cursor                    
-                item.save()
-                for account in updated_accounts:
-                    account.last_updated = datetime.datetime.now()
-                    account.save()
+                # Store the page and its cursor together, so a failed page is fetched again
+                with atomic():
+                    _categories_for(categories, transactions)
+                    _accounts_for(accounts, item, transactions)
+                    new_transactions.extend(_upsert_transactions(transactions, accounts, categories))
+                    updated_accounts.update(transaction["account_id"] for transaction in transactions)
+
+                    # Save the cursor for the next time we sync
+                    item.cursor = cursor
+                    item.save(update_fields=["cursor"])
                 print("No more transactions to sync for item {0}".format(item.item_id))
         except ApiException as e:
+            if raise_rate_limits and is_rate_limit_error(e):
+                raise
             print(e)
             print(
                 "Error getting transactions for item {0}".format(
@@ -210,5 +356,7 @@ def fetch_transactions(client: plaid_api.PlaidApi):
                 )
             )
             continue
+
+    if updated_accounts:
+        Account.objects.filter(plaid_id__in=updated_accounts).update(last_updated=datetime.datetime.now())
     return new_transactions
-           
\ No newline at end of file
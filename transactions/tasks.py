@@ -1,14 +1,42 @@
-from celery import shared_task
-from .plaid_fetch import fetch_investments, fetch_transactions
+from celery import chord, shared_task
+from celery.utils.time import get_exponential_backoff_interval
+from django.core.cache import cache
+from instrumentation import ApiStats, InstrumentedPlaidApi
+from .models import PlaidItem
+from .plaid_fetch import fetch_investments, fetch_transactions, is_rate_limit_error
 from .config import load_config_file
 
 import plaid
 from plaid.api import plaid_api
 from plaid.configuration import Configuration, Environment
 from plaid.api_client import ApiClient
+from plaid.exceptions import ApiException
 
-@shared_task
-def fetch_data():
+# Syncs run one task per item and product, so one slow institution doesn't hold up the rest
+FETCHERS = {
+    "transactions": fetch_transactions,
+    "investments": fetch_investments,
+}
+
+# A lock older than this is assumed to belong to a worker that died mid-sync
+ITEM_LOCK_SECONDS = 30 * 60
+
+# A sync whose item is busy syncing its other product waits this long between tries,
+# for up to the lock's lifetime (these tries count towards the task's retries)
+ITEM_BUSY_SECONDS = 60
+ITEM_BUSY_RETRIES = ITEM_LOCK_SECONDS // ITEM_BUSY_SECONDS
+
+# Rate-limited syncs are retried with exponential backoff (in seconds), with jitter
+RATE_LIMIT_RETRIES = 5
+RETRY_BACKOFF = 30
+RETRY_BACKOFF_MAX = 600
+
+
+class PlaidRateLimited(Exception):
+    """Plaid rate-limited a sync; the task is retried with exponential backoff."""
+
+
+def _plaid_client() -> plaid_api.PlaidApi:
     config = load_config_file()
     # Get the Plaid configuration from the TOML file
     client_id = config["PLAID"]["client_id"]
@@ -16,7 +44,7 @@ def fetch_data():
 
 
     configuration = Configuration(
-        host=Environment.Production,
+        host=config["PLAID"].get("host", Environment.Production),
         api_key={
             "clientId": client_id,
             "secret": secret,
@@ -24,9 +52,84 @@ def fetch_data():
     )
 
     api_client = ApiClient(configuration)
-    client = plaid_api.PlaidApi(api_client)
-    
-    new_transactions = fetch_transactions(client)
-    print(f"fetched {new_transactions.length()} transactions")
-    new_investment_transactions = fetch_investments(client)
-    print(f"fetched {new_investment_transactions.length()} investment transactions")
+    return plaid_api.PlaidApi(api_client)
+
+
+def _lock_key(item_id):
+    return f"plaid-sync:{item_id}"
+
+
+@shared_task(bind=True, max_retries=RATE_LIMIT_RETRIES)
+def sync_item(self, item_id, product):
+    """Sync one product ("transactions" or "investments") for one Plaid item.
+
+    Holds a per-item lock in the Django cache (which must be shared by all workers),
+    so an item never syncs twice at once: a sync of the same product that is already
+    running is skipped, and one of the item's other product is waited for.
+    A sync that still fails after its retries returns its error in the result
+    instead of raising, so one bad item doesn't fail the chord and lose the summary.
+    """
+    lock_key = _lock_key(item_id)
+    holder = f"{product}:{self.request.id}"
+    if not cache.add(lock_key, holder, ITEM_LOCK_SECONDS):
+        running = (cache.get(lock_key) or "").split(":", 1)[0]
+        if running and running != product and self.request.retries < ITEM_BUSY_RETRIES:
+            print(f"{running} sync for item {item_id} is running, retrying {product} in {ITEM_BUSY_SECONDS}s")
+            raise self.retry(countdown=ITEM_BUSY_SECONDS, max_retries=ITEM_BUSY_RETRIES)
+        print(f"{product} sync for item {item_id} can't start while a {running or 'previous'} sync holds its lock, skipping")
+        return {"item_id": item_id, "product": product, "count": 0, "skipped": True}
+
+    client = None
+    try:
+        client = InstrumentedPlaidApi(_plaid_client(), ApiStats())
+        items = PlaidItem.objects.filter(item_id=item_id)
+        new_transactions = FETCHERS[product](client, items=items, raise_rate_limits=True)
+    except ApiException as e:
+        if is_rate_limit_error(e) and self.request.retries < self.max_retries:
+            countdown = get_exponential_backoff_interval(RETRY_BACKOFF, self.request.retries, RETRY_BACKOFF_MAX, full_jitter=True)
+            raise self.retry(exc=PlaidRateLimited(f"Plaid rate limit syncing {product} for item {item_id}"),
+                             countdown=countdown) from e
+        error = e
+    except Exception as e:
+        error = e
+    else:
+        error = None
+    finally:
+        if cache.get(lock_key) == holder:
+            cache.delete(lock_key)
+        print(f"{product} sync for item {item_id}, attempt {self.request.retries + 1}:")
+        if client is not None:
+            for line in client.stats.summary_lines():
+                print(line)
+
+    if error is not None:
+        print(f"{product} sync for item {item_id} failed: {error!r}")
+        return {"item_id": item_id, "product": product, "count": 0, "skipped": False, "error": str(error)}
+    return {"item_id": item_id, "product": product, "count": len(new_transactions), "skipped": False}
+
+
+@shared_task
+def summarize_sync(results):
+    """Chord callback: total the per-item sync results by product."""
+    totals = {product: 0 for product in FETCHERS}
+    for result in results:
+        totals[result["product"]] += result["count"]
+        if result.get("error"):
+            print(f"{result['product']} sync for item {result['item_id']} failed: {result['error']}")
+    print(f"fetched {totals['transactions']} transactions")
+    print(f"fetched {totals['investments']} investment transactions")
+    return totals
+
+
+@shared_task
+def fetch_data():
+    """Sync every item's transactions and investments in parallel, then total the counts."""
+    header = [
+        sync_item.s(item_id, product)
+        for item_id in PlaidItem.objects.values_list("item_id", flat=True)
+        for product in FETCHERS
+    ]
+    if not header:
+        print("No Plaid items to sync")
+        return None
+    return chord(header)(summarize_sync.s()).id
@@ -1,3 +1,565 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from datetime import date
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from beancount.core import data
+from plaid.exceptions import ApiException
+from celery.exceptions import Retry
+from beancount.core import account as beancount_account
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from instrumentation import ApiStats, InstrumentedPlaidApi
+
+from .models import (
+    Account,
+    FinanceCategory,
+    PlaidInvestmentTransaction,
+    PlaidInvestmentTransactionType,
+    PlaidItem,
+    PlaidSecurity,
+    PlaidTransaction,
+)
+from .plaid_fetch import fetch_investments, fetch_transactions
+from . import tasks, views
+
+
+def plaid_transaction(transaction_id, account_id="acc1", detailed="FOOD_AND_DRINK_COFFEE", **overrides):
+    transaction = {
+        "transaction_id": transaction_id,
+        "account_id": account_id,
+        "date": date(2024, 1, 15),
+        "datetime": None,
+        "authorized_date": None,
+        "authorized_datetime": None,
+        "name": "STARBUCKS",
+        "merchant_name": "Starbucks",
+        "website": None,
+        "amount": Decimal("5.00"),
+        "check_number": None,
+        "pending": False,
+        "personal_finance_category": {
+            "primary": "FOOD_AND_DRINK",
+            "detailed": detailed,
+            "confidence_level": "VERY_HIGH",
+        },
+    }
+    transaction.update(overrides)
+    return transaction
+
+
+def plaid_security(security_id):
+    return {
+        "security_id": security_id,
+        "name": f"Fund {security_id}",
+        "ticker_symbol": security_id.upper(),
+        "type": "mutual fund",
+        "market_identifier_code": None,
+        "is_cash_equivalent": False,
+        "isin": None,
+        "cusip": None,
+    }
+
+
+def plaid_investment_transaction(transaction_id, security_id="vtsax", type="buy", subtype="buy", **overrides):
+    transaction = {
+        "investment_transaction_id": transaction_id,
+        "account_id": "acc1",
+        "security_id": security_id,
+        "date": date(2024, 1, 15),
+        "name": "BUY FUND",
+        "quantity": Decimal("1.5"),
+        "amount": Decimal("150.00"),
+        "price": Decimal("100.00"),
+        "fees": None,
+        "cancel_transaction_id": None,
+        "type": type,
+        "subtype": subtype,
+    }
+    transaction.update(overrides)
+    return transaction
+
+
+class FakeSyncClient:
+    """Serves /transactions/sync pages in order, like the Plaid client."""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+
+    def transactions_sync(self, request):
+        transactions = self.pages.pop(0)
+        return {
+            "added": transactions,
+            "has_more": bool(self.pages),
+            "next_cursor": f"cursor-{len(self.pages)}",
+        }
+
+
+class FetchTransactionsTests(TestCase):
+    def setUp(self):
+        self.item = PlaidItem.objects.create(item_id="item1", access_token="token")
+        self.account = Account.objects.create(plaid_id="acc1", name="Checking", item=self.item)
+        FinanceCategory.objects.create(primary="FOOD_AND_DRINK", detailed="FOOD_AND_DRINK_COFFEE", description="Coffee")
+
+    def test_page_is_stored_with_a_constant_number_of_queries(self):
+        # Small enough that SQLite doesn't split the insert to stay under its variable limit
+        page = [plaid_transaction(f"txn{i}") for i in range(50)]
+        # items, savepoint, categories, accounts, upsert, cursor, release, last_updated
+        with self.assertNumQueries(8):
+            fetch_transactions(FakeSyncClient([page]))
+
+        self.assertEqual(PlaidTransaction.objects.count(), 50)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.cursor, "cursor-0")
+        self.account.refresh_from_db()
+        self.assertIsNotNone(self.account.last_updated)
+
+    def test_existing_transactions_are_updated(self):
+        fetch_transactions(FakeSyncClient([[plaid_transaction("txn1", pending=True)]]))
+        fetch_transactions(FakeSyncClient([[plaid_transaction("txn1", pending=False, amount=Decimal("6.00"))]]))
+
+        transaction = PlaidTransaction.objects.get(transaction_id="txn1")
+        self.assertFalse(transaction.pending)
+        self.assertEqual(transaction.amount, Decimal("6.00"))
+        self.assertEqual(PlaidTransaction.objects.count(), 1)
+
+    def test_unknown_categories_and_accounts_are_created(self):
+        fetch_transactions(FakeSyncClient([
+            [plaid_transaction("txn1", account_id="acc2", detailed="FOOD_AND_DRINK_NEW")],
+            [plaid_transaction("txn2", personal_finance_category=None)],
+        ]))
+
+        first = PlaidTransaction.objects.get(transaction_id="txn1")
+        self.assertEqual(first.account.plaid_id, "acc2")
+        self.assertEqual(first.account.item, self.item)
+        self.assertEqual(first.personal_finance_category.description, "Unknown (Plaid added a new category!)")
+        second = PlaidTransaction.objects.get(transaction_id="txn2")
+        self.assertIsNone(second.personal_finance_category)
+        self.assertEqual(second.personal_finance_confidence, "UNKNOWN")
+
+    def test_requests_are_accounted_per_item(self):
+        stats = ApiStats()
+        fetch_transactions(InstrumentedPlaidApi(FakeSyncClient([[plaid_transaction("txn1")], []]), stats))
+
+        self.assertEqual(stats.endpoints["transactions_sync"].requests, 2)
+        self.assertEqual(stats.items["item1"].requests, 2)
+
+
+class FakeInvestmentsClient:
+    """Serves /investments/transactions/get pages by offset, like the Plaid client."""
+
+    def __init__(self, pages, securities):
+        self.pages = pages
+        self.securities = securities
+        self.requests = 0
+
+    def investments_transactions_get(self, request):
+        offset = request.options.offset if "options" in request else 0
+        transactions = [transaction for page in self.pages for transaction in page]
+        page = next(page for page in self.pages if transactions.index(page[0]) == offset)
+        self.requests += 1
+        return {
+            "investment_transactions": page,
+            "securities": self.securities,
+            "total_investment_transactions": len(transactions),
+        }
+
+
+class FetchInvestmentsTests(TestCase):
+    def setUp(self):
+        self.item = PlaidItem.objects.create(item_id="item1", access_token="token")
+        self.account = Account.objects.create(plaid_id="acc1", name="Brokerage", item=self.item)
+
+    def test_pages_are_stored_with_a_constant_number_of_queries(self):
+        pages = [
+            [plaid_investment_transaction(f"inv{i}", security_id=f"fund{i % 3}") for i in range(40)],
+            [plaid_investment_transaction(f"inv{i}", type="cash", subtype="dividend") for i in range(40, 80)],
+        ]
+        client = FakeInvestmentsClient(pages, [plaid_security(f"fund{i}") for i in range(3)] + [plaid_security("vtsax")])
+        # securities, types, items, then per page: savepoint, accounts (first page only),
+        # securities insert + select (first page only), types insert + select, upsert, release
+        with self.assertNumQueries(3 + 8 + 5):
+            fetch_investments(client, date(2024, 1, 1), date(2024, 12, 31))
+
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(PlaidInvestmentTransaction.objects.count(), 80)
+        self.assertEqual(PlaidSecurity.objects.count(), 4)
+        self.assertEqual(PlaidInvestmentTransactionType.objects.count(), 2)
+        dividend = PlaidInvestmentTransaction.objects.get(investment_transaction_id="inv50")
+        self.assertEqual((dividend.type.type, dividend.type.subtype), ("cash", "dividend"))
+        self.assertEqual(dividend.security.security_id, "vtsax")
+
+    def test_existing_investment_transactions_are_updated(self):
+        client = FakeInvestmentsClient([[plaid_investment_transaction("inv1")]], [plaid_security("vtsax")])
+        fetch_investments(client, date(2024, 1, 1), date(2024, 12, 31))
+        client = FakeInvestmentsClient(
+            [[plaid_investment_transaction("inv1", quantity=Decimal("2"))]], [plaid_security("vtsax")]
+        )
+        # Everything is cached or known now: only the upsert touches the database
+        with self.assertNumQueries(3 + 4):
+            fetch_investments(client, date(2024, 1, 1), date(2024, 12, 31))
+
+        self.assertEqual(PlaidInvestmentTransaction.objects.get().quantity, Decimal("2"))
+
+    def test_transactions_without_a_security_are_skipped(self):
+        client = FakeInvestmentsClient(
+            [[plaid_investment_transaction("inv1", security_id=None), plaid_investment_transaction("inv2")]],
+            [plaid_security("vtsax")],
+        )
+        fetch_investments(client, date(2024, 1, 1), date(2024, 12, 31))
+
+        self.assertEqual(
+            list(PlaidInvestmentTransaction.objects.values_list("investment_transaction_id", flat=True)), ["inv2"]
+        )
+
+
+class BeancountViewTests(TestCase):
+    def setUp(self):
+        item = PlaidItem.objects.create(item_id="item1", access_token="token")
+        coffee = FinanceCategory.objects.create(
+            primary="FOOD_AND_DRINK", detailed="FOOD_AND_DRINK_COFFEE", description="Coffee",
+            expense_account="Expenses:Coffee",
+        )
+        security = PlaidSecurity.objects.create(
+            security_id="vtsax", name="Fund", ticker_symbol="VTSAX", type="etf", is_cash_equivalent=False
+        )
+        buy = PlaidInvestmentTransactionType.objects.create(type="buy", subtype="buy")
+        self.accounts = []
+        for i in range(3):
+            account = Account.objects.create(
+                plaid_id=f"acc{i}", name=f"Account {i}", item=item,
+                beancount_name=f"Assets:Bank:Account{i}", transaction_file=f"accounts/Account{i}.beancount",
+            )
+            self.accounts.append(account)
+            PlaidTransaction.objects.bulk_create([
+                PlaidTransaction(
+                    transaction_id=f"txn{i}-{j}", account=account, date=date(2024, 2, 1 + j), name="STARBUCKS",
+                    amount=Decimal("5.00"), pending=False, personal_finance_category=coffee,
+                )
+                for j in range(20)
+            ])
+            PlaidInvestmentTransaction.objects.bulk_create([
+                PlaidInvestmentTransaction(
+                    investment_transaction_id=f"inv{i}-{j}", account=account, date=date(2024, 2, 1 + j),
+                    name="BUY", quantity=Decimal("1"), price=Decimal("100"), amount=Decimal("100"),
+                    security=security, type=buy,
+                )
+                for j in range(10)
+            ])
+
+    def test_output_beancount_renders_with_one_query_per_model(self):
+        request = RequestFactory().post("/output_beancount/", {
+            "transactions": list(PlaidTransaction.objects.values_list("id", flat=True)),
+            "investment-transactions": list(PlaidInvestmentTransaction.objects.values_list("id", flat=True)),
+        })
+        with self.assertNumQueries(2):
+            response = views.output_beancount(request)
+
+        content = response.content.decode()
+        self.assertEqual(content.count("Expenses:Coffee"), 60)
+        self.assertEqual(content.count("Assets:Bank:Account1:VTSAX"), 10)
+
+    def test_update_beancount_renders_with_constant_queries_per_account(self):
+        existing = [
+            data.Transaction(
+                meta={"plaid_transaction_id": f"old{i}"}, date=date(2024, 1, 31), flag="*", payee=None,
+                narration="old", tags=set(), links=set(),
+                postings=[data.Posting(account.beancount_name, None, None, None, None, None)],
+            )
+            for i, account in enumerate(self.accounts)
+        ]
+        with mock.patch.object(views, "_load_beancount_entries", return_value=existing), \
+                mock.patch.object(views, "_get_beancount_accounts_directory", return_value="/ledger"), \
+                mock.patch.object(views, "AccountFileWriter") as writer:
+            writer.return_value.flush.return_value = []
+            # accounts, then transactions and investment transactions for each account
+            with self.assertNumQueries(1 + 2 * len(self.accounts)):
+                views.update_beancount(RequestFactory().get("/update_beancount/"))
+
+        written = writer.return_value.add.call_args_list
+        self.assertEqual(len(written), 3 * 30)
+        self.assertEqual(written[0].args[0], "/ledger/accounts/Account0.beancount")
+
+    def test_output_beancount_streams_plain_text(self):
+        ids = {
+            "transactions": list(PlaidTransaction.objects.values_list("id", flat=True)),
+            "investment-transactions": list(PlaidInvestmentTransaction.objects.values_list("id", flat=True)),
+        }
+        rendered = views.output_beancount(RequestFactory().post("/output_beancount/", ids)).content.decode()
+
+        response = views.output_beancount(RequestFactory().post("/output_beancount/?stream=1", ids))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/plain; charset=utf-8")
+        with self.assertNumQueries(2):
+            content = b"".join(response.streaming_content).decode()
+        self.assertEqual(content.count("plaid_transaction_id"), 90)
+        # Same entries as the page, in the same order
+        first, last = content.split("\n\n")[0], content.split("\n\n")[-2]
+        self.assertIn(first, rendered)
+        self.assertIn(last, rendered)
+
+    def test_update_beancount_streams_and_writes_each_account(self):
+        existing = [
+            data.Transaction(
+                meta={"plaid_transaction_id": f"old{i}"}, date=date(2024, 1, 31), flag="*", payee=None,
+                narration="old", tags=set(), links=set(),
+                postings=[data.Posting(account.beancount_name, None, None, None, None, None)],
+            )
+            for i, account in enumerate(self.accounts)
+        ]
+        with mock.patch.object(views, "_load_beancount_entries", return_value=existing), \
+                mock.patch.object(views, "_get_beancount_accounts_directory", return_value="/ledger"), \
+                mock.patch.object(views, "AccountFileWriter") as writer:
+            writer.return_value.flush.return_value = []
+            response = views.update_beancount(RequestFactory().get("/update_beancount/?stream=1"))
+            # Nothing runs until the response is consumed
+            writer.return_value.add.assert_not_called()
+            content = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(content.count("plaid_transaction_id"), 90)
+        self.assertEqual(writer.return_value.add.call_count, 90)
+        self.assertEqual(writer.return_value.flush.call_count, len(self.accounts))
+
+
+class NewestPlaidDatesTests(SimpleTestCase):
+    def entry(self, day, accounts, plaid=True):
+        return data.Transaction(
+            meta={"plaid_transaction_id": f"txn-{day}"} if plaid else {}, date=date(2024, 1, day), flag="*",
+            payee=None, narration="", tags=set(), links=set(),
+            postings=[data.Posting(account, None, None, None, None, None) for account in accounts],
+        )
+
+    def test_matches_parent_matcher_scan(self):
+        entries = [
+            self.entry(1, ["Assets:Bank:Checking", "Expenses:Food"]),
+            self.entry(5, ["Assets:Bank:Checking:Sub", "Expenses:Food"]),
+            self.entry(9, ["Assets:Bank:CheckingOld", "Expenses:Food"]),
+            self.entry(12, ["Assets:Bank:Checking"], plaid=False),
+            self.entry(3, ["Assets:Broker", "Assets:Broker:Cash"]),
+            self.entry(7, ["Liabilities:Card", "Expenses:Food"]),
+        ]
+        names = ["Assets:Bank:Checking", "Assets:Bank", "Assets:Broker", "Assets:Broker:Cash", "Assets:Savings"]
+
+        expected = {}
+        for name in names:
+            matcher = beancount_account.parent_matcher(name)
+            dates = [
+                entry.date for entry in entries
+                if "plaid_transaction_id" in entry.meta and any(matcher(posting.account) for posting in entry.postings)
+            ]
+            if dates:
+                expected[name] = max(dates)
+
+        self.assertEqual(views._newest_plaid_dates(entries, names), expected)
+        self.assertEqual(expected["Assets:Bank:Checking"], date(2024, 1, 5))
+        self.assertEqual(expected["Assets:Bank"], date(2024, 1, 9))
+        self.assertNotIn("Assets:Savings", expected)
+
+
+class TransactionFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        item = PlaidItem.objects.create(item_id="item1", access_token="token")
+        self.account = Account.objects.create(plaid_id="acc1", name="Checking", item=item)
+        # Several transactions share each date, so pages have to break ties by id
+        PlaidTransaction.objects.bulk_create([
+            PlaidTransaction(
+                transaction_id=f"txn{i}", account=self.account, date=date(2024, 1, 1 + i // 4), name=f"T{i}",
+                amount=Decimal("1.00"), pending=i == 7,
+            )
+            for i in range(25)
+        ])
+
+    def get_json(self, **params):
+        response = views.transaction_filter_json(
+            RequestFactory().get("/transaction_filter.json", {"account": self.account.pk, **params}))
+        return response.status_code, json.loads(response.content)
+
+    def test_json_pages_through_every_transaction_once(self):
+        seen = []
+        after = None
+        pages = 0
+        while True:
+            status, page = self.get_json(page_size=10, **({"after": after} if after else {}))
+            self.assertEqual(status, 200)
+            seen.extend(transaction["transaction_id"] for transaction in page["transactions"])
+            self.assertEqual(page["transaction_count"], 24)
+            pages += 1
+            after = page["next_after"]
+            if after is None:
+                break
+
+        self.assertEqual(pages, 3)
+        expected = list(
+            PlaidTransaction.objects.filter(pending=False).order_by("date", "id").values_list("transaction_id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_counts_are_cached_per_filter(self):
+        with self.assertNumQueries(5):
+            status, page = self.get_json(page_size=10)
+        # Later pages of the same filter skip the counts: account, transaction page, investment page
+        with self.assertNumQueries(3):
+            self.get_json(page_size=10, after=page["next_after"])
+        with self.assertNumQueries(5):
+            self.get_json(page_size=10, start_date="2024-01-03")
+
+    def test_invalid_cursor_is_rejected(self):
+        status, body = self.get_json(after="yesterday")
+        self.assertEqual(status, 400)
+        self.assertIn("after", body["errors"])
+
+    def test_page_links_keep_the_filter(self):
+        response = views.transaction_filter(
+            RequestFactory().post("/transaction_filter/", {"account": self.account.pk, "page_size": 5}))
+        content = response.content.decode()
+        self.assertIn("Showing 5 of about 24 transactions.", content)
+        self.assertIn("after=2024-01-02%3A", content)
+        self.assertIn("page_size=5", content)
+
+
+class RateLimitedSyncClient(FakeSyncClient):
+    """Rate-limits the first few requests, then serves pages."""
+
+    def __init__(self, pages, rate_limited_requests):
+        super().__init__(pages)
+        self.rate_limited_requests = rate_limited_requests
+        self.requests = 0
+
+    def transactions_sync(self, request):
+        self.requests += 1
+        if self.requests <= self.rate_limited_requests:
+            raise ApiException(status=429, reason="Too Many Requests")
+        return super().transactions_sync(request)
+
+
+class SyncTaskTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.item = PlaidItem.objects.create(item_id="item1", access_token="token")
+        Account.objects.create(plaid_id="acc1", name="Checking", item=self.item)
+        FinanceCategory.objects.create(primary="FOOD_AND_DRINK", detailed="FOOD_AND_DRINK_COFFEE", description="Coffee")
+
+    def test_sync_item_retries_rate_limits(self):
+        client = RateLimitedSyncClient([[plaid_transaction("txn1"), plaid_transaction("txn2")]], rate_limited_requests=2)
+        with mock.patch.object(tasks, "_plaid_client", return_value=client):
+            result = tasks.sync_item.apply(args=("item1", "transactions")).get()
+
+        self.assertEqual(result, {"item_id": "item1", "product": "transactions", "count": 2, "skipped": False})
+        self.assertEqual(client.requests, 3)
+        self.assertIsNone(cache.get(tasks._lock_key("item1")))
+
+    def test_sync_item_returns_the_error_once_retries_run_out(self):
+        client = RateLimitedSyncClient([[plaid_transaction("txn1")]], rate_limited_requests=100)
+        with mock.patch.object(tasks, "_plaid_client", return_value=client):
+            result = tasks.sync_item.apply(args=("item1", "transactions")).get()
+
+        self.assertEqual(result["count"], 0)
+        self.assertIn("Too Many Requests", result["error"])
+        self.assertEqual(client.requests, tasks.RATE_LIMIT_RETRIES + 1)
+        self.assertIsNone(cache.get(tasks._lock_key("item1")))
+
+    def test_one_failing_item_does_not_lose_the_summary(self):
+        PlaidItem.objects.create(item_id="item2", access_token="token2")
+        Account.objects.create(plaid_id="acc2", name="Savings", item=PlaidItem.objects.get(item_id="item2"))
+        healthy = FakeSyncClient([[plaid_transaction("txn1"), plaid_transaction("txn2")]])
+        # Not a Plaid error, so fetch_transactions doesn't report and skip it
+        failing = mock.Mock(transactions_sync=mock.Mock(side_effect=ConnectionError("connection reset")))
+
+        results = []
+        for item_id, client in (("item1", healthy), ("item2", failing)):
+            with mock.patch.object(tasks, "_plaid_client", return_value=client):
+                results.append(tasks.sync_item.apply(args=(item_id, "transactions")).get())
+
+        self.assertEqual(results[1]["error"], "connection reset")
+        self.assertEqual(tasks.summarize_sync(results), {"transactions": 2, "investments": 0})
+
+    def test_sync_item_skips_an_item_that_is_already_syncing(self):
+        cache.add(tasks._lock_key("item1"), "transactions:other-task")
+        with mock.patch.object(tasks, "_plaid_client") as client:
+            result = tasks.sync_item.apply(args=("item1", "transactions")).get()
+
+        self.assertTrue(result["skipped"])
+        client.assert_not_called()
+        # The other task's lock is left alone
+        self.assertEqual(cache.get(tasks._lock_key("item1")), "transactions:other-task")
+
+    def test_sync_item_waits_for_the_items_other_product(self):
+        cache.add(tasks._lock_key("item1"), "investments:other-task")
+        with mock.patch.object(tasks, "_plaid_client") as client, \
+                mock.patch.object(tasks.sync_item, "retry", side_effect=Retry()) as retry:
+            result = tasks.sync_item.apply(args=("item1", "transactions"))
+
+        self.assertIsInstance(result.result, Retry)
+        retry.assert_called_once_with(countdown=tasks.ITEM_BUSY_SECONDS, max_retries=tasks.ITEM_BUSY_RETRIES)
+        client.assert_not_called()
+        self.assertEqual(cache.get(tasks._lock_key("item1")), "investments:other-task")
+
+    def test_fetch_data_fans_out_per_item_and_product(self):
+        PlaidItem.objects.create(item_id="item2", access_token="token2")
+        with mock.patch.object(tasks, "chord") as chord:
+            tasks.fetch_data.apply().get()
+
+        header = chord.call_args.args[0]
+        self.assertEqual(
+            sorted(tuple(signature.args) for signature in header),
+            [("item1", "investments"), ("item1", "transactions"), ("item2", "investments"), ("item2", "transactions")],
+        )
+        chord.return_value.assert_called_once_with(tasks.summarize_sync.s())
+
+    def test_summarize_sync_totals_by_product(self):
+        totals = tasks.summarize_sync([
+            {"item_id": "item1", "product": "transactions", "count": 3, "skipped": False},
+            {"item_id": "item2", "product": "transactions", "count": 2, "skipped": False},
+            {"item_id": "item1", "product": "investments", "count": 4, "skipped": False},
+        ])
+        self.assertEqual(totals, {"transactions": 5, "investments": 4})
+
+
+class LoadFinanceCategoriesTests(TestCase):
+    def write_csv(self, rows):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w") as f:
+            f.write("PRIMARY,DETAILED,DESCRIPTION\n")
+            f.writelines(f'{primary},{detailed},"{description}"\n' for primary, detailed, description in rows)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def load(self, path):
+        out = io.StringIO()
+        call_command("load_finance_categories", path, stdout=out)
+        return out.getvalue()
+
+    def test_reload_is_idempotent_and_keeps_expense_accounts(self):
+        rows = [("PRIMARY_" + str(i // 10), f"DETAILED_{i}", f"Category {i}") for i in range(120)]
+        path = self.write_csv(rows)
+        self.load(path)
+        FinanceCategory.objects.filter(detailed="DETAILED_1").update(expense_account="Expenses:Food")
+
+        # select, savepoint, release: nothing to create or update
+        with self.assertNumQueries(3):
+            output = self.load(path)
+        self.assertIn("0 created, 0 updated, 120 unchanged", output)
+        self.assertEqual(FinanceCategory.objects.count(), 120)
+        self.assertEqual(FinanceCategory.objects.get(detailed="DETAILED_1").expense_account, "Expenses:Food")
+
+    def test_new_and_changed_rows_are_applied_in_bulk(self):
+        self.load(self.write_csv([("FOOD", "FOOD_COFFEE", "Coffee"), ("FOOD", "FOOD_TEA", "Tea")]))
+        path = self.write_csv([
+            ("FOOD", "FOOD_COFFEE", "Coffee shops"),
+            ("FOOD", "FOOD_TEA", "Tea"),
+            ("FOOD", "FOOD_JUICE", "Juice"),
+        ])
+
+        # select, savepoint, insert, update, release
+        with self.assertNumQueries(5):
+            output = self.load(path)
+
+        self.assertIn("1 created, 1 updated, 1 unchanged", output)
+        self.assertEqual(FinanceCategory.objects.get(detailed="FOOD_COFFEE").description, "Coffee shops")
+        self.assertTrue(FinanceCategory.objects.filter(detailed="FOOD_JUICE").exists())
@@ -6,6 +6,7 @@ urlpatterns = [
     path("load_configuration/", views.load_configuration, name="load_configuration"),
     path("update_transactions/", views.update_transactions, name="update_transactions"),
     path('transaction_filter/', views.transaction_filter, name='transaction_filter'),
+    path('transaction_filter.json', views.transaction_filter_json, name='transaction_filter_json'),
     path('output_beancount/', views.output_beancount, name='output_beancount'),
     path('update_beancount/', views.update_beancount, name='update_beancount'),
 ]
\ No newline at end of file
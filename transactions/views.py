@@ -1,15 +1,20 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from urllib.parse import urlencode
 from beancount import loader, core
 import plaid
 from plaid.api import plaid_api
 from plaid.configuration import Configuration, Environment
 from plaid.api_client import ApiClient
 
+from instrumentation import ApiStats, InstrumentedPlaidApi
 from .models import PlaidItem, Account, FinanceCategory, PlaidTransaction, PlaidInvestmentTransaction, PlaidSecurity, PlaidInvestmentTransactionType
 from .forms import TransactionFilterForm
 from .beancount_renderer import BeancountRenderer
+from .beancount_writer import AccountFileWriter
 from .plaid_fetch import fetch_investments, fetch_transactions
 from .config import load_config_file
 
@@ -185,7 +190,7 @@ def update_transactions(request):
         
         
         configuration = Configuration(
-            host=Environment.Production,
+            host=config["PLAID"].get("host", Environment.Production),
             api_key={
                 "clientId": client_id,
                 "secret": secret,
@@ -193,71 +198,276 @@ def update_transactions(request):
         )
 
         api_client = ApiClient(configuration)
-        client = plaid_api.PlaidApi(api_client)
+        client = InstrumentedPlaidApi(plaid_api.PlaidApi(api_client), ApiStats())
         
         new_transactions = fetch_transactions(client)
         new_investment_transactions = fetch_investments(client)
+        for line in client.stats.summary_lines():
+            print(line)
         return render(request, 'transactions.html', {'transactions': new_transactions, 'investment_transactions': new_investment_transactions})        
 
-def transaction_filter(request):
-    form = TransactionFilterForm(request.POST or None)
-    transactions = PlaidTransaction.objects.none()  # Empty QuerySet
-    investment_transactions = PlaidInvestmentTransaction.objects.none()  # Empty QuerySet
-    investment_transactions = PlaidInvestmentTransaction.objects.none()  # Empty QuerySet
+# Only the columns BeancountRenderer reads, with their foreign keys joined in, so
+# rendering a queryset takes one query instead of one per row per relation
+_RENDERED_TRANSACTION_FIELDS = [
+    'date', 'name', 'merchant_name', 'amount', 'currency', 'transaction_id',
+    'account__beancount_name',
+    'personal_finance_category__detailed', 'personal_finance_category__expense_account',
+]
+_RENDERED_INVESTMENT_TRANSACTION_FIELDS = [
+    'date', 'name', 'quantity', 'price', 'amount', 'investment_transaction_id',
+    'account__beancount_name',
+    'security__ticker_symbol',
+    'type__type', 'type__subtype',
+]
+
+
+# Rows fetched per database round trip when streaming beancount output
+STREAM_CHUNK_SIZE = 2000
+
+
+def _wants_stream(request):
+    """Beancount views stream plain text instead of rendering a page when asked with ?stream=1."""
+    return bool(request.GET.get('stream') or request.POST.get('stream'))
+
+
+def _transactions_for_rendering(transactions):
+    return transactions.select_related('account', 'personal_finance_category').only(*_RENDERED_TRANSACTION_FIELDS)
+
+
+def _investment_transactions_for_rendering(investment_transactions):
+    return investment_transactions.select_related('account', 'security', 'type').only(*_RENDERED_INVESTMENT_TRANSACTION_FIELDS)
+
+
+# Filtered counts are only estimates: they are cached for this long per filter
+FILTER_COUNT_CACHE_SECONDS = 300
+
+
+def _keyset_page(queryset, after, page_size):
+    """One page of queryset in (date, id) order, starting after the (date, id) cursor.
+
+    Unlike OFFSET, the cost doesn't grow with how far into the history the page is.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    queryset = queryset.order_by('date', 'id')
+    if after:
+        day, pk = after
+        queryset = queryset.filter(Q(date__gt=day) | Q(date=day, id__gt=pk))
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, f"{rows[-1].date.isoformat()}:{rows[-1].id}"
+
+
+def _cached_count(queryset, key):
+    return cache.get_or_set(key, queryset.count, FILTER_COUNT_CACHE_SECONDS)
+
+
+def _filter_transactions(form):
+    """Run a valid TransactionFilterForm: one page of each kind of transaction, plus counts."""
+    account = form.cleaned_data['account']
+    start_date = form.cleaned_data['start_date']
+    end_date = form.cleaned_data['end_date']
+    page_size = form.cleaned_data['page_size']
+
+    transactions = PlaidTransaction.objects.filter(account=account).filter(pending=False)
+    investment_transactions = PlaidInvestmentTransaction.objects.filter(account=account).select_related('security')
+
+    if start_date:
+        transactions = transactions.filter(date__gte=start_date)
+        investment_transactions = investment_transactions.filter(date__gte=start_date)
+    if end_date:
+        transactions = transactions.filter(date__lte=end_date)
+        investment_transactions = investment_transactions.filter(date__lte=end_date)
+
+    count_key = f"transaction_filter:{account.pk}:{start_date}:{end_date}"
+    transaction_page, next_after = _keyset_page(transactions, form.cleaned_data['after'], page_size)
+    investment_page, next_investment_after = _keyset_page(
+        investment_transactions, form.cleaned_data['investment_after'], page_size)
+    return {
+        'transactions': transaction_page,
+        'investment_transactions': investment_page,
+        'transaction_count': _cached_count(transactions, count_key + ":transactions"),
+        'investment_transaction_count': _cached_count(investment_transactions, count_key + ":investments"),
+        'next_after': next_after,
+        'next_investment_after': next_investment_after,
+    }
 
-    if form.is_valid():
-        account = form.cleaned_data['account']
-        start_date = form.cleaned_data['start_date']
-        end_date = form.cleaned_data['end_date']
 
-        transactions = PlaidTransaction.objects.filter(account=account).filter(pending=False)
-        investment_transactions = PlaidInvestmentTransaction.objects.filter(account=account)
+def _next_page_query(form, after, investment_after):
+    """Query string for the next page, keeping the filter and the other list's position."""
+    params = {
+        'account': form.cleaned_data['account'].pk,
+        'start_date': form.cleaned_data['start_date'] or '',
+        'end_date': form.cleaned_data['end_date'] or '',
+        'page_size': form.cleaned_data['page_size'],
+        'after': after or '',
+        'investment_after': investment_after or '',
+    }
+    return urlencode({key: value for key, value in params.items() if value != ''})
+
+
+def transaction_filter(request):
+    # Filters are POSTed from the form; next-page links use GET
+    form = TransactionFilterForm(request.POST or request.GET or None)
+    context = {
+        'form': form,
+        'transactions': PlaidTransaction.objects.none(),  # Empty QuerySet
+        'investment_transactions': PlaidInvestmentTransaction.objects.none(),  # Empty QuerySet
+    }
 
-        if start_date:
-            transactions = transactions.filter(date__gte=start_date)
-            investment_transactions = investment_transactions.filter(date__gte=start_date)            
-        if end_date:
-            transactions = transactions.filter(date__lte=end_date)
-            investment_transactions = investment_transactions.filter(date__lte=end_date)            
+    if form.is_valid():
+        context.update(_filter_transactions(form))
+        current_after = form.data.get('after')
+        current_investment_after = form.data.get('investment_after')
+        if context['next_after']:
+            context['next_transactions_query'] = _next_page_query(
+                form, context['next_after'], current_investment_after)
+        if context['next_investment_after']:
+            context['next_investment_transactions_query'] = _next_page_query(
+                form, current_after, context['next_investment_after'])
+
+    return render(request, 'transaction_filter.html', context)
+
+
+def transaction_filter_json(request):
+    """JSON variant of transaction_filter; pass next_after/next_investment_after back to page."""
+    form = TransactionFilterForm(request.GET or request.POST or None)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    result = _filter_transactions(form)
+    return JsonResponse({
+        'transactions': [
+            {
+                'id': transaction.id,
+                'transaction_id': transaction.transaction_id,
+                'date': transaction.date.isoformat(),
+                'name': transaction.name,
+                'merchant_name': transaction.merchant_name,
+                'amount': str(transaction.amount),
+                'currency': transaction.currency,
+            }
+            for transaction in result['transactions']
+        ],
+        'investment_transactions': [
+            {
+                'id': transaction.id,
+                'investment_transaction_id': transaction.investment_transaction_id,
+                'date': transaction.date.isoformat(),
+                'name': transaction.name,
+                'security': transaction.security.ticker_symbol or transaction.security.name,
+                'quantity': str(transaction.quantity),
+                'price': str(transaction.price),
+                'amount': str(transaction.amount),
+            }
+            for transaction in result['investment_transactions']
+        ],
+        'transaction_count': result['transaction_count'],
+        'investment_transaction_count': result['investment_transaction_count'],
+        'next_after': result['next_after'],
+        'next_investment_after': result['next_investment_after'],
+    })
 
-    return render(request, 'transaction_filter.html', {'form': form, 'transactions': transactions, 'investment_transactions': investment_transactions})    
 
 def output_beancount(request):
     # Take in a list of transactions from the form and output them in beancount format    
     transaction_ids = request.POST.getlist('transactions')        
     investment_transaction_ids = request.POST.getlist('investment-transactions')        
-    transactions = PlaidTransaction.objects.filter(id__in=transaction_ids).order_by('date')
-    investment_transactions = PlaidInvestmentTransaction.objects.filter(id__in=investment_transaction_ids).order_by('date')
+    transactions = _transactions_for_rendering(
+        PlaidTransaction.objects.filter(id__in=transaction_ids).order_by('date'))
+    investment_transactions = _investment_transactions_for_rendering(
+        PlaidInvestmentTransaction.objects.filter(id__in=investment_transaction_ids).order_by('date'))
+    if _wants_stream(request):
+        # Render rows as they're fetched, so output starts at once and memory stays bounded
+        renderer = BeancountRenderer(
+            transactions.iterator(chunk_size=STREAM_CHUNK_SIZE),
+            investment_transactions.iterator(chunk_size=STREAM_CHUNK_SIZE),
+        )
+        return StreamingHttpResponse(
+            (output + '\n' for output in renderer.iter_print()), content_type='text/plain; charset=utf-8'
+        )
     renderer = BeancountRenderer(transactions, investment_transactions)    
-    output = [ renderer._printer(transaction) for transaction in renderer.transactions + renderer.investment_transactions ]    
+    output = renderer.print()
     return render(request, 'output_beancount.html', {'transactions': output})
 
-def update_beancount(request):
-    # For each account, look up the most recent transaction with a plaid_transaction_id, 
-    # and output all transactions since then    
-    accounts = Account.objects.filter(transaction_file__isnull=False)
-    entries = _load_beancount_entries()
+def _newest_plaid_dates(entries, account_names):
+    """Map each of account_names to the date of its newest transaction with a plaid_transaction_id.
+
+    Makes one pass over the ledger. A posting counts for a configured account if it is
+    that account or one of its children, matching core.account.parent_matcher; each
+    posting account's configured parents are found once by walking up its components.
+    """
+    account_names = set(account_names)
+    configured_parents = {}
+    newest_dates = {}
+    for entry in entries:
+        if not isinstance(entry, core.data.Transaction) or "plaid_transaction_id" not in entry.meta:
+            continue
+        for posting in entry.postings:
+            parents = configured_parents.get(posting.account)
+            if parents is None:
+                components = posting.account.split(':')
+                parents = configured_parents[posting.account] = [
+                    name for name in (':'.join(components[:i]) for i in range(len(components), 0, -1))
+                    if name in account_names
+                ]
+            for name in parents:
+                if name not in newest_dates or entry.date > newest_dates[name]:
+                    newest_dates[name] = entry.date
+    return newest_dates
+
+
+def _account_updates(chunk_size=None):
+    """Yield (file name, rendered entries) for each account with a transaction file.
+
+    For each account, look up the most recent transaction with a plaid_transaction_id
+    and render all transactions since then. Entries are rendered lazily; with a
+    chunk_size, rows are also fetched from the database in chunks.
+    """
     import os
-    
-    os.chdir(_get_beancount_accounts_directory())    
+
+    accounts = list(Account.objects.filter(transaction_file__isnull=False))
+    entries = _load_beancount_entries()
+    newest_dates = _newest_plaid_dates(entries, [account.beancount_name for account in accounts if account.beancount_name])
+    accounts_directory = _get_beancount_accounts_directory()
     for account in accounts:        
-        file_name = account.transaction_file                
-        account_matcher = core.account.parent_matcher(account.beancount_name)
-        filtered_entries = [
-            entry for entry in entries 
-            if isinstance(entry, core.data.Transaction) and                 
-                "plaid_transaction_id" in entry.meta and
-                any(account_matcher(posting.account) for posting in entry.postings)
-            ]
-        if not filtered_entries:
+        file_name = os.path.join(accounts_directory, account.transaction_file)
+        most_recent_date = newest_dates.get(account.beancount_name)
+        if most_recent_date is None:
             print(f"No transactions found for {account}")
             continue
-        most_recent_transaction = max(filtered_entries, key=lambda x: x.date)
-        transactions = PlaidTransaction.objects.filter(account=account).filter(pending=False).filter(date__gt=most_recent_transaction.date).order_by('date')
-        investment_transactions = PlaidInvestmentTransaction.objects.filter(account=account).filter(date__gt=most_recent_transaction.date).order_by('date')
+        transactions = _transactions_for_rendering(
+            PlaidTransaction.objects.filter(account=account).filter(pending=False).filter(date__gt=most_recent_date).order_by('date'))
+        investment_transactions = _investment_transactions_for_rendering(
+            PlaidInvestmentTransaction.objects.filter(account=account).filter(date__gt=most_recent_date).order_by('date'))
+        if chunk_size:
+            transactions = transactions.iterator(chunk_size=chunk_size)
+            investment_transactions = investment_transactions.iterator(chunk_size=chunk_size)
         renderer = BeancountRenderer(transactions, investment_transactions)
-        output = [ renderer._printer(transaction) for transaction in renderer.transactions + renderer.investment_transactions ] 
-        with open(file_name, 'a') as f:
-            f.writelines(output)                    
-    
-    return render(request, 'output_beancount.html', {'transactions': []})
\ No newline at end of file
+        yield file_name, renderer.iter_print()
+
+
+def _stream_account_updates(writer):
+    for file_name, outputs in _account_updates(chunk_size=STREAM_CHUNK_SIZE):
+        for output in outputs:
+            writer.add(file_name, output + '\n')
+            yield output + '\n'
+        # Write each account once it's rendered, so only one account is held in memory
+        for result in writer.flush():
+            yield f"; Wrote {result.entries} transactions ({result.bytes} bytes) to {result.path}\n"
+
+
+def update_beancount(request):
+    writer = AccountFileWriter()
+    if _wants_stream(request):
+        return StreamingHttpResponse(_stream_account_updates(writer), content_type='text/plain; charset=utf-8')
+
+    for file_name, outputs in _account_updates():
+        for output in outputs:
+            writer.add(file_name, output + '\n')
+
+    for result in writer.flush():
+        print(f"Wrote {result.entries} transactions ({result.bytes} bytes) to {result.path}")
+
+    return render(request, 'output_beancount.html', {'transactions': []})